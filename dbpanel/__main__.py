@@ -1,3 +1,13 @@
-from .carspanel import main
+import sys
+import time
+# Time to the first rows shown is measured from here
+started = time.perf_counter()
 
-main()
+if '--headless' in sys.argv[1:]:
+    # Tk isn't imported without the panel
+    from .headless import main as headless_main
+    sys.exit(headless_main(sys.argv[1:]))
+
+from .carspanel import main  # noqa: E402
+
+main(started)
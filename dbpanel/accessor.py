@@ -0,0 +1,295 @@
+import itertools
+from abc import ABC, abstractmethod
+
+
+class ServerNotReadyError(Exception):
+    pass
+
+
+class ValidationError(Exception):
+    pass
+
+
+# Validated data of a car.
+# Attributes are kept in slots without __dict__ to save memory, and
+# to_dict() returns them as a dictionary.
+class Car:
+    __slots__ = ('id', 'brand', 'model', 'production_year', 'convertible')
+    YEAR_RANGE = (1940, 2030)
+    CONVERTIBLE = {'YES': True, 'TRUE': True, 'NO': False, 'FALSE': False}
+
+    def __init__(self, car_attr_value: dict):
+        self.id = self.validate_id(car_attr_value['id'])
+        self.brand = self.validate_brand(car_attr_value['brand'])
+        self.model = self.validate_model(car_attr_value['model'])
+        self.production_year = self.validate_year(
+                                    car_attr_value['production_year']
+                                    )
+        self.convertible = self.validate_convertible(
+                                    car_attr_value['convertible']
+                                    )
+
+    # Return the car data as a dictionary
+    def to_dict(self) -> dict:
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def validate_id(self, id:str):
+        if id.isdigit():
+            return int(id)
+        else:
+            raise ValidationError('id is not a number: ' + id)
+
+    def validate_brand(self, brand: str):
+        return brand
+
+    def validate_model(self, model: str):
+        return model
+
+    def validate_year(self, year: str):
+        if year.isdigit():
+            if self.YEAR_RANGE[0] <= int(year) <= self.YEAR_RANGE[1]:
+                return int(year)
+            else:
+                raise ValidationError('production_year out of range: '
+                                      + year)
+        else:
+            raise ValidationError('production_year is not a number: ' + year)
+
+    def validate_convertible(self, convertible: str):
+        value = self.CONVERTIBLE.get(convertible.upper())
+        if value is None:
+            raise ValidationError('convertible is not yes/no: '
+                                  + convertible)
+        return value
+
+    # Validate many cars at once without raising ValidationError.
+    # Each attribute is checked for all cars column by column.
+    # Return the list of Car for valid data, and the list of
+    # (index in cars_data, reason) for invalid data.
+    @classmethod
+    def validate_many(cls, cars_data: list):
+        ids = [str(car_data.get('id', '')) for car_data in cars_data]
+        years = [str(car_data.get('production_year', ''))
+                 for car_data in cars_data]
+        convertibles = [str(car_data.get('convertible', '')).upper()
+                        for car_data in cars_data]
+
+        ids = [int(id) if id.isdigit() else None for id in ids]
+        low, high = cls.YEAR_RANGE
+        years = [int(year) if year.isdigit() and low <= int(year) <= high
+                 else None for year in years]
+        convertibles = [cls.CONVERTIBLE.get(convertible)
+                        for convertible in convertibles]
+
+        cars = []
+        errors = []
+        for index, car_data in enumerate(cars_data):
+            if ids[index] is None:
+                errors.append((index, 'id is not a number'))
+            elif years[index] is None:
+                errors.append((index, 'production_year is not a number '
+                                      'in {}-{}'.format(low, high)))
+            elif convertibles[index] is None:
+                errors.append((index, 'convertible is not yes/no'))
+            else:
+                car = cls.__new__(cls)
+                car.id = ids[index]
+                car.brand = car_data.get('brand', '')
+                car.model = car_data.get('model', '')
+                car.production_year = years[index]
+                car.convertible = convertibles[index]
+                cars.append(car)
+
+        return cars, errors
+
+
+# Abstract class to define CRUD functions
+class CarDataAccessor(ABC):
+    # Number of rows retrieved at a time by iter_cars
+    PAGE_SIZE = 100
+    # Number of calls which can run at the same time in other threads
+    CONCURRENCY = 1
+    # True if the cars are in local files, so reading them is cheap
+    LOCAL = True
+
+    # Get cars list from json-server, and return list of dictionaries.
+    # If failed, return None.
+    @abstractmethod
+    def get_cars_list(self) -> list:
+        pass
+
+    # Yield cars one by one in id order, starting from the car next to
+    # start_after_id if it is given.
+    # Backends retrieve page_size rows at a time so that the whole table
+    # is never held in memory. This default falls back to get_cars_list.
+    def iter_cars(self, page_size=PAGE_SIZE, start_after_id=None):
+        cars = self.get_cars_list()
+        if cars is None:
+            return
+
+        for car in cars:
+            if start_after_id is None or int(car['id']) > int(start_after_id):
+                yield car
+
+    # Return the list of the attributes of the cars.
+    # They are the keys of the first car, or the attributes of Car if
+    # there are no cars.
+    def attributes(self) -> list:
+        car = next(self.iter_cars(page_size=1), None)
+        return list(Car.__slots__ if car is None else car.keys())
+
+    # Return the number of cars, or None if failed.
+    def count_cars(self) -> int:
+        cars = self.get_cars_list()
+        return None if cars is None else len(cars)
+
+    # Return the list of at most count cars from the start-th car
+    # (0 origin) in id order.
+    def get_cars_page(self, start: int, count: int) -> list:
+        return list(itertools.islice(self.iter_cars(), start, start + count))
+
+    # Return the id next to the largest id.
+    # Every backend gives the new id after the largest one and doesn't
+    # fill the gaps, so the id of a deleted car isn't given to a new car
+    # while a panel may still show the deleted one.
+    # Return None if failed.
+    def new_id(self) -> int:
+        last_id = 0
+        for car in self.iter_cars():
+            # rows are sorted by id
+            last_id = int(car['id'])
+
+        return last_id + 1
+
+    # Assign a new id to car_data and add it to the database.
+    # The assigned id is set to car_data['id'].
+    # Return True if succeeded else False.
+    def add_car_with_new_id(self, car_data: dict) -> bool:
+        car_id = self.new_id()
+        if car_id is None:
+            return False
+
+        car_data['id'] = car_id
+        return self.add_new_car(car_data)
+
+    # Return the list of cars which match all criteria in the json-server
+    # query style:
+    #   <attribute>=value          equals to value (case insensitive)
+    #   <attribute>_gte=value      greater than or equal to value
+    #   <attribute>_lte=value      less than or equal to value
+    #   q=text                     any attribute contains text
+    # sort is an attribute or a list of attributes, with '-' at the head
+    # for descending order. At most limit cars are returned.
+    # Return None if failed.
+    # This default reads all cars, and backends answer it with their
+    # queries or indexes.
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        cars = (car for car in self.iter_cars()
+                if self.match(car, criteria))
+        return self.sort_cars(cars, sort, limit)
+
+    # Return True if the car matches all criteria of find().
+    @staticmethod
+    def match(car: dict, criteria: dict) -> bool:
+        for key, expected in criteria.items():
+            if key == 'q':
+                text = str(expected).lower()
+                if not any(text in str(value).lower()
+                           for value in car.values()):
+                    return False
+            elif key.endswith('_gte'):
+                if CarDataAccessor.sort_value(car[key[:-4]]) \
+                        < CarDataAccessor.sort_value(expected):
+                    return False
+            elif key.endswith('_lte'):
+                if CarDataAccessor.sort_value(car[key[:-4]]) \
+                        > CarDataAccessor.sort_value(expected):
+                    return False
+            elif str(car[key]).lower() != str(expected).lower():
+                return False
+        return True
+
+    # Return the value to compare. Numbers in strings are compared
+    # as numbers, as the values in the csv file are strings.
+    @staticmethod
+    def sort_value(value):
+        if isinstance(value, str):
+            return int(value) if value.isdigit() else value.lower()
+        return value
+
+    # Return the list of cars sorted by the attributes in sort and
+    # cut by limit.
+    def sort_cars(self, cars, sort=None, limit=None) -> list:
+        if sort is None:
+            # cars are in id order
+            return list(itertools.islice(cars, limit))
+
+        cars = list(cars)
+        keys = [sort] if isinstance(sort, str) else sort
+        # Sort by the last key first, as the sort is stable
+        for key in reversed(keys):
+            attr = key.lstrip('-')
+            cars.sort(key=lambda car: self.sort_value(car[attr]),
+                      reverse=key.startswith('-'))
+        return cars[:limit]
+
+    # Add, update or delete the cars in cars_data.
+    # Return the list of True or False for each car.
+    # If all_or_nothing is True, nothing is changed when any car fails,
+    # and every result is False then.
+    def add_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.write_many(self.add_new_car, cars_data, all_or_nothing,
+                               undo=self.delete_a_car, keep_old=False)
+
+    def update_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.write_many(self.update_a_car, cars_data, all_or_nothing,
+                               undo=self.update_a_car, keep_old=True)
+
+    def delete_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.write_many(self.delete_a_car, cars_data, all_or_nothing,
+                               undo=self.add_new_car, keep_old=True)
+
+    # Call function for each car in cars_data.
+    # With all_or_nothing, the cars written before a failure are rolled
+    # back by calling undo with the car data, or with the car data before
+    # the change if keep_old is True.
+    # Backends override this or the *_many methods to write at once.
+    def write_many(self, function, cars_data, all_or_nothing,
+                   undo, keep_old) -> list:
+        results = []
+        undo_data = []
+        for car_data in cars_data:
+            if all_or_nothing and keep_old:
+                old_data = self.select_a_car(car_data)
+            else:
+                old_data = car_data
+
+            results.append(bool(function(car_data)))
+            if not all_or_nothing:
+                continue
+
+            if not results[-1]:
+                for data in reversed(undo_data):
+                    undo(data)
+                return [False] * len(cars_data)
+            undo_data.append(old_data)
+
+        return results
+
+    # Add car data to the json db.
+    # Return True if succeeded else False.
+    @abstractmethod
+    def add_new_car(self, car_data: dict) -> bool:
+        pass
+
+    # Delete a car data.
+    # Return True if succeeded else False.
+    @abstractmethod
+    def delete_a_car(self, car_data: dict) -> bool:
+        pass
+
+    # Return a car data retrieved from the given car_data.
+    # Return None if not found.
+    @abstractmethod
+    def select_a_car(self, car_data: dict) -> dict:
+        pass
@@ -23,29 +23,22 @@ class AddTab:
 
     # Return new id which is assigned to new data to be added.
     def new_id(self):
-        # Retrieve all data from the database
-        cars = self.panel.db.get_cars_list()
-
-        # Find the smallest id which isn't assigned to any rows.
-        ids = (int(car['id']) for car in cars)
-        num = 1
-        for id in ids:
-            # rows are sorted by id
-            if id != num:
-                # This num isn't assigned to a row
-                break
-            num += 1
-
-        self.logger.debug('id to be assigned: %d', num)
+        # The database finds the id without reading all rows
+        num = self.panel.db.new_id()
+        self.logger.debug('id to be assigned: %s', num)
         return str(num)
 
     # Insert the data which is entered in the Add tab to database
     def add_car(self):
         # Convert StringVar to string in the input fields
         car_data = self.panel.field_data_to_dict(self.car_data_fields)
-        car_data['id'] = self.new_id()
+        # The id is assigned by the database when the car is added,
+        # so that two panels never add cars with the same id.
+        # This temporary id is only for the validation.
+        car_data['id'] = '0'
         self.logger.debug('add car data: %s', car_data)
 
         # Give the data to the database function to add the data
         self.panel.submit_request(car_data,
-                                  self.panel.db.add_new_car)
+                                  self.panel.db.add_car_with_new_id,
+                                  'add')
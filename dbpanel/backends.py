@@ -0,0 +1,37 @@
+import importlib
+from collections.abc import Mapping
+
+
+# name -> (module, class) of the database classes which can be chosen by
+# name in the panel and the tools
+BACKENDS = {
+    'json': ('carsdb', 'CarsDB'),
+    'csv': ('carscsv', 'CarsCSV'),
+    'csv-mem': ('residentcsv', 'ResidentCarsCSV'),
+    'csv-log': ('journalcsv', 'JournaledCarsCSV'),
+    'sqlite': ('carssqlite', 'CarsSQLite'),
+    'csv-sharded': ('shardedcsv', 'ShardedCarsCSV'),
+    'binary': ('carsbinary', 'CarsBinary'),
+}
+
+
+# Mapping of the names to the database classes.
+# The module of a class is imported when the class is got, so choosing
+# csv doesn't import requests for json.
+class DBClasses(Mapping):
+    def __getitem__(self, name):
+        module_name, class_name = BACKENDS[name]
+        if __package__:
+            module = importlib.import_module('.' + module_name, __package__)
+        else:
+            module = importlib.import_module(module_name)
+        return getattr(module, class_name)
+
+    def __iter__(self):
+        return iter(BACKENDS)
+
+    def __len__(self):
+        return len(BACKENDS)
+
+
+DB_CLASSES = DBClasses()
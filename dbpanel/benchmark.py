@@ -0,0 +1,336 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+# __name__ is '__main__' also in python -m dbpanel.benchmark,
+# so the package tells if this is run as a script in dbpanel/
+if not __package__:
+    from backends import DB_CLASSES
+    from carscsv import CarsCSV
+    from accessor import CarDataAccessor
+    from server import CarsServer
+    from server import CarStore
+else:
+    from .backends import DB_CLASSES
+    from .carscsv import CarsCSV
+    from .accessor import CarDataAccessor
+    from .server import CarsServer
+    from .server import CarStore
+
+
+# Benchmark of the CarDataAccessor methods of the backends.
+#
+#   $ python -m dbpanel.benchmark --sizes 1000,100000 --output bench.json
+#   $ python -m dbpanel.benchmark --compare bench.json
+#
+# Each backend is filled with the same synthetic cars in a temporary
+# directory, and every method is called repeatedly. CarsDB talks to a
+# CarsServer of dbpanel.server in this process.
+# The results are saved as JSON, and --compare reports the operations
+# whose median latency got worse than the saved results.
+
+BRANDS = ('Alfa Romeo', 'Aston Martin', 'Chevrolet', 'Fiat', 'Ford',
+          'Honda', 'Isuzu', 'Maserati', 'Mazda', 'Mercedes Benz', 'Nissan',
+          'Porsche', 'Subaru', 'Toyota', 'Volkswagen', 'Volvo')
+MODELS = ('Spider', 'Coupe', 'Sedan', 'Wagon', 'Roadster', 'GT', 'EV',
+          'Cabrio', 'Hatch', 'Van')
+
+
+# Return count cars with ids from 1, generated from the seed.
+def make_cars(count, seed=0) -> list:
+    generator = random.Random(seed)
+    return [{'id': car_id,
+             'brand': generator.choice(BRANDS),
+             'model': '{} {}'.format(generator.choice(MODELS),
+                                     generator.randint(1, 99)),
+             'production_year': generator.randint(1940, 2030),
+             'convertible': generator.random() < 0.3}
+            for car_id in range(1, count + 1)]
+
+
+# Latencies of the calls of an operation
+class Measurement:
+    def __init__(self):
+        self.latencies = []
+        self.elapsed = 0.0
+        self.peak = 0
+
+    def percentile(self, percent) -> float:
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1,
+                    int(round(percent / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def summary(self) -> dict:
+        return {
+            'samples': len(self.latencies),
+            'p50_ms': round(self.percentile(50) * 1000, 4),
+            'p90_ms': round(self.percentile(90) * 1000, 4),
+            'p99_ms': round(self.percentile(99) * 1000, 4),
+            'max_ms': round(max(self.latencies) * 1000, 4),
+            'ops_per_sec': round(len(self.latencies) / self.elapsed, 1)
+            if self.elapsed else None,
+            'peak_kb': round(self.peak / 1024, 1),
+        }
+
+
+# Run the operations on one backend filled with size cars.
+class Benchmark:
+    REPEAT = 100
+    # Seconds spent at most on the calls of an operation
+    MAX_SECONDS = 5.0
+    BATCH_SIZE = 100
+    PAGE_SIZE = CarDataAccessor.PAGE_SIZE
+
+    def __init__(self, db_name, size, repeat=REPEAT, max_seconds=MAX_SECONDS,
+                 seed=0):
+        self.db_name = db_name
+        self.size = size
+        self.repeat = repeat
+        self.max_seconds = max_seconds
+        self.random = random.Random(seed)
+        self.cars = make_cars(size, seed)
+        self.server = None
+        self.db = None
+
+    def open(self):
+        if self.db_name == 'json':
+            self.server = CarsServer(('localhost', 0),
+                                     CarStore(self.cars)).start()
+            self.db = DB_CLASSES['json'](port=self.server.port)
+            return
+
+        # The csv backends read the file when they are made
+        CarsCSV().create(self.cars)
+        self.db = DB_CLASSES[self.db_name]()
+        if not isinstance(self.db, CarsCSV) and hasattr(self.db, 'create'):
+            self.db.create(self.cars)
+
+    def close(self):
+        if hasattr(self.db, 'close'):
+            self.db.close()
+        if self.server is not None:
+            self.server.close()
+
+    # Call function with the arguments made by make_args for each sample,
+    # until repeat calls are made or max_seconds is spent.
+    # The peak memory is traced in one more call, as tracing slows the
+    # calls down.
+    def measure(self, function, make_args, repeat=None) -> Measurement:
+        measurement = Measurement()
+        repeat = self.repeat if repeat is None else repeat
+        started = time.perf_counter()
+        for sample in range(repeat):
+            args = make_args()
+            before = time.perf_counter()
+            result = function(*args)
+            if hasattr(result, '__next__'):
+                # consume a stream
+                for row in result:
+                    pass
+            measurement.latencies.append(time.perf_counter() - before)
+            if time.perf_counter() - started > self.max_seconds:
+                break
+        measurement.elapsed = sum(measurement.latencies)
+
+        args = make_args()
+        tracemalloc.start()
+        try:
+            result = function(*args)
+            if hasattr(result, '__next__'):
+                for row in result:
+                    pass
+            measurement.peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return measurement
+
+    def random_car(self):
+        return dict(self.random.choice(self.cars))
+
+    # Return the summaries of the operations by their names.
+    # Cars added by an operation are deleted by the next one, so every
+    # operation sees about size cars.
+    def run(self) -> dict:
+        db = self.db
+        next_id = iter(range(self.size + 1, self.size * 10 + 10 ** 7))
+        added = []
+
+        def new_car():
+            car = self.random_car()
+            car['id'] = next(next_id)
+            added.append(car)
+            return (car,)
+
+        def new_batch():
+            batch = [new_car()[0] for count in range(self.BATCH_SIZE)]
+            return (batch,)
+
+        def added_batch():
+            batch = added[:self.BATCH_SIZE]
+            del added[:self.BATCH_SIZE]
+            return (batch,)
+
+        def updated_car():
+            car = self.random_car()
+            car['model'] = 'Updated'
+            return (car,)
+
+        operations = [
+            ('count_cars', db.count_cars, lambda: ()),
+            ('select_a_car', db.select_a_car,
+             lambda: ({'id': self.random_car()['id']},)),
+            ('get_cars_page', db.get_cars_page,
+             lambda: (self.random.randrange(self.size), self.PAGE_SIZE)),
+            ('find', self.find, lambda: ()),
+            ('new_id', db.new_id, lambda: ()),
+            ('iter_cars', db.iter_cars, lambda: ()),
+            ('get_cars_list', db.get_cars_list, lambda: ()),
+            ('add_new_car', db.add_new_car, new_car),
+            ('update_a_car', db.update_a_car, updated_car),
+            ('delete_a_car', db.delete_a_car, lambda: (added.pop(),)),
+            ('add_many', db.add_many, new_batch),
+            ('update_many', db.update_many,
+             lambda: ([updated_car()[0]
+                       for count in range(self.BATCH_SIZE)],)),
+            ('delete_many', db.delete_many, added_batch),
+        ]
+
+        results = {}
+        for name, function, make_args in operations:
+            if name in ('delete_a_car', 'delete_many'):
+                # delete only the cars added by the previous operation
+                repeat = len(added) // (self.BATCH_SIZE
+                                        if name == 'delete_many' else 1) - 1
+                measurement = self.measure(function, make_args,
+                                           max(repeat, 0))
+            else:
+                measurement = self.measure(function, make_args)
+            if measurement.latencies:
+                results[name] = measurement.summary()
+        return results
+
+    def find(self):
+        return self.db.find(limit=self.PAGE_SIZE,
+                            brand=self.random.choice(BRANDS),
+                            production_year_gte=1980)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Print the operations slower than threshold times the baseline.
+# Return the number of regressions.
+def compare(baseline, results, threshold) -> int:
+    regressions = 0
+    for db_name, sizes in results['results'].items():
+        for size, operations in sizes.items():
+            base = baseline['results'].get(db_name, {}).get(size, {})
+            for name, summary in operations.items():
+                if name not in base or not base[name]['p50_ms']:
+                    continue
+                ratio = summary['p50_ms'] / base[name]['p50_ms']
+                mark = ''
+                if ratio > threshold:
+                    mark = '  REGRESSION'
+                    regressions += 1
+                print('{:8} {:>8} {:14} {:10.3f} -> {:10.3f} ms  x{:.2f}{}'
+                      .format(db_name, size, name, base[name]['p50_ms'],
+                              summary['p50_ms'], ratio, mark))
+    return regressions
+
+
+def print_results(results):
+    print('{:8} {:>8} {:14} {:>7} {:>10} {:>10} {:>10} {:>11} {:>10}'.format(
+        'db', 'cars', 'operation', 'samples', 'p50 ms', 'p90 ms', 'p99 ms',
+        'ops/sec', 'peak KB'))
+    for db_name, sizes in results['results'].items():
+        for size, operations in sizes.items():
+            for name, summary in operations.items():
+                print('{:8} {:>8} {:14} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} '
+                      '{:>11} {:>10}'.format(
+                          db_name, size, name, summary['samples'],
+                          summary['p50_ms'], summary['p90_ms'],
+                          summary['p99_ms'], summary['ops_per_sec'],
+                          summary['peak_kb']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dbpanel.benchmark',
+        description='Measure the database operations of the backends.')
+    parser.add_argument('--db', action='append', choices=DB_CLASSES.keys(),
+                        help='backend to measure, all if not given')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='comma separated numbers of cars')
+    parser.add_argument('--repeat', type=int, default=Benchmark.REPEAT)
+    parser.add_argument('--max-seconds', type=float,
+                        default=Benchmark.MAX_SECONDS,
+                        help='time spent at most on an operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the results in this file')
+    parser.add_argument('--compare',
+                        help='compare the results with this file')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio of the median latency to report as '
+                             'a regression')
+    options = parser.parse_args(args)
+
+    # Logging every change would be measured too
+    logging.disable(logging.WARNING)
+    results = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': options.repeat,
+        'seed': options.seed,
+        'results': {},
+    }
+    sizes = [int(size) for size in options.sizes.split(',')]
+    working_dir = os.getcwd()
+    for db_name in options.db or DB_CLASSES.keys():
+        results['results'][db_name] = {}
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                # The backends keep their files in the current directory
+                os.chdir(directory)
+                benchmark = Benchmark(db_name, size, options.repeat,
+                                      options.max_seconds, options.seed)
+                try:
+                    benchmark.open()
+                    results['results'][db_name][str(size)] = benchmark.run()
+                finally:
+                    benchmark.close()
+                    os.chdir(working_dir)
+
+    print_results(results)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if options.compare:
+        with open(options.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        print('compared with', options.compare,
+              'commit', baseline.get('commit'))
+        if compare(baseline, results, options.threshold):
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
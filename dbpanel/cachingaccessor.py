@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict
+if __name__ == '__main__' or __name__ == 'cachingaccessor':
+    from accessor import CarDataAccessor
+    from logger import Logger
+else:
+    from .accessor import CarDataAccessor
+    from .logger import Logger
+
+
+# CarDataAccessor which wraps another one and keeps the results of reads
+# for ttl seconds.
+# Cars selected by id are kept up to max_cars in least recently used
+# order, and the results of list queries are kept up to max_queries.
+# Writes through this accessor remove the changed car and all list
+# queries from the cache. Call invalidate() after the database is
+# changed in other ways.
+class CachingAccessor(CarDataAccessor):
+    TTL = 5.0
+    MAX_CARS = 10000
+    MAX_QUERIES = 64
+
+    def __init__(self, db, ttl=TTL, max_cars=MAX_CARS,
+                 max_queries=MAX_QUERIES):
+        self.db = db
+        self.ttl = ttl
+        self.max_cars = max_cars
+        self.max_queries = max_queries
+        self.CONCURRENCY = db.CONCURRENCY
+        self.LOCAL = db.LOCAL
+        # id -> (expiry time, car data)
+        self.cars = OrderedDict()
+        # (method name, arguments) -> (expiry time, result)
+        self.queries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Incremented when the cache is cleared, so a result read before
+        # a write and returned after it isn't kept
+        self.generation = 0
+        # Calls come from the worker threads
+        self.lock = threading.Lock()
+        self.logger = Logger(__name__).get_logger()
+
+        # Expired lists are revalidated by the server if it can
+        if hasattr(db, 'enable_revalidation'):
+            db.enable_revalidation()
+
+    # Other attributes such as close() are the ones of the wrapped db
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    # Return the numbers of cache hits and misses
+    def cache_stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'cars': len(self.cars),
+                    'queries': len(self.queries),
+                    }
+
+    # Forget all cached results
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.cars.clear()
+            self.queries.clear()
+
+    # Return the cached value for key in cache, or call function and
+    # keep its result when it isn't cached or expired.
+    # The result isn't kept if the cache was cleared during the call, as
+    # it may have been read before the change.
+    def cached(self, cache, key, limit, function, *args):
+        now = time.monotonic()
+        with self.lock:
+            entry = cache.get(key)
+            if entry is not None and entry[0] > now:
+                cache.move_to_end(key)
+                self.hits += 1
+                return self.copy(entry[1])
+            self.misses += 1
+            generation = self.generation
+
+        value = function(*args)
+        if value is None:
+            # Failures are not cached
+            return None
+
+        with self.lock:
+            if generation != self.generation:
+                return self.copy(value)
+            cache[key] = (now + self.ttl, value)
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+        return self.copy(value)
+
+    # Callers may change the lists they get, such as the rows in ListTab
+    def copy(self, value):
+        return list(value) if isinstance(value, list) else value
+
+    def query(self, name, *args):
+        return self.cached(self.queries, (name, args), self.max_queries,
+                           getattr(self.db, name), *args)
+
+    # Remove the changed cars and the list queries from the cache
+    def changed(self, cars_data: list):
+        with self.lock:
+            self.generation += 1
+            for car_data in cars_data:
+                self.cars.pop(int(car_data['id']), None)
+            self.queries.clear()
+
+    def get_cars_list(self) -> list:
+        return self.query('get_cars_list')
+
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        # Streams are not cached
+        return self.db.iter_cars(page_size, start_after_id)
+
+    def attributes(self) -> list:
+        return self.db.attributes()
+
+    def count_cars(self) -> int:
+        return self.query('count_cars')
+
+    def get_cars_page(self, start: int, count: int) -> list:
+        return self.query('get_cars_page', start, count)
+
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        # The key must be hashable
+        if sort is not None and not isinstance(sort, str):
+            sort = tuple(sort)
+        key = ('find', (sort, limit, tuple(sorted(criteria.items()))))
+        return self.cached(self.queries, key, self.max_queries,
+                           lambda: self.db.find(sort, limit, **criteria))
+
+    def select_a_car(self, car_data: dict) -> dict:
+        return self.cached(self.cars, int(car_data['id']), self.max_cars,
+                           self.db.select_a_car, car_data)
+
+    def new_id(self) -> int:
+        return self.db.new_id()
+
+    def add_car_with_new_id(self, car_data: dict) -> bool:
+        succeeded = self.db.add_car_with_new_id(car_data)
+        self.changed([car_data])
+        return succeeded
+
+    def add_new_car(self, car_data: dict) -> bool:
+        succeeded = self.db.add_new_car(car_data)
+        self.changed([car_data])
+        return succeeded
+
+    def delete_a_car(self, car_data: dict) -> bool:
+        succeeded = self.db.delete_a_car(car_data)
+        self.changed([car_data])
+        return succeeded
+
+    def update_a_car(self, car_data: dict) -> bool:
+        succeeded = self.db.update_a_car(car_data)
+        self.changed([car_data])
+        return succeeded
+
+    def add_many(self, cars_data: list, all_or_nothing=False) -> list:
+        results = self.db.add_many(cars_data, all_or_nothing)
+        self.changed(cars_data)
+        return results
+
+    def update_many(self, cars_data: list, all_or_nothing=False) -> list:
+        results = self.db.update_many(cars_data, all_or_nothing)
+        self.changed(cars_data)
+        return results
+
+    def delete_many(self, cars_data: list, all_or_nothing=False) -> list:
+        results = self.db.delete_many(cars_data, all_or_nothing)
+        self.changed(cars_data)
+        return results
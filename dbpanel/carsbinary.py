@@ -0,0 +1,494 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+# __name__ is '__main__' also in python -m dbpanel.carsbinary,
+# so the package tells if this is run as a script in dbpanel/
+if not __package__:
+    from accessor import Car
+    from accessor import CarDataAccessor
+    from carscsv import CarsCSV
+    from logger import Logger
+else:
+    from .accessor import Car
+    from .accessor import CarDataAccessor
+    from .carscsv import CarsCSV
+    from .logger import Logger
+
+
+# Cars in fixed size records of a memory mapped file, where the record of
+# a car is found at the position of its id:
+#
+#   cars.bin          header, then the records of ids 1, 2, 3, ...
+#   cars.bin.live     bitmap of the ids in use, a bit per id
+#   cars.bin.strings  brands and models, a JSON string per line
+#
+# A record has the numbers of brand and model in the strings, which are
+# interned so that the same string is kept once, production_year and
+# convertible. The number of a string is the offset of its line, so it is
+# the same in every process which has the files open. A new string is
+# appended holding the lock of the strings file, after the strings
+# appended by the other processes are read. A cleared bit in the live bitmap is a tombstone; deleting
+# a car only clears its bit, and its record is overwritten when the id is
+# used again. So select, update and delete don't read other records.
+# The files grow by GROWTH ids at least when a larger id is added.
+class CarsBinary(CarDataAccessor):
+    FILENAME = 'cars.bin'
+    LIVE_SUFFIX = '.live'
+    STRINGS_SUFFIX = '.strings'
+    MAGIC = b'CARB'
+    # 2: the numbers of the strings are the offsets of their lines
+    VERSION = 2
+    # magic, version and size of a record
+    HEADER = struct.Struct('<4sHH8x')
+    # brand, model, production_year and convertible
+    RECORD = struct.Struct('<IIh?')
+    COLUMNS = ('id', 'brand', 'model', 'production_year', 'convertible')
+    # Number of ids the files grow by at least, a multiple of 8
+    GROWTH = 32 * 1024
+    # Bytes of the live bitmap checked at once
+    BLOCK = 4096
+
+    def __init__(self, filename=FILENAME):
+        self.filename = filename
+        self.logger = Logger(__name__).get_logger()
+        self.records_file = None
+        self.live_file = None
+        self.records = None
+        self.live = None
+        self.capacity = 0
+        self.count = 0
+        # number -> interned string, and string -> number of it
+        self.strings = {}
+        self.string_numbers = {}
+        # bytes of the strings file read into self.strings
+        self.strings_size = 0
+        self.open()
+
+    # Map the files, making them if they don't exist.
+    def open(self):
+        if not os.path.exists(self.filename):
+            with open(self.filename, 'wb') as records_file:
+                records_file.write(self.HEADER.pack(
+                    self.MAGIC, self.VERSION, self.RECORD.size))
+            with open(self.filename + self.LIVE_SUFFIX, 'wb'):
+                pass
+            with open(self.filename + self.STRINGS_SUFFIX, 'w'):
+                pass
+
+        self.records_file = open(self.filename, 'r+b')
+        magic, version, record_size = self.HEADER.unpack(
+            self.records_file.read(self.HEADER.size))
+        if (magic != self.MAGIC or version != self.VERSION
+                or record_size != self.RECORD.size):
+            self.records_file.close()
+            raise ValueError(self.filename + ' is not a cars binary file')
+
+        self.live_file = open(self.filename + self.LIVE_SUFFIX, 'r+b')
+        self.capacity = os.path.getsize(self.filename + self.LIVE_SUFFIX) * 8
+        if self.capacity == 0:
+            self.resize(self.GROWTH)
+        else:
+            self.map()
+        self.count = sum(self.popcount(self.live[start:start + self.BLOCK])
+                         for start in range(0, len(self.live), self.BLOCK))
+
+        self.strings = {}
+        self.string_numbers = {}
+        self.strings_size = 0
+        with open(self.filename + self.STRINGS_SUFFIX, 'rb') as strings_file:
+            self.read_strings(strings_file)
+
+    def map(self):
+        self.records = mmap.mmap(self.records_file.fileno(), 0)
+        self.live = mmap.mmap(self.live_file.fileno(), 0)
+
+    def unmap(self):
+        if self.records is not None:
+            self.records.close()
+            self.live.close()
+            self.records = None
+            self.live = None
+
+    # Extend the files to have room for capacity ids.
+    def resize(self, capacity):
+        self.unmap()
+        self.records_file.truncate(self.HEADER.size
+                                   + capacity * self.RECORD.size)
+        self.live_file.truncate(capacity // 8)
+        self.capacity = capacity
+        self.map()
+
+    # Make room for the id. Return True if succeeded else False.
+    def reserve(self, car_id: int) -> bool:
+        if car_id <= self.capacity:
+            return True
+
+        capacity = max(self.capacity * 2, car_id + self.GROWTH)
+        try:
+            self.resize(capacity - capacity % 8)
+            return True
+
+        except OSError as e:
+            self.logger.error('Resize %s failed. error: %s',
+                              self.filename, e.strerror)
+            self.map()
+            return False
+
+    def close(self):
+        self.unmap()
+        for file in (self.records_file, self.live_file):
+            if file is not None:
+                file.close()
+        self.records_file = None
+        self.live_file = None
+
+    @staticmethod
+    def popcount(data) -> int:
+        return bin(int.from_bytes(data, 'little')).count('1')
+
+    # Read the lines of the strings file after the ones already read.
+    # A line being written by another process is read next time.
+    def read_strings(self, strings_file):
+        strings_file.seek(self.strings_size)
+        data = strings_file.read()
+        end = data.rfind(b'\n') + 1
+        offset = self.strings_size
+        for line in data[:end].splitlines(keepends=True):
+            string = json.loads(line)
+            self.strings[offset] = string
+            self.string_numbers.setdefault(string, offset)
+            offset += len(line)
+        self.strings_size = offset
+
+    # Return the string of the number, which may be appended by another
+    # process after the strings file was read.
+    def string(self, number: int) -> str:
+        if number not in self.strings:
+            with open(self.filename + self.STRINGS_SUFFIX, 'rb') \
+                    as strings_file:
+                self.read_strings(strings_file)
+        return self.strings[number]
+
+    # Return the number of the string, appending it to the strings file
+    # if it is new.
+    def intern(self, string: str) -> int:
+        number = self.string_numbers.get(string)
+        if number is not None:
+            return number
+
+        with open(self.filename + self.STRINGS_SUFFIX, 'a+b') as strings_file:
+            if fcntl is not None:
+                fcntl.flock(strings_file.fileno(), fcntl.LOCK_EX)
+            else:
+                strings_file.seek(0)
+                msvcrt.locking(strings_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                # Another process may have appended it
+                self.read_strings(strings_file)
+                number = self.string_numbers.get(string)
+                if number is None:
+                    number = self.strings_size
+                    strings_file.write(json.dumps(string).encode() + b'\n')
+                    strings_file.flush()
+                    self.read_strings(strings_file)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(strings_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    strings_file.seek(0)
+                    msvcrt.locking(strings_file.fileno(), msvcrt.LK_UNLCK, 1)
+        return number
+
+    def is_live(self, car_id: int) -> bool:
+        index = car_id - 1
+        return (0 <= index < self.capacity
+                and self.live[index >> 3] & (1 << (index & 7)) != 0)
+
+    def set_live(self, car_id: int, live: bool):
+        index = car_id - 1
+        if live:
+            self.live[index >> 3] |= 1 << (index & 7)
+            self.count += 1
+        else:
+            self.live[index >> 3] &= ~(1 << (index & 7)) & 0xff
+            self.count -= 1
+
+    # Return the car data in the record of the id
+    def read(self, car_id: int) -> dict:
+        brand, model, year, convertible = self.RECORD.unpack_from(
+            self.records, self.HEADER.size + (car_id - 1) * self.RECORD.size)
+        return {'id': car_id,
+                'brand': self.string(brand),
+                'model': self.string(model),
+                'production_year': year,
+                'convertible': convertible}
+
+    # Write car_data to the record of its id, which must be reserved.
+    # Return True if succeeded else False.
+    def write(self, car_data: dict) -> bool:
+        try:
+            year = int(car_data['production_year'])
+        except (TypeError, ValueError):
+            year = None
+        if year is None or not -0x8000 <= year < 0x8000:
+            self.logger.error('car id: %s has invalid production_year: %s',
+                              str(car_data['id']),
+                              str(car_data['production_year']))
+            return False
+
+        convertible = Car.CONVERTIBLE.get(
+            str(car_data['convertible']).upper())
+        if convertible is None:
+            self.logger.error('car id: %s has invalid convertible: %s',
+                              str(car_data['id']),
+                              str(car_data['convertible']))
+            return False
+
+        # The strings are interned after the values are checked
+        self.RECORD.pack_into(
+            self.records,
+            self.HEADER.size + (int(car_data['id']) - 1) * self.RECORD.size,
+            self.intern(str(car_data['brand'])),
+            self.intern(str(car_data['model'])),
+            year, convertible)
+        return True
+
+    # Yield the ids in use from first_id in id order.
+    # Blocks of the bitmap with no ids in use are skipped at once.
+    def live_ids(self, first_id=1):
+        index = max(first_id - 1, 0)
+        while index < self.capacity:
+            start = index >> 3
+            block = self.live[start:start + self.BLOCK]
+            if block.count(0) == len(block):
+                index = (start + len(block)) * 8
+                continue
+
+            for offset, bits in enumerate(block):
+                if not bits:
+                    continue
+                base = (start + offset) * 8
+                for bit in range(8):
+                    if bits & (1 << bit) and base + bit >= index:
+                        yield base + bit + 1
+            index = (start + len(block)) * 8
+
+    # Newly create the files with the data given in cars parameter.
+    # Return True if succeeded else False.
+    def create(self, cars: list) -> bool:
+        self.close()
+        try:
+            for suffix in ('', self.LIVE_SUFFIX, self.STRINGS_SUFFIX):
+                if os.path.exists(self.filename + suffix):
+                    os.remove(self.filename + suffix)
+            self.open()
+
+        except OSError as e:
+            self.logger.error('Create %s failed. error: %s',
+                              self.filename, e.strerror)
+            return False
+
+        return all(self.add_many(cars))
+
+    def attributes(self) -> list:
+        return list(self.COLUMNS)
+
+    def get_cars_list(self) -> list:
+        return [self.read(car_id) for car_id in self.live_ids()]
+
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        first_id = 1 if start_after_id is None else int(start_after_id) + 1
+        for car_id in self.live_ids(first_id):
+            yield self.read(car_id)
+
+    def count_cars(self) -> int:
+        return self.count
+
+    # Skip the blocks of the bitmap before the page by counting their bits.
+    def get_cars_page(self, start: int, count: int) -> list:
+        first_id = 1
+        for offset in range(0, len(self.live), self.BLOCK):
+            ids = self.popcount(self.live[offset:offset + self.BLOCK])
+            if start < ids:
+                break
+            start -= ids
+            first_id = (offset + self.BLOCK) * 8 + 1
+
+        cars = []
+        for car_id in self.live_ids(first_id):
+            if start:
+                start -= 1
+                continue
+            if len(cars) == count:
+                break
+            cars.append(self.read(car_id))
+        return cars
+
+    # Return the id next to the largest id, the last set bit in the bitmap.
+    def new_id(self) -> int:
+        for end in range(len(self.live), 0, -self.BLOCK):
+            offset = max(end - self.BLOCK, 0)
+            block = self.live[offset:end].rstrip(b'\x00')
+            if block:
+                # the highest bit of the byte is the largest id in it
+                return (offset + len(block) - 1) * 8 \
+                    + block[-1].bit_length() + 1
+        return 1
+
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        if 'id' in criteria:
+            car_id = int(criteria['id'])
+            cars = [self.read(car_id)] if self.is_live(car_id) else []
+            return self.sort_cars((car for car in cars
+                                   if self.match(car, criteria)),
+                                  sort, limit)
+        return super().find(sort, limit, **criteria)
+
+    # Add, update or delete a car in its record.
+    # Return True if succeeded else False.
+    def add_new_car(self, car_data: dict) -> bool:
+        return self.add_many([car_data])[0]
+
+    def delete_a_car(self, car_data: dict) -> bool:
+        return self.delete_many([car_data])[0]
+
+    def update_a_car(self, car_data: dict) -> bool:
+        return self.update_many([car_data])[0]
+
+    # Retrieve a car data with the id of specified car data.
+    # Return None if not found else the dict type data of the car.
+    def select_a_car(self, car_data: dict) -> dict:
+        car_id = int(car_data['id'])
+        return self.read(car_id) if self.is_live(car_id) else None
+
+    def add_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('add', cars_data, all_or_nothing)
+
+    def update_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('update', cars_data, all_or_nothing)
+
+    def delete_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('delete', cars_data, all_or_nothing)
+
+    # operation is 'add', 'update' or 'delete'.
+    # With all_or_nothing, the ids are checked in the bitmap before any
+    # record is written.
+    # Return the list of True or False for each car.
+    def change_many(self, operation, cars_data, all_or_nothing) -> list:
+        if all_or_nothing and not all(self.check_many(operation, cars_data)):
+            return [False] * len(cars_data)
+
+        results = []
+        for car_data in cars_data:
+            car_id = self.to_id(car_data)
+            if car_id is None:
+                self.logger.error('car id: %s is not a number',
+                                  str(car_data.get('id')))
+                results.append(False)
+                continue
+
+            if operation == 'add':
+                succeeded = (car_id > 0 and not self.is_live(car_id)
+                             and self.reserve(car_id)
+                             and self.write(car_data))
+            elif not self.is_live(car_id):
+                succeeded = False
+            else:
+                succeeded = operation == 'delete' or self.write(car_data)
+
+            if not succeeded:
+                self.logger.error('car id: %d cannot %s', car_id, operation)
+            elif operation != 'update':
+                self.set_live(car_id, operation == 'add')
+            results.append(succeeded)
+
+        self.logger.info('%d of %d cars: %s', results.count(True),
+                         len(results), operation)
+        return results
+
+    # Return the id of the car data as int, or None if it isn't a number.
+    @staticmethod
+    def to_id(car_data: dict):
+        try:
+            return int(car_data['id'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    # Check the cars can be added, updated or deleted in order.
+    # Return the list of True or False for each car.
+    def check_many(self, operation, cars_data) -> list:
+        # ids added or deleted by the cars before
+        added = set()
+        deleted = set()
+        results = []
+        for car_data in cars_data:
+            car_id = self.to_id(car_data)
+            if car_id is None:
+                results.append(False)
+                continue
+
+            live = (car_id in added
+                    or car_id not in deleted and self.is_live(car_id))
+            if operation == 'add':
+                results.append(car_id > 0 and not live)
+                added.add(car_id)
+                deleted.discard(car_id)
+            else:
+                results.append(live)
+                if operation == 'delete':
+                    deleted.add(car_id)
+                    added.discard(car_id)
+        return results
+
+    # Replace the cars with the ones in the csv file.
+    # Return True if succeeded else False.
+    def import_csv(self, filename=CarsCSV.FILENAME) -> bool:
+        csv_db = CarsCSV()
+        csv_db.filename = filename
+        cars = csv_db.get_cars_list()
+        return cars is not None and self.create(cars)
+
+    # Write the cars to the csv file in the format of CarsCSV.
+    # Return True if succeeded else False.
+    def export_csv(self, filename=CarsCSV.FILENAME) -> bool:
+        csv_db = CarsCSV()
+        csv_db.filename = filename
+        # The header of an export with no cars
+        csv_db._header = list(self.COLUMNS)
+        return csv_db.create(self.get_cars_list())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dbpanel.carsbinary',
+        description='Convert the cars between csv and binary files.')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--import', dest='import_file', metavar='CSV',
+                       help='replace the cars with the csv file')
+    group.add_argument('--export', dest='export_file', metavar='CSV',
+                       help='write the cars to the csv file')
+    parser.add_argument('--file', default=CarsBinary.FILENAME)
+    options = parser.parse_args(args)
+
+    db = CarsBinary(options.file)
+    succeeded = True
+    if options.import_file:
+        succeeded = db.import_csv(options.import_file)
+    elif options.export_file:
+        succeeded = db.export_csv(options.export_file)
+    print(db.count_cars(), 'cars in', db.filename)
+    db.close()
+    return 0 if succeeded else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,31 +1,96 @@
+import bisect
+import contextlib
 import csv
+import io
+import mmap
+import os
+import struct
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
 if __name__ == '__main__' or __name__ == 'carscsv':
-    from carsdb import CarsDB
-    from carsdb import Car
-    from carsdb import CarDataAccessor
-    from carsdb import ServerNotReadyError
+    from accessor import Car
+    from accessor import CarDataAccessor
     from logger import Logger
 else:
-    from .carsdb import CarsDB
-    from .carsdb import Car
-    from .carsdb import CarDataAccessor
-    from .carsdb import ServerNotReadyError
+    from .accessor import Car
+    from .accessor import CarDataAccessor
     from .logger import Logger
 
 
 class CarsCSV(CarDataAccessor):
     FILENAME = 'cars.csv'
+    # Attributes find() looks up in the secondary indexes
+    INDEXED = ('brand', 'production_year')
+    # The id index is saved next to the csv file as
+    #   mtime, size and number of rows of the csv file,
+    #   ids and offsets of the rows in 64-bit integers
+    ID_INDEX_SUFFIX = '.idx'
+    ID_INDEX_HEADER = struct.Struct('<qqq')
+    # Files of this size or larger are parsed in chunks by worker
+    # processes in get_cars_list()
+    PARALLEL_THRESHOLD = 32 * 1024 * 1024
+    CHUNK_SIZE = 4 * 1024 * 1024
+    WORKERS = os.cpu_count() or 1
+    # Writes hold an exclusive lock of this file next to the csv file, so
+    # that panels in other processes don't write at the same time
+    LOCK_SUFFIX = '.lock'
 
     def __init__(self):
         self.filename = CarsCSV.FILENAME
         self._header = None
         self.logger = Logger(__name__).get_logger()
+        # Secondary indexes built by the first find(), and (mtime, size)
+        # of the file when they were built
+        self.indexes = None
+        self.index_stamp = None
+        # (stamp of the file, ids, offsets) of the id index
+        self.id_index = None
+        # The file lock is taken once by nested writes in this process
+        self.write_lock = threading.RLock()
+        self.lock_depth = 0
+        self.lock_file = None
+
+    # Hold the lock of the csv file, which is shared with other processes,
+    # in the with block.
+    @contextlib.contextmanager
+    def locked(self):
+        with self.write_lock:
+            if self.lock_depth == 0:
+                self.lock_file = open(self.filename + self.LOCK_SUFFIX, 'a+b')
+                if fcntl is not None:
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self.lock_file.seek(0)
+                    msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0:
+                    if fcntl is not None:
+                        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        self.lock_file.seek(0)
+                        msvcrt.locking(self.lock_file.fileno(),
+                                       msvcrt.LK_UNLCK, 1)
+                    self.lock_file.close()
+                    self.lock_file = None
 
     # Newly create the csv file with the data given in cars parameter.
     # Return True if succeeded else False.
     def create(self, cars: list) -> bool:
         # cars contains a list of dictionary
-        header = cars[0].keys()
+        # Only the header is written when no cars are given.
+        header = cars[0].keys() if cars else self.header
         try:
             with open(self.filename, 'w', newline='') as csvfile:
                 writer = csv.DictWriter(csvfile,
@@ -35,6 +100,8 @@ class CarsCSV(CarDataAccessor):
                 for car in sorted(cars, key=lambda car: int(car['id'])):
                     writer.writerow(car)
 
+            self.indexes = None
+            self.id_index = None
             return True
 
         except OSError as e:
@@ -58,9 +125,23 @@ class CarsCSV(CarDataAccessor):
                           self.filename)
         return None
 
+    # The header row is the attributes
+    def attributes(self) -> list:
+        return list(self.header)
+
     # Get cars list from the csv file, and return list of dictionaries.
     # If failed, return None.
     def get_cars_list(self) -> list:
+        if self.WORKERS > 1:
+            try:
+                size = os.path.getsize(self.filename)
+            except OSError:
+                size = 0
+            if size >= self.PARALLEL_THRESHOLD:
+                cars = self.get_cars_list_parallel()
+                if cars is not None:
+                    return cars
+
         try:
             with open(self.filename, 'r', newline='') as csvfile:
                 reader = csv.DictReader(csvfile, delimiter=',')
@@ -71,78 +152,605 @@ class CarsCSV(CarDataAccessor):
                               self.filename, e.strerror)
             return None
 
-    # Add car data to the csv file.
+    # Parse and validate the csv file in chunks of lines in worker
+    # processes. The rows are the same as csv.DictReader gives, in the order
+    # of the file, that is id order. Return None if failed.
+    def get_cars_list_parallel(self) -> list:
+        header = self.header
+        chunks = self.split_chunks()
+        if header is None or chunks is None:
+            return None
+
+        cars = []
+        malformed = 0
+        invalid = 0
+        try:
+            with ProcessPoolExecutor(max_workers=self.WORKERS) as executor:
+                for rows, bad_rows, bad_values in executor.map(
+                        read_chunk,
+                        *zip(*((self.filename, start, end, header)
+                               for start, end in chunks))):
+                    cars.extend(dict(zip(header, row))
+                                if type(row) is tuple else row
+                                for row in rows)
+                    malformed += bad_rows
+                    invalid += bad_values
+
+        except (OSError, BrokenProcessPool) as e:
+            self.logger.error('Parallel read of %s failed. error: %s',
+                              self.filename, e)
+            return None
+
+        if malformed:
+            self.logger.warning('%d rows in %s have not %d fields',
+                                malformed, self.filename, len(header))
+        if invalid:
+            self.logger.warning('%d rows in %s have invalid values',
+                                invalid, self.filename)
+        self.logger.debug('%d cars read from %s in %d chunks',
+                          len(cars), self.filename, len(chunks))
+        return cars
+
+    # Split the rows of the csv file into (start, end) byte ranges of about
+    # CHUNK_SIZE, which start at the beginning of a row.
+    # A newline in a quoted field is after an odd number of quotes, so it
+    # doesn't end a row. Return None if failed.
+    def split_chunks(self) -> list:
+        try:
+            with open(self.filename, 'rb') as csvfile, \
+                    mmap.mmap(csvfile.fileno(), 0,
+                              access=mmap.ACCESS_READ) as data:
+                size = len(data)
+                quoted = data.find(b'"') >= 0
+                # skip the header
+                start = data.find(b'\n') + 1 or size
+                chunks = []
+                # quotes counted from start up to position
+                quotes = 0
+                counted = start
+                while start < size:
+                    position = min(start + self.CHUNK_SIZE, size)
+                    while position < size:
+                        end = data.find(b'\n', position)
+                        if end < 0:
+                            position = size
+                            break
+                        if quoted:
+                            quotes += data[counted:end].count(b'"')
+                            counted = end
+                        if quotes % 2 == 0:
+                            position = end + 1
+                            break
+                        position = end + 1
+                    chunks.append((start, position))
+                    start = position
+                return chunks
+
+        except (OSError, ValueError) as e:
+            # mmap raises ValueError for an empty file
+            self.logger.error('Split %s failed. error: %s', self.filename, e)
+            return None
+
+    # Yield cars one by one reading the csv file lazily.
+    # The csv file is sorted by id, so rows up to start_after_id are skipped.
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        try:
+            with open(self.filename, 'r', newline='') as csvfile:
+                reader = csv.DictReader(csvfile, delimiter=',')
+                for car in reader:
+                    if (start_after_id is None
+                            or int(car['id']) > int(start_after_id)):
+                        yield car
+
+        except OSError as e:
+            self.logger.error('Get cars from %s failed. error: %s',
+                              self.filename, e.strerror)
+
+    # Return the number of rows in the csv file except the header,
+    # or None if failed.
+    # The rows are counted in the id index, and the file is parsed only
+    # when the index can't be built.
+    def count_cars(self) -> int:
+        index = self.load_id_index()
+        if index is not None:
+            return len(index[0])
+
+        try:
+            with open(self.filename, 'r', newline='') as csvfile:
+                rows = sum(1 for row in csv.reader(csvfile, delimiter=','))
+                return max(rows - 1, 0)
+
+        except OSError as e:
+            self.logger.error('Count cars in %s failed. error: %s',
+                              self.filename, e.strerror)
+            return None
+
+    # Read only the rows of the page at their offsets in the id index.
+    # The file is parsed from the head only when the index can't be built.
+    def get_cars_page(self, start: int, count: int) -> list:
+        index = self.load_id_index()
+        if index is None:
+            return super().get_cars_page(start, count)
+
+        ids, offsets = index
+        return list(self.read_rows(offsets[start:start + count]))
+
+    # Look up the cars matching brand or production_year in the secondary
+    # indexes, and read only those rows from the file.
+    # Other criteria are checked on the rows read.
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        try:
+            return self.find_cars(sort, limit, criteria)
+
+        except (TypeError, ValueError) as e:
+            # such as production_year_gte=abc, or brand_gte=5 compared
+            # with the brands in strings
+            self.logger.error('Find in %s failed. error: %s',
+                              self.filename, e)
+            return None
+
+    def find_cars(self, sort, limit, criteria) -> list:
+        year_keys = [key for key in criteria
+                     if key in ('production_year', 'production_year_gte',
+                                'production_year_lte')]
+        # Only brand= and production_year are looked up in the indexes,
+        # and other criteria such as brand_gte are checked on the rows.
+        if 'brand' not in criteria and not year_keys:
+            return super().find(sort, limit, **criteria)
+
+        indexes = self.load_indexes()
+        if indexes is None:
+            return None
+
+        brands, years = indexes
+        offsets = None
+        if 'brand' in criteria:
+            offsets = set(brands.get(str(criteria['brand']).lower(), ()))
+        if year_keys:
+            low = int(criteria.get('production_year_gte', 0))
+            high = int(criteria.get('production_year_lte', 10 ** 9))
+            if 'production_year' in criteria:
+                year = int(criteria['production_year'])
+                low, high = max(low, year), min(high, year)
+            start = bisect.bisect_left(years, (low, -1))
+            end = bisect.bisect_right(years, (high, float('inf')))
+            found = {offset for year, offset in years[start:end]}
+            offsets = found if offsets is None else offsets & found
+
+        cars = (car for car in self.read_rows(sorted(offsets))
+                if self.match(car, criteria))
+        return self.sort_cars(cars, sort, limit)
+
+    # Return the secondary indexes of the csv file:
+    #   brand in lower case -> list of the offsets of the rows
+    #   sorted list of (production_year, offset of the row)
+    # They are built reading the file once, and again when the file is
+    # changed. Return None if failed.
+    def load_indexes(self):
+        stamp = self.stat_file()
+        if self.indexes is not None and stamp == self.index_stamp:
+            return self.indexes
+
+        try:
+            brands = {}
+            years = []
+            with open(self.filename, 'rb') as csvfile:
+                header = next(csv.reader([csvfile.readline().decode()]))
+                brand_column = header.index('brand')
+                year_column = header.index('production_year')
+                offset = csvfile.tell()
+                for line in csvfile:
+                    row = next(csv.reader([line.decode()]), None)
+                    if row:
+                        brands.setdefault(row[brand_column].lower(),
+                                          []).append(offset)
+                        years.append((int(row[year_column]), offset))
+                    offset += len(line)
+
+        except (OSError, ValueError, StopIteration) as e:
+            self.logger.error('Index %s failed. error: %s', self.filename, e)
+            return None
+
+        years.sort()
+        self.indexes = (brands, years)
+        self.index_stamp = stamp
+        self.logger.debug('Indexes of %s built: %d brands, %d rows',
+                          self.filename, len(brands), len(years))
+        return self.indexes
+
+    # Yield the rows at the offsets in the csv file.
+    def read_rows(self, offsets: list):
+        header = self.header
+        try:
+            with open(self.filename, 'rb') as csvfile:
+                for offset in offsets:
+                    csvfile.seek(offset)
+                    line = csvfile.readline().decode()
+                    yield dict(zip(header, next(csv.reader([line]))))
+
+        except OSError as e:
+            self.logger.error('Get cars from %s failed. error: %s',
+                              self.filename, e.strerror)
+
+    # Return (mtime, size) of the csv file, or None if it isn't found.
+    def stat_file(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    # Return the arrays of the ids in the csv file and the offsets of
+    # their rows, sorted by id. The index saved with the same mtime and
+    # size as the file is used, or it is built and saved again.
+    # Return None if failed.
+    def load_id_index(self):
+        stamp = self.stat_file()
+        if stamp is None:
+            self.logger.error('%s not found', self.filename)
+            return None
+
+        if self.id_index is None or self.id_index[0] != stamp:
+            index = self.read_id_index(stamp)
+            if index is None:
+                index = self.build_id_index()
+                if index is None:
+                    return None
+                self.write_id_index(stamp, *index)
+            self.id_index = (stamp,) + index
+
+        return self.id_index[1:]
+
+    # Return the ids and offsets in the saved index, or None if it isn't
+    # saved for the file of stamp.
+    def read_id_index(self, stamp):
+        try:
+            with open(self.filename + self.ID_INDEX_SUFFIX, 'rb') as index:
+                mtime, size, rows = self.ID_INDEX_HEADER.unpack(
+                    index.read(self.ID_INDEX_HEADER.size))
+                if (mtime, size) != stamp:
+                    return None
+                ids = array('q')
+                offsets = array('q')
+                ids.fromfile(index, rows)
+                offsets.fromfile(index, rows)
+
+        except (OSError, EOFError, struct.error):
+            return None
+
+        return ids, offsets
+
+    def write_id_index(self, stamp, ids, offsets):
+        index_name = self.filename + self.ID_INDEX_SUFFIX
+        try:
+            with open(index_name + '.tmp', 'wb') as index:
+                index.write(self.ID_INDEX_HEADER.pack(*stamp, len(ids)))
+                ids.tofile(index)
+                offsets.tofile(index)
+            os.replace(index_name + '.tmp', index_name)
+
+        except OSError as e:
+            # The index is built again next time
+            self.logger.warning('Save %s failed. error: %s',
+                                index_name, e.strerror)
+
+    # Scan the lines in the memory mapped csv file for the ids and
+    # the offsets of the rows.
+    # Return None if failed.
+    def build_id_index(self):
+        ids = array('q')
+        offsets = array('q')
+        try:
+            with open(self.filename, 'rb') as csvfile, \
+                    mmap.mmap(csvfile.fileno(), 0,
+                              access=mmap.ACCESS_READ) as data:
+                size = len(data)
+                # skip the header
+                position = data.find(b'\n') + 1 or size
+                while position < size:
+                    end = data.find(b'\n', position)
+                    if end < 0:
+                        end = size
+                    comma = data.find(b',', position, end)
+                    if comma > position:
+                        ids.append(int(data[position:comma]))
+                        offsets.append(position)
+                    position = end + 1
+
+        except (OSError, ValueError) as e:
+            # mmap raises ValueError for an empty file
+            self.logger.error('Index %s failed. error: %s', self.filename, e)
+            return None
+
+        if any(ids[i] >= ids[i + 1] for i in range(len(ids) - 1)):
+            # The file was edited by hand
+            pairs = sorted(zip(ids, offsets))
+            ids = array('q', (car_id for car_id, offset in pairs))
+            offsets = array('q', (offset for car_id, offset in pairs))
+        self.logger.debug('Id index of %s built: %d rows',
+                          self.filename, len(ids))
+        return ids, offsets
+
+    # Return the offset of the row of the car with the id,
+    # or None if not found.
+    def find_offset(self, car_id: int) -> int:
+        index = self.load_id_index()
+        if index is None:
+            return None
+
+        ids, offsets = index
+        position = bisect.bisect_left(ids, car_id)
+        if position == len(ids) or ids[position] != car_id:
+            return None
+        return offsets[position]
+
+    # Return the row of the car with the id as a dictionary,
+    # or None if not found.
+    def find_row(self, car_id: int) -> dict:
+        offset = self.find_offset(car_id)
+        if offset is None:
+            return None
+
+        try:
+            with open(self.filename, 'rb') as csvfile, \
+                    mmap.mmap(csvfile.fileno(), 0,
+                              access=mmap.ACCESS_READ) as data:
+                end = data.find(b'\n', offset)
+                line = data[offset:end if end >= 0 else len(data)]
+
+        except (OSError, ValueError) as e:
+            self.logger.error('Read %s failed. error: %s', self.filename, e)
+            return None
+
+        return dict(zip(self.header, next(csv.reader([line.decode()]))))
+
+    # Replace the row of the car with the id by line, or remove it if
+    # line is empty. Only the rows after it are written again.
+    # Return True if succeeded else False.
+    def replace_row(self, car_id: int, line: bytes) -> bool:
+        with self.locked():
+            offset = self.find_offset(car_id)
+            if offset is None:
+                return False
+
+            try:
+                with open(self.filename, 'r+b') as csvfile:
+                    csvfile.seek(offset)
+                    csvfile.readline()
+                    rest = csvfile.read()
+                    csvfile.seek(offset)
+                    csvfile.write(line + rest)
+                    csvfile.truncate()
+
+            except OSError as e:
+                self.logger.error('Write %s failed. error: %s',
+                                  self.filename, e.strerror)
+                return False
+
+            self.indexes = None
+            self.id_index = None
+            return True
+
+    # Return the row of car_data as written by create()
+    def to_line(self, car_data: dict) -> bytes:
+        line = io.StringIO(newline='')
+        csv.writer(line, quoting=csv.QUOTE_MINIMAL).writerow(
+            [car_data[attr] for attr in self.header])
+        return line.getvalue().encode()
+
+    # Add car data to the csv file. The row is appended when its id is
+    # the largest, else the file is written again.
     # Return True if succeeded else False.
     def add_new_car(self, car_data: dict) -> bool:
-        cars = self.get_cars_list()
-        if cars is None:
-            return False
+        return self.change_many('add', [car_data], False)[0]
 
-        cars.append(car_data)
-        if not self.create(cars):
-            return False
+    # Return the id next to the largest id, found in the last row.
+    # Return None if failed.
+    def new_id(self) -> int:
+        last_id = self.last_id()
+        return None if last_id is None else last_id + 1
 
-        self.logger.info('Car id: %s added', str(car_data['id']))
-        return True
+    # The new id is taken and the row is appended holding the lock, so
+    # other threads and processes don't take the same id.
+    def add_car_with_new_id(self, car_data: dict) -> bool:
+        with self.locked():
+            return super().add_car_with_new_id(car_data)
 
     # Delete a car data from the csv file.
     # Return True if succeeded, else False.
     def delete_a_car(self, car_data: dict) -> bool:
-        cars_list = self.get_cars_list()
-
-        # find the car with the same id as car_data in the list
-        car_found = next((car for car in cars_list if str(car_data['id'])
-                          == str(car['id'])),
-                         None)
-
-        if car_found is None:
+        # the row is found in the id index
+        if not self.replace_row(int(car_data['id']), b''):
             self.logger.error('car id: %s not found', str(car_data['id']))
             return False
 
-        cars_list.remove(car_found)
-        return self.create(cars_list)
+        return True
 
     # Retrieve a car data with the id of specified car data.
     # Return None if not found else the dict type data of the car.
     def select_a_car(self, car_data: dict) -> dict:
-        cars_list = self.get_cars_list()
-
         # return the car which matches the specified car_data by its id
-        car_found = next(
-            (car for car in cars_list if car['id'] == car_data['id']),
-            None
-            )
+        car_found = self.find_row(int(car_data['id']))
 
-        return None if car_found is None else Car(car_found).__dict__
+        return None if car_found is None else Car(car_found).to_dict()
 
     # Update a car data in the csv file.
     # Return True if suceeded, else False.
     def update_a_car(self, car_data: dict) -> bool:
-        # delete the car data which has the same id as th specified data
-        if not self.delete_a_car(car_data):
+        # replace the row which has the same id as the specified data
+        if not self.replace_row(int(car_data['id']),
+                                self.to_line(car_data)):
             self.logger.error('car id %s not found', str(car_data['id']))
             return False
 
-        if not self.add_new_car(car_data):
-            self.logger.error('failed to add a car, id: %s', str(car_data['id']))
-            return False
-
         self.logger.info('update success id: %s', str(car_data['id']))
         return True
 
+    # Add, update or delete the cars in cars_data with one read and
+    # one write of the csv file.
+    def add_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('add', cars_data, all_or_nothing)
 
-# Create the csv file with the data got from the cars.json.
-def main():
-    try:
-        cars_db = CarsDB()
+    def update_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('update', cars_data, all_or_nothing)
 
-    except ServerNotReadyError:
-        Logger(__name__).get_logger().error('Server is not ready')
-        exit(1)
+    def delete_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('delete', cars_data, all_or_nothing)
 
+    # operation is 'add', 'update' or 'delete'.
+    # Return the list of True or False for each car.
+    def change_many(self, operation, cars_data, all_or_nothing) -> list:
+        with self.locked():
+            if operation == 'add':
+                results = self.append_sorted(cars_data)
+                if results is not None:
+                    return results
+
+            cars_list = self.get_cars_list()
+            if cars_list is None:
+                return [False] * len(cars_data)
+
+            cars = {int(car['id']): car for car in cars_list}
+            results = self.check_many(operation, cars_data, set(cars))
+            if all_or_nothing and not all(results):
+                return [False] * len(results)
+
+            for car_data, succeeded in zip(cars_data, results):
+                if not succeeded:
+                    continue
+                if operation == 'delete':
+                    del cars[int(car_data['id'])]
+                else:
+                    cars[int(car_data['id'])] = car_data
+
+            if any(results) and not self.create(list(cars.values())):
+                return [False] * len(results)
+
+            self.logger.info('%d of %d cars: %s', results.count(True),
+                             len(results), operation)
+            return results
+
+    # Append the cars to the end of the csv file without rewriting it,
+    # when their ids are in ascending order after the last row.
+    # Return the list of True for each car if appended, or None if the
+    # cars can't be appended.
+    def append_sorted(self, cars_data: list) -> list:
+        ids = [int(car_data['id']) for car_data in cars_data]
+        last_id = self.last_id()
+        if (not ids or last_id is None or ids[0] <= last_id
+                or any(prev >= next for prev, next in zip(ids, ids[1:]))):
+            return None
+
+        try:
+            with open(self.filename, 'a', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile,
+                                        fieldnames=self.header,
+                                        quoting=csv.QUOTE_MINIMAL)
+                writer.writerows(cars_data)
+
+        except OSError as e:
+            self.logger.error('Append to %s failed. error: %s',
+                              self.filename, e.strerror)
+            return [False] * len(ids)
+
+        return [True] * len(ids)
+
+    # Return the id in the last row of the csv file which is the largest
+    # id as the rows are sorted, 0 if no rows, or None if failed.
+    def last_id(self) -> int:
+        try:
+            with open(self.filename, 'rb') as csvfile:
+                # the last row is in the tail of the file
+                end = csvfile.seek(0, os.SEEK_END)
+                csvfile.seek(max(0, end - 4096))
+                lines = csvfile.read().splitlines()
+
+        except OSError as e:
+            self.logger.error('Read %s failed. error: %s',
+                              self.filename, e.strerror)
+            return None
+
+        if not lines:
+            return None
+        car_id = lines[-1].split(b',')[0]
+        # the last line is the header if no rows
+        return int(car_id) if car_id.isdigit() else 0
+
+    # Check the cars can be added, updated or deleted in order when the
+    # cars with the ids in ids exist. ids is changed as the cars are
+    # checked.
+    # Return the list of True or False for each car.
+    def check_many(self, operation, cars_data, ids: set) -> list:
+        results = []
+        for car_data in cars_data:
+            car_id = int(car_data['id'])
+            if operation == 'add':
+                succeeded = car_id not in ids
+                ids.add(car_id)
+            elif operation == 'delete':
+                succeeded = car_id in ids
+                ids.discard(car_id)
+            else:
+                succeeded = car_id in ids
+
+            if not succeeded:
+                self.logger.error('car id: %d cannot %s', car_id, operation)
+            results.append(succeeded)
+
+        return results
+
+
+# Parse and validate the rows in the byte range of the csv file.
+# Run in the worker processes of CarsCSV.get_cars_list_parallel.
+# A row with as many fields as the header is returned as a tuple, which is
+# pickled smaller and unpickled faster than a dict, and the others as the
+# dicts csv.DictReader gives. Return the rows, the number of rows which
+# have not as many fields as the header, and the number of the other rows
+# with values Car doesn't accept.
+def read_chunk(filename, start, end, header):
+    with open(filename, 'rb') as csvfile:
+        csvfile.seek(start)
+        data = csvfile.read(end - start)
+    # decoded as open() in text mode does
+    text = io.TextIOWrapper(io.BytesIO(data), newline='')
+    fields = len(header)
+    rows = []
+    malformed = 0
+    for row in csv.reader(text, delimiter=','):
+        if len(row) == fields:
+            rows.append(tuple(row))
+        elif row:
+            # the rest is kept with None key, or the lacking values are None
+            malformed += 1
+            car = dict(zip(header, row))
+            if len(row) > fields:
+                car[None] = row[fields:]
+            else:
+                car.update((key, None) for key in header[len(row):])
+            rows.append(car)
+
+    low, high = Car.YEAR_RANGE
+    checks = [(header.index(attr), check) for attr, check in (
+        ('id', str.isdigit),
+        ('production_year',
+         lambda year: year.isdigit() and low <= int(year) <= high),
+        ('convertible', lambda value: value.upper() in Car.CONVERTIBLE),
+    ) if attr in header]
+    invalid = sum(1 for row in rows if type(row) is tuple
+                  and not all(check(row[index]) for index, check in checks))
+    return rows, malformed, invalid
+
+
+# Create the csv file with the data got from the cars.json.
+# The rows are streamed by the migration tool.
+def main():
+    if __name__ == '__main__' or __name__ == 'carscsv':
+        from migrate import main as migrate
     else:
-        cars_csv = CarsCSV()
-        cars_csv.create(cars_db.get_cars_list())
+        from .migrate import main as migrate
+
+    migrate(['--from', 'json', '--to', 'csv', '--restart'])
 
 
 if __name__ == '__main__':
@@ -1,108 +1,134 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 # import logging
-from abc import ABC, abstractmethod
-from logger import Logger
+# Car and CarDataAccessor are in accessor.py so that the other backends
+# don't import requests. They are imported here for the old imports.
+if __name__ == '__main__' or __name__ == 'carsdb':
+    from accessor import Car  # noqa: F401
+    from accessor import CarDataAccessor
+    from accessor import ServerNotReadyError
+    from accessor import ValidationError  # noqa: F401
+    from logger import Logger
+else:
+    from .accessor import Car  # noqa: F401
+    from .accessor import CarDataAccessor
+    from .accessor import ServerNotReadyError
+    from .accessor import ValidationError  # noqa: F401
+    from .logger import Logger
 
 # http status codes
 # https://requests.readthedocs.io/en/latest/api/#status-code-lookup
 
 
-class ServerNotReadyError(Exception):
-    pass
-
-
-class ValidationError(Exception):
-    pass
-
-
-class Car:
-    def __init__(self, car_attr_value: dict):
-        self.id = self.validate_id(car_attr_value['id'])
-        self.brand = self.validate_brand(car_attr_value['brand'])
-        self.model = self.validate_model(car_attr_value['model'])
-        self.production_year = self.validate_year(
-                                    car_attr_value['production_year']
-                                    )
-        self.convertible = self.validate_convertible(
-                                    car_attr_value['convertible']
-                                    )
-
-    def validate_id(self, id:str):
-        if id.isdigit():
-            return int(id)
-        else:
-            raise ValidationError()
-
-    def validate_brand(self, brand: str):
-        return brand
-
-    def validate_model(self, model: str):
-        return model
-
-    def validate_year(self, year: str):
-        if year.isdigit():
-            if 1940 <= int(year) <= 2030:
-                return int(year)
-            else:
-                raise ValidationError()
-
-    def validate_convertible(self, convertible: str):
-        if convertible.upper() == 'YES' or convertible.upper() == 'TRUE':
-            return True
-        elif convertible.upper() == 'NO' or convertible.upper() == 'FALSE':
-            return False
-        else:
-            raise ValidationError
-
-
-# Abstract class to define CRUD functions
-class CarDataAccessor(ABC):
-
-    # Get cars list from json-server, and return list of dictionaries.
-    # If failed, return None.
-    @abstractmethod
-    def get_cars_list(self) -> list:
-        pass
-
-    # Add car data to the json db.
-    # Return True if succeeded else False.
-    @abstractmethod
-    def add_new_car(self, car_data: dict) -> bool:
-        pass
-
-    # Delete a car data.
-    # Return True if succeeded else False.
-    @abstractmethod
-    def delete_a_car(self, car_data: dict) -> bool:
-        pass
-
-    # Return a car data retrieved from the given car_data.
-    # Return None if not found.
-    @abstractmethod
-    def select_a_car(self, car_data: dict) -> dict:
-        pass
-
-
 class CarsDB(CarDataAccessor):
     LOG_FORMAT = '%(asctime)s:%(name)s:%(levelname)s:%(message)s'
-    h_close = {'Connection': 'Close'}
     h_content = {'Content-Type': 'application/json'}
-
-    def __init__(self, url='http://localhost', port=3000):
+    # Number of keep-alive connections kept in the pool
+    POOL_SIZE = 10
+    # (connect timeout, read timeout) in seconds for each request
+    TIMEOUT = (3.05, 10)
+    # Retry count and backoff factor for failed connections and
+    # temporary server errors
+    RETRIES = 3
+    BACKOFF = 0.3
+    RETRY_STATUS = (502, 503, 504)
+    # Requests can be sent in parallel over the pooled connections
+    CONCURRENCY = 4
+    # Number of replies kept to revalidate them with If-None-Match
+    REVALIDATE_REPLIES = 32
+    LOCAL = False
+
+    def __init__(self, url='http://localhost', port=3000,
+                 pool_size=POOL_SIZE, timeout=TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF):
         # self.logger = self.logging_setup()
         self.logger = Logger(__name__).get_logger()
         self.server_url = url + ':' + str(port)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = self.make_session(pool_size, retries, backoff)
+        # Replies with ETag kept by the query parameters, and the number
+        # of replies reused as the server returned 304 Not Modified.
+        # They are used only after enable_revalidation is called.
+        self.replies = None
+        self.not_modified = 0
+        self.replies_lock = threading.Lock()
+        # Results of the request sent by check_server, and the keys of
+        # the first car in them
+        self.prefetched = {}
+        self.car_attributes = None
         if not self.check_server():
+            self.close()
             raise ServerNotReadyError()
 
+    # Make a session which keeps connections to the server alive and
+    # reuses them for every request.
+    def make_session(self, pool_size, retries, backoff):
+        retry = Retry(total=retries,
+                      backoff_factor=backoff,
+                      status_forcelist=self.RETRY_STATUS,
+                      # Return the last reply instead of raising an error
+                      # so that the status code is checked as usual.
+                      raise_on_status=False,
+                      )
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              max_retries=retry,
+                              )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    # Close the connections in the pool.
+    def close(self):
+        self.session.close()
+
+    # Return the numbers of requests sent and connections opened
+    # through the pool. 'reused' is the number of requests which were
+    # sent on an already opened connection, and 'not_modified' is the
+    # number of replies revalidated by 304.
+    def connection_stats(self) -> dict:
+        stats = {'requests': 0, 'connections': 0}
+        adapters = {id(adapter): adapter
+                    for adapter in self.session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+
+        stats['reused'] = stats['requests'] - stats['connections']
+        stats['not_modified'] = self.not_modified
+        return stats
+
+    # Send If-None-Match with the ETag of the last reply to the same query,
+    # so that an unchanged list is revalidated by 304 Not Modified instead
+    # of transferring it again.
+    def enable_revalidation(self):
+        if self.replies is None:
+            self.replies = OrderedDict()
+
     def request_url(self):
         return self.server_url + '/cars'
 
+    # Check the server with the request for the first page, which is
+    # kept for the first count_cars and get_cars_page and for the
+    # attributes, so the panel starts with this one request.
     def check_server(self, cid=None):
         # return True if the server returns ok(200) else False
         try:
-            reply = requests.head(self.server_url, headers=CarsDB.h_close)
+            reply = self.session.get(self.request_url(),
+                                     params={'_sort': 'id', '_order': 'asc',
+                                             '_start': 0,
+                                             '_limit': self.PAGE_SIZE},
+                                     timeout=self.timeout)
 
         except requests.RequestException as e:
             self.logger.error('Communication error: %s', e.response)
@@ -110,27 +136,140 @@ class CarsDB(CarDataAccessor):
 
         else:
             if reply.status_code == requests.codes.ok:
+                rows = reply.json()
+                self.prefetched = {'rows': rows}
+                if 'X-Total-Count' in reply.headers:
+                    self.prefetched['total'] = int(
+                        reply.headers['X-Total-Count'])
+                if rows:
+                    self.car_attributes = list(rows[0].keys())
                 return True
             else:
                 self.logger.error('Server error: %s', reply.status_code)
                 return False
 
+    # Return the value fetched by check_server, or None if it is already
+    # used or the cars may have been changed since then.
+    def take_prefetched(self, name):
+        with self.replies_lock:
+            return self.prefetched.pop(name, None)
+
+    # Called when the cars are changed
+    def forget_prefetched(self):
+        with self.replies_lock:
+            self.prefetched.clear()
+
+    def attributes(self):
+        if self.car_attributes is not None:
+            return list(self.car_attributes)
+        return super().attributes()
+
     def get_cars_list(self):
         # get cars list from json-server, and return list of dictionaries.
         # if failed, return None
+        return self.query_cars({'_sort': 'id', '_order': 'asc'})
+
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        # get cars page by page with json-server's _page and _limit
+        params = {'_sort': 'id', '_order': 'asc', '_limit': page_size}
+        if start_after_id is not None:
+            params['id_gte'] = int(start_after_id) + 1
+
+        page = 1
+        while True:
+            params['_page'] = page
+            cars = self.query_cars(params)
+            if not cars:
+                return
+
+            yield from cars
+
+            if len(cars) < page_size:
+                # this was the last page
+                return
+            page += 1
+
+    def count_cars(self):
+        total = self.take_prefetched('total')
+        if total is not None:
+            return total
+
+        # json-server tells the total number of rows in X-Total-Count
+        # when the reply is sliced, so only one row is transferred.
+        reply = self.get_reply({'_limit': 1})
+        if reply is None:
+            return None
+
+        total = reply.headers.get('X-Total-Count')
+        if total is None:
+            return super().count_cars()
+        return int(total)
+
+    def get_cars_page(self, start, count):
+        rows = self.take_prefetched('rows') if start == 0 else None
+        # A short first page has all cars
+        if rows is not None and (count <= len(rows)
+                                 or len(rows) < self.PAGE_SIZE):
+            return rows[:count]
+
+        return self.query_cars({'_sort': 'id', '_order': 'asc',
+                                '_start': start, '_limit': count})
+
+    def find(self, sort=None, limit=None, **criteria):
+        # json-server understands the criteria as the query parameters
+        params = {key: str(value).lower() if isinstance(value, bool)
+                  else value for key, value in criteria.items()}
+        keys = ['id'] if sort is None else [sort] if isinstance(sort, str) \
+            else sort
+        params['_sort'] = ','.join(key.lstrip('-') for key in keys)
+        params['_order'] = ','.join('desc' if key.startswith('-') else 'asc'
+                                    for key in keys)
+        if limit is not None:
+            params['_limit'] = limit
+        return self.query_cars(params)
+
+    def query_cars(self, params: dict):
+        # get cars matching the query parameters from json-server.
+        # return list of dictionaries, or None if failed
+        reply = self.get_reply(params)
+        # convert json object to list of dict and return it
+        return None if reply is None else reply.json()
+
+    def get_reply(self, params: dict):
+        # send a get request with the query parameters to json-server.
+        # return the reply if succeeded else None
+        key = tuple(sorted(params.items()))
+        last_reply = None
+        headers = {}
+        if self.replies is not None:
+            with self.replies_lock:
+                last_reply = self.replies.get(key)
+            if last_reply is not None:
+                headers['If-None-Match'] = last_reply.headers['ETag']
+
         try:
-            target_url = self.request_url() + '/?_sort=id&_order=asc'
-            reply = requests.get(target_url,
-                                 headers=CarsDB.h_close)
+            reply = self.session.get(self.request_url(),
+                                     params=params,
+                                     headers=headers,
+                                     timeout=self.timeout)
 
         except requests.RequestException as e:
             self.logger.error('Get request error: %s', e.response)
             return None
 
         else:
-            if reply.status_code == requests.codes.ok:
-                # convert json object to list of dict and return it
-                return reply.json()
+            if (reply.status_code == requests.codes.not_modified
+                    and last_reply is not None):
+                with self.replies_lock:
+                    self.not_modified += 1
+                    self.replies[key] = last_reply
+                    self.replies.move_to_end(key)
+                return last_reply
+            elif reply.status_code == requests.codes.ok:
+                if self.replies is not None and 'ETag' in reply.headers:
+                    self.keep_reply(key, reply)
+                return reply
             elif reply.status_code == requests.codes.not_found:
                 self.logger.error('Resource not found')
                 return None
@@ -138,59 +277,117 @@ class CarsDB(CarDataAccessor):
                 self.logger.error('Get request error, status code: %d', reply.status_code)
                 return None
 
+    def keep_reply(self, key, reply):
+        with self.replies_lock:
+            self.replies[key] = reply
+            self.replies.move_to_end(key)
+            if len(self.replies) > self.REVALIDATE_REPLIES:
+                # forget the least recently used reply
+                self.replies.popitem(last=False)
+
+    def new_id(self):
+        # the car with the largest id is the first one in descending order
+        cars = self.query_cars({'_sort': 'id', '_order': 'desc', '_limit': 1})
+        if cars is None:
+            return None
+        return int(cars[0]['id']) + 1 if cars else 1
+
+    def add_car_with_new_id(self, car_data: dict) -> bool:
+        # json-server assigns the largest id + 1 to a car posted without id,
+        # so panels adding cars at the same time never get the same id.
+        new_car = self.post_car({attr: value for attr, value
+                                 in car_data.items() if attr != 'id'})
+        if new_car is None:
+            return False
+
+        car_data['id'] = new_car['id']
+        return True
+
     def add_new_car(self, car_data: dict) -> bool:
         # add car data to the json db
         # return True if succeeded else False
+        return self.post_car(car_data) is not None
+
+    def post_car(self, car_data: dict) -> dict:
+        # post car data to the json db
+        # return the car data added by the server, or None if failed
+        self.forget_prefetched()
         try:
             # convert car data to json and give it to the json server
-            reply = requests.post(self.request_url(),
-                                  headers=CarsDB.h_content,
-                                  data=json.dumps(car_data))
+            reply = self.session.post(self.request_url(),
+                                      headers=CarsDB.h_content,
+                                      data=json.dumps(car_data),
+                                      timeout=self.timeout)
 
         except requests.RequestException as e:
             self.logger.error('Post request error: %s', e.response)
-            return False
+            return None
 
         else:
             if reply.status_code == requests.codes.created:
-                return True
+                return reply.json()
             else:
                 self.logger.error('Post request status code: %d', reply.status_code)
-                return False
+                return None
 
     def delete_a_car(self, car_data: dict) -> bool:
+        self.forget_prefetched()
         target_url = self.request_url() + '/' + str(car_data['id'])
-        self.logger.info('target_url: %s', target_url)
+        self.logger.debug('target_url: %s', target_url)
         try:
-            reply = requests.delete(target_url)
+            reply = self.session.delete(target_url, timeout=self.timeout)
 
         except requests.RequestException as e:
             self.logger.error('Delete request error: %s', e.response)
             return False
 
         else:
-            self.logger.info('Delete request status code: %d', reply.status_code)
-            return True
+            self.logger.debug('Delete request status code: %d', reply.status_code)
+            return reply.status_code == requests.codes.ok
 
     def select_a_car(self, car_data: dict) -> dict:
         target_url = self.request_url() + '/?id=' + str(car_data['id'])
         try:
-            reply = requests.get(target_url)
+            reply = self.session.get(target_url, timeout=self.timeout)
 
         except requests.RequestException as e:
             self.logger.error('Get request error: %s', e.response)
             return None
 
         else:
-            self.logger.info('Get request status code: %d', reply.status_code)
-            return reply.json()[0]  # reply.json() is a list
+            self.logger.debug('Get request status code: %d', reply.status_code)
+            cars = reply.json()  # reply.json() is a list
+            return cars[0] if cars else None
+
+    def write_many(self, function, cars_data, all_or_nothing,
+                   undo, keep_old):
+        # send the requests in parallel over the pooled connections
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            if all_or_nothing and keep_old:
+                old_cars = list(executor.map(self.select_a_car, cars_data))
+            else:
+                old_cars = list(cars_data)
+
+            results = [bool(result)
+                       for result in executor.map(function, cars_data)]
+            if all_or_nothing and not all(results):
+                # json-server has no transaction, so roll back the cars
+                # which were written
+                list(executor.map(undo, [old for old, result
+                                         in zip(old_cars, results)
+                                         if result and old is not None]))
+                return [False] * len(results)
+
+        return results
 
     def update_a_car(self, car_data: dict) -> bool:
+        self.forget_prefetched()
         target_url = self.request_url() + '/' + str(car_data['id'])
         try:
-            reply = requests.put(target_url,
-                                 headers=CarsDB.h_content,
-                                 data=json.dumps(car_data))
+            reply = self.session.put(target_url,
+                                     headers=CarsDB.h_content,
+                                     data=json.dumps(car_data),
+                                     timeout=self.timeout)
 
         except requests.RequestException as e:
             self.logger.error('Put request error: %s', e.response)
@@ -201,6 +398,7 @@ class CarsDB(CarDataAccessor):
                 return True
             else:
                 self.logger.info('Put request status code: %d', reply.status_code)
+                return False
 
 
 if __name__ == '__main__':
@@ -211,3 +409,5 @@ if __name__ == '__main__':
         exit(1)
 
     print(cars_db.get_cars_list())
+    print(cars_db.connection_stats())
+    cars_db.close()
@@ -1,3 +1,4 @@
+import time
 import tkinter as tk
 from tkinter import ttk
 if __name__ == '__main__':
@@ -5,27 +6,33 @@ if __name__ == '__main__':
     from addtab import AddTab
     from updatetab import UpdateTab
     from deletetab import DeleteTab
-    from carsdb import Car
-    from carsdb import CarsDB
-    from carsdb import ValidationError
-    from carsdb import ServerNotReadyError
-    from carscsv import CarsCSV
+    from accessor import Car
+    from accessor import ValidationError
+    from accessor import ServerNotReadyError
+    from backends import DB_CLASSES
+    from cachingaccessor import CachingAccessor
     from configwindow import ConfigWindow
     from menubar import MenuBar
     from logger import Logger
+    from metrics import Metrics
+    from metrics import MeteredAccessor
+    from worker import Worker
 else:
     from .listtab import ListTab
     from .addtab import AddTab
     from .updatetab import UpdateTab
     from .deletetab import DeleteTab
-    from .carsdb import Car
-    from .carsdb import CarsDB
-    from .carsdb import ValidationError
-    from .carsdb import ServerNotReadyError
-    from .carscsv import CarsCSV
+    from .accessor import Car
+    from .accessor import ValidationError
+    from .accessor import ServerNotReadyError
+    from .backends import DB_CLASSES
+    from .cachingaccessor import CachingAccessor
     from .configwindow import ConfigWindow
     from .menubar import MenuBar
     from .logger import Logger
+    from .metrics import Metrics
+    from .metrics import MeteredAccessor
+    from .worker import Worker
 
 
 # To do :
@@ -36,37 +43,93 @@ else:
 
 class CarsPanel:
     LOG_FORMAT = '%(asctime)s:%(name)s:%(levelname)s:%(message)s'
-    DB_CLASSES = {
-        'json': CarsDB,
-        'csv': CarsCSV,
-    }
-
-    def __init__(self):
+    DB_CLASSES = DB_CLASSES
+    # The metrics are written to this file when the panel is closed
+    METRICS_FILE = 'dbpanel.metrics.json'
+    # Milliseconds between updates of the status bar
+    STATUS_INTERVAL = 500
+
+    # started is the perf_counter() when the program started, to tell
+    # the time until the first rows are shown.
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
         self.root = tk.Tk()
         self.logger = Logger(__name__).get_logger()
+        # Latencies of the database calls and the panel operations
+        self.metrics = Metrics()
         self.config_window = ConfigWindow(self)
         self.choose_db()
         self.root.title('Cars DB : ' + self.db_name)
         self.menu_bar = MenuBar(self)
         self.car_attributes = None
+        # Database calls run in the worker not to freeze the window
+        self.worker = Worker(self.root,
+                             max_workers=self.db.CONCURRENCY,
+                             on_busy=self.show_busy)
 
         self.notebook = ttk.Notebook(self.root)
+        # Moves while database calls are running.
+        # It is made before the tabs which start the calls.
+        self.busy_bar = ttk.Progressbar(self.root, mode='indeterminate')
         self.__current_car_data = self.make_car_data_fields()
         self.make_tabs()
         self.notebook.pack()
+        self.busy_bar.pack(fill=tk.X)
+        # The last operation and its rolling percentiles
+        self.status_text = tk.StringVar(self.root)
+        self.status_bar = tk.Label(self.root,
+                                   textvariable=self.status_text,
+                                   anchor=tk.W)
+        self.status_bar.pack(fill=tk.X)
+        self.update_status()
 
         self.root.mainloop()
+        self.worker.shutdown()
+        self.save_metrics()
 
     # Return db object based on the choice in the config window
     # Default is json db
     def choose_db(self):
         self.db_name = self.config_window.chosen_db_name()
         try:
-            self.db = self.DB_CLASSES[self.db_name]()
+            # Reads repeated in a short time are served from the cache,
+            # and the calls are timed including the cache.
+            self.db = MeteredAccessor(
+                CachingAccessor(self.DB_CLASSES[self.db_name]()),
+                self.metrics)
         except ServerNotReadyError:
             self.logger.error('Server not ready.')
             exit(1)
 
+    # Show the database calls are running
+    def show_busy(self, busy):
+        if busy:
+            self.busy_bar.start()
+            self.root.config(cursor='watch')
+        else:
+            self.busy_bar.stop()
+            self.root.config(cursor='')
+
+    # Called by the list tab when the first rows are shown
+    def first_paint(self):
+        elapsed = time.perf_counter() - self.started
+        self.metrics.record('first_paint', elapsed)
+        self.logger.info('First rows shown in %.0f ms', elapsed * 1000)
+
+    # Show the last recorded operation in the status bar
+    def update_status(self):
+        status = self.metrics.status()
+        if status is not None:
+            self.status_text.set(status)
+        self.root.after(self.STATUS_INTERVAL, self.update_status)
+
+    def save_metrics(self):
+        if self.metrics.dump(self.METRICS_FILE):
+            self.logger.info('Metrics saved in %s', self.METRICS_FILE)
+        else:
+            self.logger.error('Failed to save metrics in %s',
+                              self.METRICS_FILE)
+
     def make_tabs(self):
         self.list_tab = ListTab(self)
         self.add_tab = AddTab(self)
@@ -121,11 +184,20 @@ class CarsPanel:
         input_frame.pack(anchor=tk.N)
 
     def get_car_attributes(self):
-        # Get a list of dictionary data from database, and return
-        # the tuple of keys of the dictionary
+        # Return the tuple of the attributes of the cars.
+        # A local db reads them from its file, and the ones of a server
+        # are saved in the config file at the first start.
         if self.car_attributes is None:
-            cars = self.db.get_cars_list()
-            self.car_attributes = tuple(cars[0].keys())
+            if self.db.LOCAL:
+                attributes = self.db.attributes()
+            else:
+                attributes = self.config_window.cached_attributes(
+                    self.db_name)
+                if attributes is None:
+                    attributes = self.db.attributes()
+                    self.config_window.save_attributes(self.db_name,
+                                                       attributes)
+            self.car_attributes = tuple(attributes)
 
         return self.car_attributes
 
@@ -136,7 +208,7 @@ class CarsPanel:
         record_id = self.list_tab.car_table.focus()
         # The data values are retrieved from TreeView by its record_id.
         record_values = self.list_tab.car_table.item(record_id, 'values')
-        self.logger.debug('current car data: %s', str(record_values))
+        self.logger.debug('current car data: %s', record_values)
         attributes = self.get_car_attributes()
         # Make a dictionary with the attribute and StringVar
         for attr, value in zip(attributes, record_values):
@@ -166,26 +238,51 @@ class CarsPanel:
     def current_field(self):
         return self.__current_car_data
 
-    def submit_request(self, car_data, db_function):
-        for attr, value in car_data.items():
-            self.logger.debug('%s : %s', attr, value)
+    # Validate car_data and give it to db_function.
+    # change is 'add', 'update' or 'delete' to tell the list tab which row
+    # to refresh. The whole list is reloaded when change is None.
+    def submit_request(self, car_data, db_function, change=None):
+        # One message for the car, formatted only if debug is enabled
+        self.logger.debug('%s: %s', db_function.__name__, car_data)
 
+        # Timed until the list shows the result
+        started = time.perf_counter()
         try:
             car = Car(car_data)
 
-        except ValidationError:
-            self.logger.error('Invalid value')
+        except ValidationError as e:
+            self.logger.error('Invalid value: %s', e)
+            self.metrics.record('submit_request',
+                                time.perf_counter() - started, failed=True)
 
         else:
-            if db_function(car.__dict__):
-                self.notebook.select(self.list_tab.tab)
+            # db_function runs in the worker, and request_done is called
+            # with its result in the mainloop.
+            # db_function may set the id assigned to the car in car_data
+            car_data = car.to_dict()
+            self.worker.submit(db_function, car_data,
+                               callback=lambda succeeded:
+                               self.request_done(succeeded,
+                                                 car_data,
+                                                 change,
+                                                 started)
+                               )
+
+    def request_done(self, succeeded, car_data, change, started):
+        if succeeded:
+            self.notebook.select(self.list_tab.tab)
+            if change is None:
                 self.list_tab.list_cars()
             else:
-                self.logger.error('submit request failed.')
+                self.list_tab.apply_change(change, car_data)
+        else:
+            self.logger.error('submit request failed.')
+        self.metrics.record('submit_request', time.perf_counter() - started,
+                            failed=not succeeded)
 
 
-def main():
-    CarsPanel()
+def main(started=None):
+    CarsPanel(started)
 
 
 if __name__ == '__main__':
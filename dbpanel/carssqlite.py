@@ -0,0 +1,368 @@
+import contextlib
+import sqlite3
+import threading
+if __name__ == '__main__' or __name__ == 'carssqlite':
+    from accessor import Car
+    from accessor import CarDataAccessor
+    from logger import Logger
+else:
+    from .accessor import Car
+    from .accessor import CarDataAccessor
+    from .logger import Logger
+
+
+# Cars in a local SQLite database file.
+# The id is the primary key (the rowid of the table), and brand and
+# production_year are indexed for find().
+#
+# Each thread of the worker has its own connection. The database is in
+# WAL mode, so reads don't wait for a write in another thread.
+# The statements are fixed strings with parameters, which sqlite3 keeps
+# prepared in the statement cache of each connection.
+class CarsSQLite(CarDataAccessor):
+    FILENAME = 'cars.db'
+    CONCURRENCY = 4
+    # Seconds to wait for a write lock held by another connection
+    TIMEOUT = 5.0
+    COLUMNS = ('id', 'brand', 'model', 'production_year', 'convertible')
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS cars ('
+        ' id INTEGER PRIMARY KEY,'
+        ' brand TEXT NOT NULL,'
+        ' model TEXT NOT NULL,'
+        ' production_year INTEGER NOT NULL,'
+        ' convertible INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS cars_brand'
+        ' ON cars (brand COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS cars_production_year'
+        ' ON cars (production_year)',
+    )
+    SELECT = ('SELECT id, brand, model, production_year, convertible'
+              ' FROM cars')
+    INSERT = ('INSERT INTO cars'
+              ' (id, brand, model, production_year, convertible)'
+              ' VALUES (?, ?, ?, ?, ?)')
+    UPDATE = ('UPDATE cars SET brand = ?, model = ?, production_year = ?,'
+              ' convertible = ? WHERE id = ?')
+    DELETE = 'DELETE FROM cars WHERE id = ?'
+
+    def __init__(self, filename=FILENAME, timeout=TIMEOUT):
+        self.filename = filename
+        self.timeout = timeout
+        self.logger = Logger(__name__).get_logger()
+        self.local = threading.local()
+        # All connections, to close them
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        with self.transaction() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    # Return the connection of this thread.
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # Transactions are started explicitly by transaction()
+            connection = sqlite3.connect(self.filename,
+                                         timeout=self.timeout,
+                                         isolation_level=None,
+                                         check_same_thread=False,
+                                         cached_statements=64)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # WAL is safe against corruption with NORMAL, and only the
+            # last transactions may be lost on a power failure.
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            with self.connections_lock:
+                self.connections.append(connection)
+        return connection
+
+    # Run the statements in the with block in a transaction.
+    # It is rolled back when an exception is raised, or COMMIT fails.
+    @contextlib.contextmanager
+    def transaction(self):
+        connection = self.connection()
+        # Take the write lock first so that the reads in the transaction
+        # are not made stale by another writer.
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        try:
+            connection.execute('COMMIT')
+        except BaseException:
+            # a failed COMMIT may leave the transaction open
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        self.local = threading.local()
+
+    # Convert a row of the table to car data
+    def to_car(self, row) -> dict:
+        car = dict(zip(self.COLUMNS, row))
+        car['convertible'] = bool(car['convertible'])
+        return car
+
+    # Convert car data to the parameters of INSERT.
+    # Raise ValueError if a value can't be stored.
+    def to_row(self, car_data: dict) -> tuple:
+        return (int(car_data['id']),
+                str(car_data['brand']),
+                str(car_data['model']),
+                int(car_data['production_year']),
+                self.to_convertible(car_data['convertible']))
+
+    # Return 1 or 0 for yes/no or true/false.
+    # Raise ValueError for other values.
+    @staticmethod
+    def to_convertible(value) -> int:
+        convertible = Car.CONVERTIBLE.get(str(value).upper())
+        if convertible is None:
+            raise ValueError('convertible is not yes/no: ' + str(value))
+        return int(convertible)
+
+    # Return the rows of the query as car data, or None if failed.
+    def query(self, sql, params=()) -> list:
+        try:
+            rows = self.connection().execute(sql, params).fetchall()
+
+        except sqlite3.Error as e:
+            self.logger.error('Query to %s failed. error: %s',
+                              self.filename, e)
+            return None
+
+        return [self.to_car(row) for row in rows]
+
+    # Newly create the table with the cars.
+    # Return True if succeeded else False.
+    def create(self, cars: list) -> bool:
+        try:
+            with self.transaction() as connection:
+                connection.execute('DELETE FROM cars')
+                connection.executemany(self.INSERT,
+                                       (self.to_row(car) for car in cars))
+            return True
+
+        except (sqlite3.Error, ValueError) as e:
+            self.logger.error('Create %s failed. error: %s', self.filename, e)
+            return False
+
+    def attributes(self) -> list:
+        return list(self.COLUMNS)
+
+    def get_cars_list(self) -> list:
+        return self.query(self.SELECT + ' ORDER BY id')
+
+    # Yield the cars reading page_size rows at a time after the last id,
+    # so a page is found in the primary key at any depth.
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        last_id = -1 if start_after_id is None else int(start_after_id)
+        while True:
+            cars = self.query(self.SELECT + ' WHERE id > ? ORDER BY id'
+                              ' LIMIT ?', (last_id, page_size))
+            if not cars:
+                return
+            yield from cars
+            last_id = cars[-1]['id']
+
+    def count_cars(self) -> int:
+        try:
+            return self.connection().execute(
+                'SELECT COUNT(*) FROM cars').fetchone()[0]
+
+        except sqlite3.Error as e:
+            self.logger.error('Count cars in %s failed. error: %s',
+                              self.filename, e)
+            return None
+
+    def get_cars_page(self, start: int, count: int) -> list:
+        return self.query(self.SELECT + ' ORDER BY id LIMIT ? OFFSET ?',
+                          (count, start))
+
+    # Return the id next to the largest one.
+    # MAX(id) is read from the end of the primary key, so it doesn't scan
+    # the table to find a gap.
+    def new_id(self) -> int:
+        return self.connection().execute(
+            'SELECT COALESCE(MAX(id), 0) + 1 FROM cars').fetchone()[0]
+
+    def add_car_with_new_id(self, car_data: dict) -> bool:
+        try:
+            # The id isn't taken by another connection in the transaction
+            with self.transaction() as connection:
+                car_data['id'] = self.new_id()
+                connection.execute(self.INSERT, self.to_row(car_data))
+
+        except (sqlite3.Error, ValueError) as e:
+            self.logger.error('Add a car to %s failed. error: %s',
+                              self.filename, e)
+            return False
+
+        self.logger.info('Car id: %s added', str(car_data['id']))
+        return True
+
+    # Add, update or delete a car.
+    # Return True if succeeded else False.
+    def add_new_car(self, car_data: dict) -> bool:
+        return self.add_many([car_data])[0]
+
+    def delete_a_car(self, car_data: dict) -> bool:
+        return self.delete_many([car_data])[0]
+
+    def update_a_car(self, car_data: dict) -> bool:
+        return self.update_many([car_data])[0]
+
+    def select_a_car(self, car_data: dict) -> dict:
+        cars = self.query(self.SELECT + ' WHERE id = ?',
+                          (int(car_data['id']),))
+        return cars[0] if cars else None
+
+    def add_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('add', cars_data, all_or_nothing)
+
+    def update_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('update', cars_data, all_or_nothing)
+
+    def delete_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('delete', cars_data, all_or_nothing)
+
+    # Change the cars in one transaction.
+    # operation is 'add', 'update' or 'delete'.
+    # Return the list of True or False for each car.
+    def change_many(self, operation, cars_data, all_or_nothing) -> list:
+        results = []
+        try:
+            with self.transaction() as connection:
+                for car_data in cars_data:
+                    results.append(self.change(connection, operation,
+                                               car_data))
+                if all_or_nothing and not all(results):
+                    raise sqlite3.IntegrityError('not all cars can be '
+                                                 'changed')
+
+        except sqlite3.Error as e:
+            self.logger.error('%s cars in %s failed. error: %s',
+                              operation, self.filename, e)
+            return [False] * len(cars_data)
+
+        self.logger.info('%d of %d cars: %s', results.count(True),
+                         len(results), operation)
+        return results
+
+    # Change a car in the transaction.
+    # Return True if succeeded else False.
+    def change(self, connection, operation, car_data) -> bool:
+        car_id = int(car_data['id'])
+        try:
+            if operation == 'add':
+                cursor = connection.execute(self.INSERT,
+                                            self.to_row(car_data))
+            elif operation == 'update':
+                cursor = connection.execute(self.UPDATE,
+                                            self.to_row(car_data)[1:]
+                                            + (car_id,))
+            else:
+                # only the id is needed to delete
+                cursor = connection.execute(self.DELETE, (car_id,))
+
+        except sqlite3.IntegrityError:
+            # the id already exists
+            cursor = None
+        except ValueError as e:
+            self.logger.error('car id: %d has a bad value. error: %s',
+                              car_id, e)
+            cursor = None
+
+        if cursor is None or cursor.rowcount == 0:
+            self.logger.error('car id: %d cannot %s', car_id, operation)
+            return False
+        return True
+
+    # Translate the criteria to a WHERE clause using the indexes.
+    # Return None if a value of the criteria is bad.
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        try:
+            sql, params = self.find_query(sort, limit, criteria)
+        except ValueError as e:
+            self.logger.error('Bad criteria: %s', e)
+            return None
+        return None if sql is None else self.query(sql, params)
+
+    # Return the query and the parameters of find(),
+    # or None and None for an unknown attribute.
+    # Raise ValueError if a value is bad.
+    def find_query(self, sort, limit, criteria):
+        conditions = []
+        params = []
+        for key, value in criteria.items():
+            if key == 'q':
+                # % and _ in the text are matched as they are
+                text = str(value).replace('\\', '\\\\') \
+                    .replace('%', '\\%').replace('_', '\\_')
+                conditions.append('(' + ' OR '.join(
+                    "CAST({} AS TEXT) LIKE ? ESCAPE '\\'".format(column)
+                    for column in self.COLUMNS) + ')')
+                params += ['%{}%'.format(text)] * len(self.COLUMNS)
+                continue
+
+            column, operator = key, '='
+            if key.endswith('_gte'):
+                column, operator = key[:-4], '>='
+            elif key.endswith('_lte'):
+                column, operator = key[:-4], '<='
+            if column not in self.COLUMNS:
+                self.logger.error('Unknown attribute: %s', key)
+                return None, None
+
+            if column in ('brand', 'model'):
+                conditions.append('{} {} ? COLLATE NOCASE'.format(column,
+                                                                  operator))
+                params.append(str(value))
+            elif column == 'convertible':
+                conditions.append('convertible {} ?'.format(operator))
+                params.append(self.to_convertible(value))
+            else:
+                conditions.append('{} {} ?'.format(column, operator))
+                params.append(int(value))
+
+        sql = self.SELECT
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        keys = ['id'] if sort is None else [sort] if isinstance(sort, str) \
+            else list(sort)
+        if any(key.lstrip('-') not in self.COLUMNS for key in keys):
+            self.logger.error('Unknown attribute to sort: %s', str(sort))
+            return None, None
+        # Ties are in id order as the other backends give
+        if not any(key.lstrip('-') == 'id' for key in keys):
+            keys.append('id')
+        # Text is sorted ignoring case as CarDataAccessor.sort_value does
+        sql += ' ORDER BY ' + ', '.join(
+            key.lstrip('-')
+            + (' COLLATE NOCASE' if key.lstrip('-') in ('brand', 'model')
+               else '')
+            + (' DESC' if key.startswith('-') else '')
+            for key in keys)
+
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return sql, params
+
+
+if __name__ == '__main__':
+    db = CarsSQLite()
+    print(db.count_cars(), 'cars in', db.filename)
+    for car in db.get_cars_page(0, 10):
+        print(car)
+    db.close()
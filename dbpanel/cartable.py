@@ -0,0 +1,285 @@
+import itertools
+import operator
+from array import array
+from collections import Counter
+try:
+    import numpy
+except ImportError:
+    # filter() and sort() loop over the rows in Python
+    numpy = None
+if __name__ == '__main__' or __name__ == 'cartable':
+    from accessor import Car
+    from accessor import CarDataAccessor
+    from logger import Logger
+else:
+    from .accessor import Car
+    from .accessor import CarDataAccessor
+    from .logger import Logger
+
+
+# In-memory table of cars stored column by column.
+# id, production_year and convertible are kept in typed arrays, and
+# brand and model are kept as codes into the lists of distinct values.
+#
+# filter() and sort() return a new CarTable which shares the columns
+# with this one and has its own order of rows, so they can be chained:
+#   table.filter(brand='Maserati', production_year_gte=1970).sort(
+#       ['-production_year'])
+# They are vectorized with NumPy if it is installed. Without NumPy they
+# loop over the rows in Python, which is not vectorized.
+# A CarTable also answers count_cars() and get_cars_page() like a
+# CarDataAccessor, so ListTab can show it directly.
+class CarTable:
+    COLUMNS = ('id', 'brand', 'model', 'production_year', 'convertible')
+    # Columns kept as codes into the lists of distinct values
+    ENCODED = ('brand', 'model')
+    # Columns compared as numbers by filter()
+    NUMBERS = ('id', 'production_year')
+    # Suffix of the key of the criteria -> operator
+    OPERATORS = {'': operator.eq, '_gte': operator.ge, '_lte': operator.le}
+
+    def __init__(self, table=None, order=None):
+        if table is None:
+            self.data = {
+                'id': array('q'),
+                'brand': array('l'),
+                'model': array('l'),
+                'production_year': array('h'),
+                'convertible': array('b'),
+            }
+            # code -> value, and value -> code of the encoded columns
+            self.values = {column: [] for column in self.ENCODED}
+            self.codes = {column: {} for column in self.ENCODED}
+        else:
+            self.data = table.data
+            self.values = table.values
+            self.codes = table.codes
+        # Indexes of the rows in this table, or None for all rows
+        self.order = order
+
+    # Make a table with all cars in db, reading page_size cars at a time.
+    @classmethod
+    def from_accessor(cls, db: CarDataAccessor,
+                      page_size=CarDataAccessor.PAGE_SIZE):
+        table = cls()
+        cars = db.iter_cars(page_size=page_size)
+        while True:
+            chunk = list(itertools.islice(cars, page_size))
+            if not chunk:
+                break
+
+            valid_cars, errors = Car.validate_many(chunk)
+            for index, reason in errors:
+                Logger(__name__).get_logger().error(
+                    'Invalid car skipped: %s, %s', str(chunk[index]), reason)
+            table.extend(valid_cars)
+
+        return table
+
+    # Append the cars to the columns.
+    # Only a table made by CarTable() or from_accessor() can be extended.
+    def extend(self, cars: list):
+        for column in ('id', 'production_year', 'convertible'):
+            self.data[column].extend(getattr(car, column) for car in cars)
+        for column in self.ENCODED:
+            self.data[column].extend(self.encode(column, getattr(car, column))
+                                     for car in cars)
+
+    def encode(self, column, value) -> int:
+        codes = self.codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[column])
+            self.values[column].append(value)
+        return code
+
+    # Return the indexes of the rows in this table
+    def indexes(self):
+        if self.order is None:
+            return range(len(self.data['id']))
+        return self.order
+
+    def __len__(self):
+        return len(self.indexes())
+
+    # Return the car data in the row at index of the columns
+    def row(self, index) -> dict:
+        car = {column: self.data[column][index] for column in self.COLUMNS}
+        for column in self.ENCODED:
+            car[column] = self.values[column][car[column]]
+        car['convertible'] = bool(car['convertible'])
+        return car
+
+    def count_cars(self) -> int:
+        return len(self)
+
+    def get_cars_page(self, start: int, count: int) -> list:
+        return [self.row(index)
+                for index in self.indexes()[start:start + count]]
+
+    def get_cars_list(self) -> list:
+        return [self.row(index) for index in self.indexes()]
+
+    # Return the table of the rows which match all criteria, which are
+    # the same as the ones of CarDataAccessor.find():
+    #   attr=value, attr_gte=value, attr_lte=value, q=text
+    # brand, model and convertible are tested once for each distinct value.
+    # Return None if the criteria are bad, as find() does.
+    def filter(self, **criteria):
+        indexes = self.indexes() if numpy is None else self.index_array()
+        try:
+            for key, expected in criteria.items():
+                if key == 'q':
+                    columns = self.COLUMNS
+                else:
+                    column = key[:-4] if key.endswith(('_gte', '_lte')) \
+                        else key
+                    if column not in self.COLUMNS:
+                        raise ValueError('unknown attribute: ' + key)
+                    columns = (column,)
+                indexes = self.select(indexes, columns, key, expected)
+
+        except (TypeError, ValueError) as e:
+            Logger(__name__).get_logger().error(
+                'Bad criteria: %s, %s', str(criteria), e)
+            return None
+
+        return CarTable(self, self.to_order(indexes))
+
+    # Return the indexes of the rows whose value in any of the columns
+    # matches the criterion.
+    def select(self, indexes, columns, key, expected):
+        if numpy is None:
+            tests = [(self.data[column], self.value_test(column, key,
+                                                         expected))
+                     for column in columns]
+            return [index for index in indexes
+                    if any(test(data[index]) for data, test in tests)]
+
+        mask = numpy.zeros(len(indexes), dtype=bool)
+        for column in columns:
+            data = self.column_array(column)[indexes]
+            comparison = self.comparison(column, key, expected)
+            if comparison is not None:
+                mask |= comparison[0](data, comparison[1])
+            else:
+                test = self.value_test(column, key, expected)
+                accepted = [value for value in numpy.unique(data).tolist()
+                            if test(value)]
+                mask |= numpy.isin(data, accepted)
+        return indexes[mask]
+
+    # Return the operator and the number to compare the values of a number
+    # column with, or None if the criterion isn't a comparison of numbers.
+    def comparison(self, column, key, expected):
+        if column not in self.NUMBERS or key == 'q':
+            return None
+        bound = CarDataAccessor.sort_value(expected)
+        if not isinstance(bound, int) or isinstance(bound, bool) \
+                or key == column and str(bound) != str(expected):
+            return None
+        return self.OPERATORS[key[len(column):]], bound
+
+    # Return the function which tells if a value stored in the column
+    # matches the criterion as CarDataAccessor.match() does.
+    # The result is kept for each distinct value.
+    def value_test(self, column, key, expected):
+        comparison = self.comparison(column, key, expected)
+        if comparison is not None:
+            function, bound = comparison
+            return lambda value: function(value, bound)
+
+        if column in self.ENCODED:
+            decode = self.values[column].__getitem__
+        elif column == 'convertible':
+            decode = bool
+        else:
+            decode = int
+        criteria = {key: expected}
+        results = {}
+
+        def test(value):
+            result = results.get(value)
+            if result is None:
+                result = results[value] = CarDataAccessor.match(
+                    {column: decode(value)}, criteria)
+            return result
+        return test
+
+    # Return the column as a NumPy array sharing the memory.
+    # It is used only in a method, as the array can't be extended while
+    # it is shared.
+    def column_array(self, column):
+        data = self.data[column]
+        return numpy.frombuffer(data, dtype=data.typecode)
+
+    # Return the indexes of the rows in this table as a NumPy array
+    def index_array(self):
+        if self.order is None:
+            return numpy.arange(len(self.data['id']), dtype='l')
+        return numpy.frombuffer(self.order, dtype='l')
+
+    # Return the indexes as the order of a new table
+    def to_order(self, indexes):
+        if numpy is not None:
+            return array('l', numpy.asarray(indexes, dtype='l').tobytes())
+        return array('l', indexes)
+
+    # Return the ranks of the codes of the encoded column in the order of
+    # their values.
+    def ranks(self, column) -> list:
+        values = self.values[column]
+        ranks = [0] * len(values)
+        for rank, code in enumerate(sorted(range(len(values)),
+                                           key=values.__getitem__)):
+            ranks[code] = rank
+        return ranks
+
+    # Return the table sorted by the columns in keys, which is a column or
+    # a list of columns as sort of CarDataAccessor.find().
+    # A column with '-' at the head is sorted in descending order.
+    def sort(self, keys):
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        if numpy is not None:
+            indexes = self.index_array()
+            sort_keys = []
+            for key in keys:
+                column = key.lstrip('-')
+                data = self.column_array(column)[indexes].astype('q')
+                if column in self.ENCODED:
+                    # codes are in the order of appearance
+                    data = numpy.array(self.ranks(column), dtype='q')[data]
+                sort_keys.append(-data if key.startswith('-') else data)
+            # lexsort is stable, and sorts by the last key first
+            if sort_keys:
+                indexes = indexes[numpy.lexsort(sort_keys[::-1])]
+            return CarTable(self, self.to_order(indexes))
+
+        indexes = list(self.indexes())
+        # Sort by the last key first, as the sort is stable
+        for key in reversed(keys):
+            column = key.lstrip('-')
+            data = self.data[column]
+            if column in self.ENCODED:
+                # codes are in the order of appearance, so sort them by
+                # the rank of their values
+                ranks = self.ranks(column)
+                sort_key = (lambda index, data=data, ranks=ranks:
+                            ranks[data[index]])
+            else:
+                sort_key = data.__getitem__
+            indexes.sort(key=sort_key, reverse=key.startswith('-'))
+
+        return CarTable(self, array('l', indexes))
+
+    # Return the dictionary of the value of the column and the number of
+    # rows which have the value.
+    def group_count(self, column) -> dict:
+        data = self.data[column]
+        counts = Counter(data[index] for index in self.indexes())
+        if column in self.ENCODED:
+            values = self.values[column]
+            return {values[code]: count for code, count in counts.items()}
+        if column == 'convertible':
+            return {bool(value): count for value, count in counts.items()}
+        return dict(counts)
@@ -13,12 +13,22 @@ class ConfigWindow():
             '# DB Choice': None,
             '#  1: json': None,
             '#  2: csv': None,
+            '#  3: csv-mem': None,
+            '#  4: csv-log': None,
+            '#  5: sqlite': None,
+            '#  6: csv-sharded': None,
+            '#  7: binary': None,
             'db': '1',
         }
     }
     DB_CHOICE = {
         'json': 1,
         'csv': 2,
+        'csv-mem': 3,
+        'csv-log': 4,
+        'sqlite': 5,
+        'csv-sharded': 6,
+        'binary': 7,
     }
 
     def __init__(self, panel):
@@ -36,7 +46,6 @@ class ConfigWindow():
         modal_dlg = tk.Toplevel(self.parent)
         modal_dlg.grab_set()
         modal_dlg.focus_set()
-        modal_dlg.geometry('200x200')
         # Don't show in the task bar
         modal_dlg.transient(self.parent)
         self.modal_dlg = modal_dlg
@@ -45,6 +54,11 @@ class ConfigWindow():
 
         choices = self.DB_CHOICE
 
+        db_choice_label = tk.Label(config_frame,
+                                   text='DB Choice')
+        db_choice_label.grid(row=0, column=0)
+
+        # A choice in a row, so that the dialog fits all of them
         num = 1
         for choice, value in choices.items():
             button = tk.Radiobutton(config_frame,
@@ -53,22 +67,14 @@ class ConfigWindow():
                                     variable=self.db_choice,
                                     command=self.switch_db,
                                     )
-            button.grid(row=1, column=num)
+            button.grid(row=num, column=0, sticky=tk.W)
             num += 1
 
-        db_choice_label = tk.Label(config_frame,
-                                   text='DB Choice')
-        db_choice_label.grid(row=0,
-                             column=0,
-                             columnspan=num,
-                             )
-
         save_button = tk.Button(config_frame,
                                 text='Save',
                                 command=self.save_config)
-        save_button.grid(row=3,
+        save_button.grid(row=num,
                          column=0,
-                         columnspan=num,
                          )
 
         self.save_button = save_button
@@ -93,6 +99,10 @@ class ConfigWindow():
             return
 
     def save_config(self):
+        self.write_config()
+        self.modal_dlg.destroy()
+
+    def write_config(self):
         self.config.read_dict(self.DEFAULT)
 
         if not self.config.has_section('DB Choice'):
@@ -102,14 +112,34 @@ class ConfigWindow():
         with open(self.CONFIG_FILE, 'w') as configfile:
             self.config.write(configfile)
 
-        self.modal_dlg.destroy()
-
+    # Return the attributes of the cars in the db saved by
+    # save_attributes, or None if they aren't saved.
+    def cached_attributes(self, db_name):
+        if not self.config.has_option('Schema', db_name):
+            return None
+        return self.config['Schema'][db_name].split(',')
+
+    # Save the attributes of the cars in the db not to ask them to
+    # the server at the next start.
+    def save_attributes(self, db_name, attributes):
+        if not self.config.has_section('Schema'):
+            self.config.add_section('Schema')
+        self.config['Schema'][db_name] = ','.join(attributes)
+        self.write_config()
+
+    # The db is json when the file has no [DB Choice], e.g. only
+    # [Logging], or has a db which isn't in DB_CHOICE.
     def read_config(self):
         if os.path.exists(self.CONFIG_FILE):
             self.config.read(self.CONFIG_FILE)
-            self.db_choice.set(int(self.config['DB Choice']['db']))
-        else:
-            self.db_choice.set(self.DB_CHOICE['json'])      # default is json
+        try:
+            db_choice = self.config.getint('DB Choice', 'db',
+                                           fallback=self.DB_CHOICE['json'])
+        except ValueError:
+            db_choice = None
+        if db_choice not in self.DB_CHOICE.values():
+            db_choice = self.DB_CHOICE['json']              # default is json
+        self.db_choice.set(db_choice)
 
     # Convert the digit value in self.db_choice to the db name in DB_CHOICE.
     def chosen_db_name(self):
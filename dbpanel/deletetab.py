@@ -1,5 +1,8 @@
 import tkinter as tk
-from carsdb import Car
+if __name__ == 'deletetab':
+    from accessor import Car
+else:
+    from .accessor import Car
 
 
 # Tab page to delete a data which fills the field in this tab page.
@@ -20,14 +23,20 @@ class DeleteTab:
         car_to_delete = self.panel.current_car_data
 
         # Retrieve the data from db by the id of car to delete.
-        car_in_db = self.panel.db.select_a_car(car_to_delete)
+        self.panel.worker.submit(self.panel.db.select_a_car, car_to_delete,
+                                 callback=lambda car_in_db:
+                                 self.confirm_delete(car_to_delete, car_in_db)
+                                 )
 
+    # Called with the car data retrieved from db
+    def confirm_delete(self, car_to_delete, car_in_db):
         # Confirm the car data to delete equals the data in db.
-        if (car_in_db == Car(car_to_delete).__dict__):
+        if (car_in_db == Car(car_to_delete).to_dict()):
             # The car data to delete is found in the db.
             self.logger.debug('data to be deleted: %s', car_in_db.values())
             self.panel.submit_request(car_to_delete,
-                                      self.panel.db.delete_a_car)
+                                      self.panel.db.delete_a_car,
+                                      'delete')
         else:
             self.logger.error("Car to delete isn't found in db")
             self.logger.error('car in db: %s', str(car_in_db))
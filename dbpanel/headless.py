@@ -0,0 +1,196 @@
+import argparse
+import json
+import sys
+import time
+# __name__ is '__main__' also in python -m dbpanel.headless,
+# so the package tells if this is run as a script in dbpanel/
+if not __package__:
+    from backends import DB_CLASSES
+    from accessor import Car
+    from accessor import ServerNotReadyError
+    from logger import Logger
+else:
+    from .backends import DB_CLASSES
+    from .accessor import Car
+    from .accessor import ServerNotReadyError
+    from .logger import Logger
+
+
+# Run the operations read from stdin on a database without the panel.
+#
+#   $ python -m dbpanel --headless --db csv < operations.ndjson
+#
+# An operation is a JSON object in a line:
+#   {"op": "add", "car": {"id": 5, "brand": ..., "model": ...,
+#                         "production_year": ..., "convertible": ...}}
+#   {"op": "update", "car": {...}}
+#   {"op": "delete", "id": 5}
+#   {"op": "select", "id": 5}
+# An added car without id gets a new id.
+# The cars are validated by Car, and the consecutive operations of the
+# same kind are written by one add_many, update_many or delete_many.
+# A result is written to stdout as a JSON line for each operation, in the
+# order of the operations:
+#   {"line": 1, "op": "add", "id": 5, "ok": true}
+#   {"line": 2, "op": "select", "id": 5, "ok": true, "car": {...}}
+#   {"line": 3, "op": "delete", "id": 9, "ok": false, "error": "..."}
+# At most BATCH_SIZE operations are kept in memory.
+class BatchRunner:
+    BATCH_SIZE = 100
+    OPERATIONS = ('add', 'update', 'delete', 'select')
+
+    def __init__(self, db, output, batch_size=BATCH_SIZE):
+        self.db = db
+        self.output = output
+        self.batch_size = batch_size
+        self.logger = Logger(__name__).get_logger()
+        # operation and [(line number, car data)] of the writes not run yet
+        self.pending_op = None
+        self.pending = []
+        self.succeeded = 0
+        self.failed = 0
+
+    # Run the operations in the lines.
+    def run(self, lines):
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                operation, car_data = self.parse(line)
+            except ValueError as e:
+                self.flush()
+                self.emit(line_number, None, None, False, error=str(e))
+                continue
+
+            if operation == 'select' or \
+                    operation == 'add' and 'id' not in car_data:
+                self.flush()
+                self.run_one(line_number, operation, car_data)
+                continue
+
+            if operation != self.pending_op:
+                self.flush()
+            self.pending_op = operation
+            self.pending.append((line_number, car_data))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+        self.flush()
+
+    # Return the operation and the validated car data in the line.
+    # Raise ValueError if it is invalid.
+    def parse(self, line):
+        # json.JSONDecodeError is a ValueError
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError('operation is not an object')
+        operation = request.get('op')
+        if operation not in self.OPERATIONS:
+            raise ValueError('unknown op: ' + str(operation))
+
+        car_data = request.get('car', {})
+        if not isinstance(car_data, dict):
+            raise ValueError('car is not an object')
+        if 'id' in request:
+            car_data = dict(car_data, id=request['id'])
+
+        if operation in ('delete', 'select'):
+            car_id = str(car_data.get('id', ''))
+            if not car_id.isdigit():
+                raise ValueError('id is not a number')
+            return operation, {'id': int(car_id)}
+
+        new_id = operation == 'add' and car_data.get('id') is None
+        if new_id:
+            # validated with a dummy id and given a new one later
+            car_data = dict(car_data, id=0)
+        cars, errors = Car.validate_many([car_data])
+        if errors:
+            raise ValueError(errors[0][1])
+        car_data = cars[0].to_dict()
+        if new_id:
+            del car_data['id']
+        return operation, car_data
+
+    # Run the pending writes at once.
+    def flush(self):
+        if not self.pending:
+            return
+
+        cars_data = [car_data for line_number, car_data in self.pending]
+        method = getattr(self.db, self.pending_op + '_many')
+        try:
+            results = method(cars_data)
+        except Exception as e:
+            self.logger.error('%s of %d cars failed. error: %s',
+                              self.pending_op, len(cars_data), e)
+            results = [False] * len(cars_data)
+
+        for (line_number, car_data), succeeded in zip(self.pending, results):
+            self.emit(line_number, self.pending_op, car_data['id'],
+                      bool(succeeded))
+        self.pending = []
+        self.pending_op = None
+        self.output.flush()
+
+    # Run a select, or an add with a new id.
+    def run_one(self, line_number, operation, car_data):
+        try:
+            if operation == 'select':
+                car = self.db.select_a_car(car_data)
+                self.emit(line_number, operation, car_data['id'],
+                          car is not None, car=car)
+            else:
+                succeeded = self.db.add_car_with_new_id(car_data)
+                self.emit(line_number, operation, car_data.get('id'),
+                          bool(succeeded))
+
+        except Exception as e:
+            self.emit(line_number, operation, car_data.get('id'), False,
+                      error=str(e))
+
+    def emit(self, line_number, operation, car_id, succeeded, **extra):
+        if succeeded:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        result = {'line': line_number, 'op': operation, 'id': car_id,
+                  'ok': succeeded}
+        result.update((key, value) for key, value in extra.items()
+                      if value is not None)
+        self.output.write(json.dumps(result) + '\n')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dbpanel --headless',
+        description='Run the operations in NDJSON from stdin on a database.')
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--db', default='json', choices=DB_CLASSES.keys())
+    parser.add_argument('--batch-size', type=int,
+                        default=BatchRunner.BATCH_SIZE)
+    options = parser.parse_args(args)
+
+    try:
+        db = DB_CLASSES[options.db]()
+    except ServerNotReadyError:
+        Logger(__name__).get_logger().error('Server is not ready')
+        return 1
+
+    runner = BatchRunner(db, sys.stdout, options.batch_size)
+    started = time.perf_counter()
+    runner.run(sys.stdin)
+    elapsed = time.perf_counter() - started
+    if hasattr(db, 'close'):
+        db.close()
+
+    operations = runner.succeeded + runner.failed
+    # stdout has only the results
+    print('{} operations, {} failed, {:.0f} ops/sec'.format(
+        operations, runner.failed, operations / elapsed if elapsed else 0.0),
+        file=sys.stderr)
+    return 1 if runner.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+import csv
+import io
+import os
+import threading
+if __name__ == '__main__' or __name__ == 'journalcsv':
+    from accessor import CarDataAccessor
+    from accessor import Car
+    from carscsv import CarsCSV
+else:
+    from .accessor import CarDataAccessor
+    from .accessor import Car
+    from .carscsv import CarsCSV
+
+
+# CarsCSV which doesn't rewrite the csv file on every change.
+# Changes are appended to the journal file next to the csv file as
+#   add,<id>,<brand>,...
+#   update,<id>,<brand>,...
+#   delete,<id>
+# and reads merge the csv file (base) with the journal.
+# When the journal grows over compact_size bytes, it is folded into a new
+# base file in a background thread.
+#
+# Compaction renames the journal to <journal>.compacting first, so new
+# changes go to a fresh journal while the new base is written to a
+# temporary file. The temporary file replaces the base atomically, and
+# the compacting journal is removed after that. If the program stops in
+# between, the old base and the compacting journal are kept, and the
+# journal entries can be applied again as they only set or remove a row.
+class JournaledCarsCSV(CarsCSV):
+    JOURNAL_SUFFIX = '.journal'
+    COMPACTING_SUFFIX = '.compacting'
+    TEMP_SUFFIX = '.tmp'
+    # Size of the journal in bytes to start the compaction
+    COMPACT_SIZE = 1024 * 1024
+
+    def __init__(self, compact_size=COMPACT_SIZE):
+        super().__init__()
+        self.compact_size = compact_size
+        self.journal_name = self.filename + self.JOURNAL_SUFFIX
+        self.compacting_name = self.journal_name + self.COMPACTING_SUFFIX
+        # Changes in the journals. id -> car data, or None if deleted
+        self.changes = {}
+        # The largest id in the base file and the journals
+        self.max_id = 0
+        self.compactor = None
+        self.lock = threading.RLock()
+        self.load_journal()
+
+    # Read the journals into self.changes, and find the largest id in the
+    # last row of the base file and the journals.
+    # The compacting journal is older than the current journal.
+    def load_journal(self):
+        changes = {}
+        self.read_journal(self.compacting_name, changes)
+        self.read_journal(self.journal_name, changes)
+        with self.lock:
+            self.changes = changes
+            # The base file may not be made yet
+            base_id = self.last_id() if os.path.exists(self.filename) else 0
+            self.max_id = max([base_id or 0] + list(changes))
+
+    # Apply the entries in the journal file to changes.
+    # Only the lines which end with a newline are applied. The last line
+    # cut off by a crash is removed, so that the next entry is appended at
+    # the head of a line.
+    def read_journal(self, journal_name, changes):
+        try:
+            with open(journal_name, 'r+b') as journal:
+                data = journal.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    self.logger.warning('Cut off entry in %s removed: %s',
+                                        journal_name, str(data[end:]))
+                    journal.truncate(end)
+
+        except FileNotFoundError:
+            return
+
+        header = self.header
+        # decoded as open() in text mode does
+        text = io.TextIOWrapper(io.BytesIO(data[:end]), newline='')
+        try:
+            for row in csv.reader(text, delimiter=','):
+                try:
+                    if len(row) == 2 and row[0] == 'delete':
+                        changes[int(row[1])] = None
+                        continue
+                    if len(row) == len(header) + 1 \
+                            and row[0] in ('add', 'update'):
+                        changes[int(row[1])] = dict(zip(header, row[1:]))
+                        continue
+                except ValueError:
+                    pass
+                self.logger.warning('Broken journal entry in %s: %s',
+                                    journal_name, str(row))
+
+        except csv.Error as e:
+            self.logger.warning('Broken journal entry in %s: %s',
+                                journal_name, e)
+
+    # Append an entry to the journal.
+    # Return True if succeeded else False.
+    def append(self, operation, car_data: dict) -> bool:
+        return self.append_many(operation, [car_data])
+
+    # Append the entries for the cars to the journal at once.
+    # Return True if succeeded else False.
+    def append_many(self, operation, cars_data: list) -> bool:
+        rows = []
+        for car_data in cars_data:
+            if operation == 'delete':
+                rows.append([operation, str(car_data['id'])])
+            else:
+                rows.append([operation] + [str(car_data[attr])
+                                           for attr in self.header])
+
+        with self.lock:
+            try:
+                with open(self.journal_name, 'a', newline='') as journal:
+                    csv.writer(journal,
+                               quoting=csv.QUOTE_MINIMAL).writerows(rows)
+                    # The change is kept after a power failure when this
+                    # returns
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                    journal_size = journal.tell()
+
+            except OSError as e:
+                self.logger.error('Append to %s failed. error: %s',
+                                  self.journal_name, e.strerror)
+                return False
+
+            for row in rows:
+                if operation == 'delete':
+                    self.changes[int(row[1])] = None
+                else:
+                    self.changes[int(row[1])] = dict(zip(self.header,
+                                                         row[1:]))
+                    self.max_id = max(self.max_id, int(row[1]))
+
+        if journal_size >= self.compact_size:
+            self.start_compaction()
+        return True
+
+    # Yield the cars in rows replaced by the changes, in id order.
+    # rows must be sorted by id.
+    def merge(self, rows, changes: dict):
+        changed_ids = sorted(changes)
+        index = 0
+        for car in rows:
+            car_id = int(car['id'])
+            # cars added before this row
+            while index < len(changed_ids) and changed_ids[index] < car_id:
+                if changes[changed_ids[index]] is not None:
+                    yield changes[changed_ids[index]]
+                index += 1
+
+            if index < len(changed_ids) and changed_ids[index] == car_id:
+                if changes[car_id] is not None:
+                    yield changes[car_id]
+                index += 1
+            else:
+                yield car
+
+        # cars added after the last row
+        for car_id in changed_ids[index:]:
+            if changes[car_id] is not None:
+                yield changes[car_id]
+
+    # Start the compaction in a background thread if it isn't running.
+    def start_compaction(self):
+        with self.lock:
+            if self.compactor is not None and self.compactor.is_alive():
+                return
+
+            self.compactor = threading.Thread(target=self.compact,
+                                              daemon=True)
+            self.compactor.start()
+
+    # Fold the journal into a new base file.
+    # Return True if succeeded else False.
+    def compact(self) -> bool:
+        with self.lock:
+            # A compacting journal left by a crash is folded first,
+            # and the current journal is left for the next time.
+            if not os.path.exists(self.compacting_name):
+                if not os.path.exists(self.journal_name):
+                    return True
+                os.replace(self.journal_name, self.compacting_name)
+
+        changes = {}
+        self.read_journal(self.compacting_name, changes)
+        temp_name = self.filename + self.TEMP_SUFFIX
+        try:
+            with open(temp_name, 'w', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile,
+                                        fieldnames=self.header,
+                                        quoting=csv.QUOTE_MINIMAL)
+                writer.writeheader()
+                writer.writerows(self.merge(super().iter_cars(), changes))
+                csvfile.flush()
+                os.fsync(csvfile.fileno())
+
+            with self.lock:
+                os.replace(temp_name, self.filename)
+                os.remove(self.compacting_name)
+                self.load_journal()
+
+        except OSError as e:
+            self.logger.error('Compaction of %s failed. error: %s',
+                              self.filename, e.strerror)
+            return False
+
+        self.logger.info('%d changes compacted into %s',
+                         len(changes), self.filename)
+        return True
+
+    # Wait for the running compaction.
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.join()
+
+    # Newly create the csv file and discard the journals.
+    def create(self, cars: list) -> bool:
+        with self.lock:
+            if not super().create(cars):
+                return False
+
+            for journal_name in (self.compacting_name, self.journal_name):
+                if os.path.exists(journal_name):
+                    os.remove(journal_name)
+            self.changes = {}
+            self.max_id = self.last_id() or 0
+            return True
+
+    def get_cars_list(self) -> list:
+        return list(self.iter_cars())
+
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        with self.lock:
+            changes = {car_id: car for car_id, car in self.changes.items()
+                       if start_after_id is None
+                       or car_id > int(start_after_id)}
+            rows = super().iter_cars(page_size, start_after_id)
+
+        yield from self.merge(rows, changes)
+
+    def count_cars(self) -> int:
+        return sum(1 for car in self.iter_cars())
+
+    # The id index of the base file doesn't know the journal,
+    # so the merged rows are paged.
+    def get_cars_page(self, start: int, count: int) -> list:
+        return CarDataAccessor.get_cars_page(self, start, count)
+
+    # The secondary indexes of the base file don't know the journal,
+    # so the merged rows are searched.
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        return CarDataAccessor.find(self, sort, limit, **criteria)
+
+    # Return the car data with the id from the journal or the base file.
+    # Return None if not found.
+    def find_car(self, car_id: int) -> dict:
+        with self.lock:
+            if car_id in self.changes:
+                return self.changes[car_id]
+
+        # The base file is looked up in its id index
+        return self.find_row(car_id)
+
+    # The ids in the journal are not in the last row of the base file,
+    # so the largest id is kept as the journal is read and appended.
+    # A deleted largest id isn't given again until the next compaction.
+    def new_id(self) -> int:
+        with self.lock:
+            return self.max_id + 1
+
+    def add_car_with_new_id(self, car_data: dict) -> bool:
+        # Hold the lock so that the id isn't taken by another thread
+        with self.lock:
+            return CarDataAccessor.add_car_with_new_id(self, car_data)
+
+    # Check the cars with the ids in the base file and the journal,
+    # and append the entries at once.
+    def change_many(self, operation, cars_data, all_or_nothing) -> list:
+        with self.lock:
+            ids = {int(car['id']) for car in self.iter_cars()}
+            results = self.check_many(operation, cars_data, ids)
+            if all_or_nothing and not all(results):
+                return [False] * len(results)
+
+            cars_to_write = [car_data for car_data, succeeded
+                             in zip(cars_data, results) if succeeded]
+            if cars_to_write and not self.append_many(operation,
+                                                      cars_to_write):
+                return [False] * len(results)
+            return results
+
+    def add_new_car(self, car_data: dict) -> bool:
+        # Hold the lock so that the id isn't added by another thread
+        with self.lock:
+            if self.find_car(int(car_data['id'])) is not None:
+                self.logger.error('car id: %s already exists',
+                                  str(car_data['id']))
+                return False
+
+            if not self.append('add', car_data):
+                return False
+
+        self.logger.info('Car id: %s added', str(car_data['id']))
+        return True
+
+    def delete_a_car(self, car_data: dict) -> bool:
+        if self.find_car(int(car_data['id'])) is None:
+            self.logger.error('car id: %s not found', str(car_data['id']))
+            return False
+
+        return self.append('delete', car_data)
+
+    def select_a_car(self, car_data: dict) -> dict:
+        car_found = self.find_car(int(car_data['id']))
+        return None if car_found is None else Car(car_found).to_dict()
+
+    def update_a_car(self, car_data: dict) -> bool:
+        if self.find_car(int(car_data['id'])) is None:
+            self.logger.error('car id %s not found', str(car_data['id']))
+            return False
+
+        if not self.append('update', car_data):
+            return False
+
+        self.logger.info('update success id: %s', str(car_data['id']))
+        return True
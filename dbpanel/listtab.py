@@ -1,59 +1,391 @@
+import bisect
+import shlex
+import time
 import tkinter as tk
 from tkinter import ttk
+if __name__ == '__main__' or __name__ == 'listtab':
+    from accessor import Car
+    from cartable import CarTable
+else:
+    from .accessor import Car
+    from .cartable import CarTable
 
 
 # Tab page in the panel where all data fields are listed.
 # When a row is clicked in the list, its data is read into
 # CarsPanel.__current_car_data.
+#
+# Only the rows in the viewport are kept as Treeview items.
+# Rows are paged in from the database when the list is scrolled,
+# so the number of rows doesn't affect the rendering time and memory.
+#
+# The filter box above the list takes criteria such as
+#   brand=Fiat production_year_gte=1960 spider
+# where the words without '=' are searched in all attributes.
+# Only the matching cars are fetched from the database.
 class ListTab():
+    # Number of rows shown in the viewport
+    VISIBLE_ROWS = 20
+    # Number of rows fetched in advance above and below the viewport
+    OVERSCAN = 40
+
     def __init__(self, panel):
         self.tab = panel.make_tab('List cars')
         self.car_table = None
+        self.scroll_bar = None
         self.panel = panel
+        # Number of rows in the database
+        self.total = 0
+        # Index of the row shown at the top of the viewport
+        self.top = 0
+        # Rows fetched from the database and the index of the first one
+        self.window_start = 0
+        self.window_rows = []
+        # id of the selected row, kept while the list is scrolled
+        self.selected_id = None
+        # values shown in each Treeview item
+        self.rendered = []
+        # CarTable shown instead of the database
+        self.table = None
+        # Criteria of the filter shown in the list, or None
+        self.criteria = None
+        # When the running list_cars was called, to record its latency
+        self.list_started = None
+        self.painted = False
+        self.filter_text = tk.StringVar()
+        self.make_filter_box()
         self.list_frame = tk.Frame(self.tab)
         self.list_frame.pack()
         self.list_cars()
 
     # Show the treeview table on list_frame.
-    # The table is filled with the data retrieved from database.
-    def list_cars(self):
+    # The table is filled with the data retrieved from database, or
+    # with the rows of table if a CarTable is given.
+    # The data is retrieved in the worker, and a refresh requested while
+    # the previous one is running replaces it.
+    def list_cars(self, table=None):
+        if self.car_table is None:
+            self.make_table()
+
+        if table is None:
+            self.criteria = None
+        if table is not self.table:
+            self.table = table
+            self.top = 0
+
+        # Rows being fetched for scrolling may be older than this refresh
+        self.panel.worker.cancel('list-page')
+        self.list_started = time.perf_counter()
+        self.panel.worker.submit(self.fetch_list,
+                                 max(0, self.top - self.OVERSCAN),
+                                 callback=self.show_list,
+                                 key='list')
+
+    # Run in the worker.
+    # Return the number of rows and the rows from start.
+    def fetch_list(self, start):
+        total = self.source().count_cars()
+        rows = self.source().get_cars_page(
+            start,
+            self.VISIBLE_ROWS + self.OVERSCAN * 2
+            )
+        return total, start, rows
+
+    # Return where the rows are retrieved from
+    def source(self):
+        return self.panel.db if self.table is None else self.table
+
+    # result is None if fetch_list raised
+    def show_list(self, result):
+        total, start, rows = (None, self.window_start, None) \
+            if result is None else result
+        self.total = 0 if total is None else total
+        self.window_start = start
+        self.window_rows = [] if rows is None else rows
+        self.top = self.clamp_top(self.top)
+        self.render()
+        # Timed from list_cars until the rows are rendered
+        self.panel.metrics.record('list_cars',
+                                  time.perf_counter() - self.list_started,
+                                  failed=total is None or rows is None)
+        if not self.painted:
+            self.painted = True
+            self.panel.first_paint()
+
+    # Reflect a change made by the panel without fetching all rows again.
+    # change is 'add', 'update' or 'delete', and car is the changed data.
+    # Rows are sorted by id, so the position of the car is found in the
+    # fetched rows, and only the Treeview items which changed are updated.
+    def apply_change(self, change, car):
+        if self.car_table is None:
+            return
+
+        if self.criteria is not None:
+            # The changed car may or may not match the filter
+            self.filter_cars()
+            return
+
+        if self.table is not None:
+            # The rows of a CarTable may not be in id order,
+            # so show the database again.
+            self.list_cars()
+            return
+
+        # Rows being fetched for scrolling may be older than this change
+        self.panel.worker.cancel('list-page')
+        car_id = int(car['id'])
+        ids = [int(row['id']) for row in self.window_rows]
+        # position of the car in the fetched rows
+        position = bisect.bisect_left(ids, car_id)
+        found = position < len(ids) and ids[position] == car_id
+        window_end = self.window_start + len(self.window_rows)
+
+        if change == 'update':
+            if found:
+                self.window_rows[position] = car
+        elif change == 'delete':
+            self.total = max(self.total - 1, 0)
+            if found:
+                del self.window_rows[position]
+            elif ids and car_id < ids[0]:
+                # the row was before the fetched rows
+                self.window_start -= 1
+        elif change == 'add':
+            self.total += 1
+            if not ids:
+                # nothing fetched yet
+                pass
+            elif position == 0 and self.window_start > 0:
+                # the row is before the fetched rows
+                self.window_start += 1
+            elif position < len(ids) or window_end == self.total - 1:
+                # the row is among the fetched rows or at the end of table
+                self.window_rows.insert(position, car)
+
+        self.top = self.clamp_top(self.top)
+        self.render()
+
+    def make_filter_box(self):
+        filter_frame = tk.Frame(self.tab)
+        filter_frame.pack(fill=tk.X)
+        tk.Label(filter_frame, text='Filter').pack(side=tk.LEFT)
+        filter_entry = tk.Entry(filter_frame,
+                                textvariable=self.filter_text,
+                                width=60)
+        filter_entry.bind('<Return>', lambda event: self.filter_cars())
+        filter_entry.pack(side=tk.LEFT)
+        filter_button = tk.Button(filter_frame, text='Filter',
+                                  command=lambda: self.filter_cars())
+        filter_button.pack(side=tk.LEFT)
+
+    # Show the cars matching the text in the filter box,
+    # or all cars if the filter box is empty.
+    def filter_cars(self):
+        self.criteria = self.parse_filter(self.filter_text.get())
+        if not self.criteria:
+            self.criteria = None
+            self.list_cars()
+            return
+
+        self.panel.worker.cancel('list-page')
+        self.panel.worker.submit(self.fetch_filtered, self.criteria,
+                                 callback=self.show_filtered,
+                                 key='list')
+
+    # Return the criteria of CarDataAccessor.find() in the filter text.
+    # key=value is a criterion if key is an attribute or an attribute
+    # with _gte or _lte, and the other words are searched with q.
+    def parse_filter(self, text) -> dict:
+        try:
+            words = shlex.split(text)
+        except ValueError:
+            # unbalanced quotes
+            words = text.split()
+
+        attributes = self.car_table['columns']
+        criteria = {}
+        texts = []
+        for word in words:
+            key, equal, value = word.partition('=')
+            base = key[:-4] if key.endswith(('_gte', '_lte')) else key
+            if equal and base in attributes:
+                criteria[key] = value
+            else:
+                texts.append(word)
+
+        if texts:
+            criteria['q'] = ' '.join(texts)
+        return criteria
+
+    # Run in the worker.
+    # Return the CarTable of the cars matching criteria, or None if failed.
+    def fetch_filtered(self, criteria):
+        cars = self.panel.db.find(**criteria)
+        if cars is None:
+            return None
+
+        valid_cars, errors = Car.validate_many(cars)
+        table = CarTable()
+        table.extend(valid_cars)
+        return table
+
+    def show_filtered(self, table):
+        if table is None:
+            self.panel.logger.error('Filter failed: %s', str(self.criteria))
+            return
+        self.list_cars(table)
+
+    def make_table(self):
         # Make the header of table with the keys of dictionary data.
         columns = self.panel.get_car_attributes()
-        if self.car_table is None:
-            # reference :
-            # https://office54.net/python/tkinter/ttk-treeview-table
-            #
-            # Show headings of the table.
-            self.car_table = ttk.Treeview(self.list_frame,
-                                          columns=columns,
-                                          show='headings'
-                                          )
-            for column in columns:
-                if column == 'id':
-                    self.car_table.heading(column, text=column,
-                                           anchor=tk.CENTER)
-                    self.car_table.column(column, anchor=tk.CENTER, width=50)
-                else:
-                    self.car_table.heading(column, text=column, anchor=tk.W)
-                    self.car_table.column(column, anchor=tk.W, width=150)
-
-            # selected row data is read into CarsPanel.current_car_data .
-            self.car_table.bind('<<TreeviewSelect>>',
-                                self.panel.fill_current_car_data)
-            self.car_table.pack()
-        else:
-            # Clean up the old data in the table
-            self.car_table.delete(*self.car_table.get_children())
+        # reference :
+        # https://office54.net/python/tkinter/ttk-treeview-table
+        #
+        # Show headings of the table.
+        self.car_table = ttk.Treeview(self.list_frame,
+                                      columns=columns,
+                                      show='headings',
+                                      height=self.VISIBLE_ROWS
+                                      )
+        for column in columns:
+            if column == 'id':
+                self.car_table.heading(column, text=column,
+                                       anchor=tk.CENTER)
+                self.car_table.column(column, anchor=tk.CENTER, width=50)
+            else:
+                self.car_table.heading(column, text=column, anchor=tk.W)
+                self.car_table.column(column, anchor=tk.W, width=150)
+
+        # selected row data is read into CarsPanel.current_car_data .
+        self.car_table.bind('<<TreeviewSelect>>', self.select_row)
+
+        # The scroll bar moves the viewport over all rows in the database,
+        # not over the items in the Treeview.
+        self.scroll_bar = ttk.Scrollbar(self.list_frame,
+                                        orient=tk.VERTICAL,
+                                        command=self.yview)
+        # Mouse wheel on Windows/macOS and on X11
+        self.car_table.bind('<MouseWheel>',
+                            lambda event: self.scroll(
+                                -1 if event.delta > 0 else 1))
+        self.car_table.bind('<Button-4>', lambda event: self.scroll(-1))
+        self.car_table.bind('<Button-5>', lambda event: self.scroll(1))
+
+        self.car_table.pack(side=tk.LEFT)
+        self.scroll_bar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    # Called by the scroll bar with ('moveto', fraction) or
+    # ('scroll', number, 'units' or 'pages').
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.move_to(int(float(args[1]) * self.total))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            if args[2] == 'pages':
+                step *= self.VISIBLE_ROWS
+            self.move_to(self.top + step)
+
+    # Scroll the viewport by the given number of rows.
+    # Return 'break' not to let the Treeview scroll by itself.
+    def scroll(self, step):
+        self.move_to(self.top + step * 3)
+        return 'break'
+
+    def move_to(self, top):
+        top = self.clamp_top(top)
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def clamp_top(self, top):
+        return max(0, min(top, self.total - self.VISIBLE_ROWS))
 
-        # Retrieve all data from the database
-        cars = self.panel.db.get_cars_list()
+    # Return True if the rows in the viewport are already fetched.
+    def viewport_fetched(self):
+        end = min(self.top + self.VISIBLE_ROWS, self.total)
+        window_end = self.window_start + len(self.window_rows)
+        return self.window_start <= self.top and end <= window_end
+
+    # Fetch the rows around the viewport in the worker.
+    # Scrolling while fetching replaces the previous fetch.
+    def fetch_rows(self):
+        start = max(0, self.top - self.OVERSCAN)
+        self.panel.worker.submit(self.source().get_cars_page,
+                                 start,
+                                 self.VISIBLE_ROWS + self.OVERSCAN * 2,
+                                 callback=lambda rows:
+                                 self.show_rows(start, rows),
+                                 key='list-page')
+
+    def show_rows(self, start, rows):
+        if rows is None:
+            return
+
+        self.window_start = start
+        self.window_rows = rows
+        # Show the rows even if the table got shorter than expected
+        self.render(fetch=False)
+
+    # Fill the items in the Treeview with the rows in the viewport.
+    # The items are reused and only their values are replaced.
+    # The rows are fetched first when they aren't fetched yet.
+    def render(self, fetch=True):
+        if fetch and not self.viewport_fetched():
+            self.update_scroll_bar(self.VISIBLE_ROWS)
+            self.fetch_rows()
+            return
+
+        offset = max(0, self.top - self.window_start)
+        rows = self.window_rows[offset:offset + self.VISIBLE_ROWS]
+        items = self.car_table.get_children()
+
+        # Remove the items left over from a longer list
+        if len(items) > len(rows):
+            self.car_table.delete(*items[len(rows):])
+            del self.rendered[len(rows):]
+
+        selected_item = None
+        for index, car in enumerate(rows):
+            values = tuple(str(value) for value in car.values())
+            item = str(index)
+            if index < len(items):
+                # Touch the item only when its values are changed
+                if self.rendered[index] != values:
+                    self.car_table.item(item, values=values)
+                    self.rendered[index] = values
+            else:
+                # insert the data of a row into the bottm of the table
+                self.car_table.insert(parent='',
+                                      index='end',
+                                      iid=item,
+                                      values=values
+                                      )
+                self.rendered.append(values)
+            if str(car['id']) == self.selected_id:
+                selected_item = item
+
+        # Keep the selection on the same car while scrolling
+        if selected_item is None:
+            if self.car_table.selection():
+                self.car_table.selection_set(())
+        elif self.car_table.selection() != (selected_item,):
+            self.car_table.selection_set(selected_item)
+            self.car_table.focus(selected_item)
+
+        self.update_scroll_bar(len(rows))
+
+    def update_scroll_bar(self, shown_rows):
+        if self.total > 0:
+            self.scroll_bar.set(self.top / self.total,
+                                min(self.top + shown_rows, self.total)
+                                / self.total)
+        else:
+            self.scroll_bar.set(0, 1)
 
-        # Adjust the height of the Treeview with the number of rows
-        self.car_table.config(height=len(cars))
+    def select_row(self, event):
+        selection = self.car_table.selection()
+        if not selection:
+            return
 
-        for car in cars:
-            # insert the data of a row into the bottm of the table
-            self.car_table.insert(parent='',
-                                  index='end',
-                                  values=tuple(car.values())
-                                  )
+        self.selected_id = str(self.car_table.set(selection[0], 'id'))
+        self.panel.fill_current_car_data(event)
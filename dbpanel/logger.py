@@ -1,20 +1,92 @@
+import atexit
+import configparser
 import logging
+import logging.handlers
+import queue
+import threading
 
 
+# Loggers of the modules share one QueueHandler, so logging a message only
+# puts it in a queue. A QueueListener thread writes the messages to the
+# console and the log file, and the Tk thread never waits for them.
+#
+# The level and the log file are read from the [Logging] section of
+# dbpanel.ini when the first Logger is made:
+#   [Logging]
+#   level = INFO            DEBUG, INFO, WARNING, ERROR or CRITICAL
+#   file = dbpanel.log      no log file if empty
+#   max_bytes = 1048576     the file is rotated at this size
+#   backup_count = 3        number of the rotated files kept
+#   console = yes           write to the console too
 class Logger:
     LOG_FORMAT = '%(asctime)s:%(name)s:%(levelname)s:%(message)s'
+    CONFIG_FILE = './dbpanel.ini'
+    SECTION = 'Logging'
+    DEFAULT = {
+        'level': 'INFO',
+        'file': '',
+        'max_bytes': str(1024 * 1024),
+        'backup_count': '3',
+        'console': 'yes',
+    }
+    # Set up by the first Logger and shared by all loggers
+    queue_handler = None
+    listener = None
+    level = logging.INFO
+    setup_lock = threading.Lock()
 
     def __init__(self, name):
+        self.setup()
         logger = logging.getLogger(name)
-        logger.setLevel(logging.DEBUG)
-        log_handler = logging.StreamHandler()
-        # log_handler = logging.FileHandler('dbpanel.log', 'a')
-        log_formatter = logging.Formatter(self.LOG_FORMAT)
-        log_handler.setFormatter(log_formatter)
-        log_handler.setLevel(logging.DEBUG)
-        logger.addHandler(log_handler)
+        # Debug messages cost only this level check when they are disabled
+        logger.setLevel(Logger.level)
+        # The same logger is got again by other instances
+        if Logger.queue_handler not in logger.handlers:
+            logger.addHandler(Logger.queue_handler)
         self.logger = logger
 
+    # Make the handlers and start the listener thread once.
+    @classmethod
+    def setup(cls, config_file=CONFIG_FILE):
+        with cls.setup_lock:
+            if cls.queue_handler is not None:
+                return
+
+            config = configparser.ConfigParser()
+            config.read_dict({cls.SECTION: cls.DEFAULT})
+            # dbpanel.ini may not exist yet
+            config.read(config_file)
+            settings = config[cls.SECTION]
+            cls.level = logging.getLevelName(settings['level'].upper())
+            if not isinstance(cls.level, int):
+                cls.level = logging.INFO
+
+            formatter = logging.Formatter(cls.LOG_FORMAT)
+            handlers = []
+            if settings.getboolean('console'):
+                handlers.append(logging.StreamHandler())
+            if settings['file']:
+                handlers.append(logging.handlers.RotatingFileHandler(
+                    settings['file'],
+                    maxBytes=settings.getint('max_bytes'),
+                    backupCount=settings.getint('backup_count'),
+                    encoding='utf-8'))
+            for handler in handlers:
+                handler.setFormatter(formatter)
+
+            log_queue = queue.SimpleQueue()
+            cls.listener = logging.handlers.QueueListener(log_queue,
+                                                          *handlers)
+            cls.listener.start()
+            cls.queue_handler = logging.handlers.QueueHandler(log_queue)
+            # Write the messages left in the queue at exit
+            atexit.register(cls.shutdown)
+
+    @classmethod
+    def shutdown(cls):
+        if cls.listener is not None:
+            cls.listener.stop()
+
     def get_logger(self):
         return self.logger
 
@@ -31,6 +31,9 @@ class MenuBar():
 
     def add_file_menu(self):
         self.sub_menu_file = self.make_submenu('File', underline=0)
+        self.sub_menu_file.add_command(label='Save metrics',
+                                       underline=0,
+                                       command=self.panel.save_metrics)
         self.sub_menu_file.add_command(label='Quit',
                                        underline=0,
                                        command=lambda: self.parent.destroy())
@@ -0,0 +1,200 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+# Counts and latencies of an operation.
+# The latencies are counted in a histogram for the whole run, and the
+# latest ones are kept to tell the rolling percentiles.
+class OperationMetrics:
+    # Upper bounds of the histogram buckets in milliseconds.
+    # The last bucket counts the latencies over the last bound.
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+               1000, 2500, 5000, 10000)
+    # Number of the latest latencies for the rolling percentiles
+    ROLLING = 200
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+        self.recent = deque(maxlen=self.ROLLING)
+
+    # failed is True if the operation failed, or the number of the items
+    # which failed in a bulk operation.
+    def record(self, seconds, failed):
+        milliseconds = seconds * 1000
+        self.count += 1
+        self.errors += int(failed)
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+        self.histogram[bisect.bisect_left(self.BUCKETS, milliseconds)] += 1
+        self.recent.append(milliseconds)
+
+    # Return the percentile of the latest latencies in milliseconds
+    def percentile(self, percent) -> float:
+        recent = sorted(self.recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * percent / 100))]
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total / self.count if self.count else None,
+            'max_ms': self.max,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            # '<=bound' -> count, and '>last bound' -> count
+            'histogram': {
+                ('<={}'.format(bound) if index < len(self.BUCKETS)
+                 else '>{}'.format(self.BUCKETS[-1])): count
+                for index, (bound, count) in enumerate(
+                    zip(self.BUCKETS + (None,), self.histogram))
+                if count
+            },
+        }
+
+
+# Registry of the metrics of the operations by their names.
+# Operations are recorded from the worker threads and read in the
+# mainloop, so the registry is locked.
+class Metrics:
+    def __init__(self):
+        self.operations = {}
+        # (name, milliseconds, failed) of the last recorded operation
+        self.last = None
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, failed=False):
+        with self.lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = OperationMetrics()
+            operation.record(seconds, failed)
+            self.last = (name, seconds * 1000, failed)
+
+    # Record the time spent in the with block.
+    # It is recorded as failed when an exception is raised.
+    def timer(self, name):
+        return Timer(self, name)
+
+    # Return the rolling percentile of the operation in milliseconds,
+    # or None if it isn't recorded yet.
+    def percentile(self, name, percent) -> float:
+        with self.lock:
+            operation = self.operations.get(name)
+            return None if operation is None else operation.percentile(percent)
+
+    # Return the text of the last operation and its rolling percentiles
+    # for the status bar, or None if nothing is recorded yet.
+    def status(self) -> str:
+        with self.lock:
+            if self.last is None:
+                return None
+            name, milliseconds, failed = self.last
+            operation = self.operations[name]
+            if failed is True or failed == 1:
+                failed_text = ' failed'
+            elif failed:
+                failed_text = ' {} failed'.format(failed)
+            else:
+                failed_text = ''
+            return '{}{} {:.1f} ms    p50 {:.1f} ms    p95 {:.1f} ms'.format(
+                name, failed_text, milliseconds,
+                operation.percentile(50), operation.percentile(95))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {name: operation.to_dict()
+                    for name, operation in sorted(self.operations.items())}
+
+    # Write the metrics of all operations to the file as JSON.
+    # Return True if succeeded else False.
+    def dump(self, filename) -> bool:
+        temp_name = filename + '.tmp'
+        try:
+            with open(temp_name, 'w') as metrics_file:
+                json.dump({'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           'operations': self.snapshot()},
+                          metrics_file, indent=2)
+            os.replace(temp_name, filename)
+            return True
+
+        except OSError:
+            return False
+
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.started,
+                            failed=exc_type is not None)
+        return False
+
+
+# Wrapper of a CarDataAccessor which records the calls of its methods
+# in metrics as 'db.<method>'.
+# A call is counted as an error when it raises an exception, or when a read
+# returns None as the backends do when they fail. The False items in the
+# results of a bulk change are counted as errors.
+# A change returning False, such as for an id which already exists, and
+# select_a_car not finding the car are not errors.
+# iter_cars isn't recorded as it returns a stream.
+class MeteredAccessor:
+    READ_METHODS = ('attributes', 'get_cars_list', 'count_cars',
+                    'get_cars_page', 'find', 'new_id')
+    BULK_METHODS = ('add_many', 'update_many', 'delete_many')
+    METHODS = READ_METHODS + BULK_METHODS + (
+        'add_car_with_new_id', 'add_new_car', 'delete_a_car',
+        'select_a_car', 'update_a_car')
+
+    def __init__(self, db, metrics: Metrics):
+        self.db = db
+        self.metrics = metrics
+        self.CONCURRENCY = db.CONCURRENCY
+
+    def __getattr__(self, name):
+        attribute = getattr(self.db, name)
+        if name not in self.METHODS:
+            return attribute
+
+        @functools.wraps(attribute)
+        def metered(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except BaseException:
+                self.metrics.record('db.' + name,
+                                    time.perf_counter() - started, True)
+                raise
+            self.metrics.record('db.' + name, time.perf_counter() - started,
+                                self.count_errors(name, result))
+            return result
+
+        # Keep the wrapper not to make it on every call
+        setattr(self, name, metered)
+        return metered
+
+    # Return the number of the errors in the result of the method.
+    def count_errors(self, name, result) -> int:
+        if name in self.READ_METHODS:
+            return int(result is None)
+        if name in self.BULK_METHODS:
+            return 0 if result is None else sum(not item for item in result)
+        return 0
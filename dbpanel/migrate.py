@@ -0,0 +1,241 @@
+import argparse
+import itertools
+import json
+import os
+import time
+# __name__ is '__main__' also in python -m dbpanel.migrate,
+# so the package tells if this is run as a script in dbpanel/
+if not __package__:
+    from backends import DB_CLASSES
+    from accessor import Car
+    from accessor import ServerNotReadyError
+    from logger import Logger
+else:
+    from .backends import DB_CLASSES
+    from .accessor import Car
+    from .accessor import ServerNotReadyError
+    from .logger import Logger
+
+
+class MigrationError(Exception):
+    pass
+
+
+# Copy all cars from one database to another chunk by chunk.
+#
+#   $ python -m dbpanel.migrate --from json --to csv
+#
+# The id of the last copied car is saved in the checkpoint file after
+# every chunk, so an interrupted migration resumes from there when the
+# same command is run again.
+# The checkpoint doesn't go past a car which failed, and the failed ids
+# are saved in it too. The checkpoint is kept when any car failed, so the
+# next run copies again from the first failed car.
+# A target which already has cars is written only when the migration is
+# resumed, or run with restart or force.
+class Migration:
+    CHUNK_SIZE = 1000
+    CHECKPOINT_FILE = 'migrate.checkpoint'
+
+    def __init__(self, source_name, target_name,
+                 chunk_size=CHUNK_SIZE, checkpoint_file=CHECKPOINT_FILE):
+        if source_name == target_name:
+            raise MigrationError('cannot copy {} to itself'.format(
+                source_name))
+        self.logger = Logger(__name__).get_logger()
+        self.source_name = source_name
+        self.target_name = target_name
+        self.source = DB_CLASSES[source_name]()
+        self.target = DB_CLASSES[target_name]()
+        self.chunk_size = chunk_size
+        self.checkpoint_file = checkpoint_file
+        self.copied = 0
+        self.failed = 0
+        # ids of the cars which failed in this run
+        self.failed_ids = []
+
+    # Return the checkpoint of this migration, which has the id of the last
+    # copied car, or None if there is no checkpoint for this migration.
+    def read_checkpoint(self) -> dict:
+        try:
+            with open(self.checkpoint_file, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+
+        except (OSError, ValueError):
+            return None
+
+        if (checkpoint.get('from') != self.source_name
+                or checkpoint.get('to') != self.target_name):
+            self.logger.info('Checkpoint for another migration is ignored')
+            return None
+
+        self.copied = checkpoint['copied']
+        self.failed = checkpoint['failed']
+        return checkpoint
+
+    # Save the progress. The file is replaced at once so that
+    # a broken checkpoint is never left.
+    def write_checkpoint(self, last_id, copied, failed):
+        temp_name = self.checkpoint_file + '.tmp'
+        with open(temp_name, 'w') as checkpoint_file:
+            json.dump({'from': self.source_name,
+                       'to': self.target_name,
+                       'last_id': last_id,
+                       'copied': copied,
+                       'failed': failed,
+                       'failed_ids': self.failed_ids,
+                       }, checkpoint_file)
+        os.replace(temp_name, self.checkpoint_file)
+
+    # Copy the cars and return the number of cars copied per second.
+    # Raise MigrationError if the target has cars and the migration is not
+    # resumed, restarted or forced, or if not all cars are read from the
+    # source.
+    def run(self, restart=False, force=False) -> float:
+        checkpoint = None if restart else self.read_checkpoint()
+        if checkpoint is None:
+            if not (restart or force) and self.target.count_cars():
+                raise MigrationError(
+                    '{} has cars already, run with restart or force to '
+                    'write into it'.format(self.target_name))
+            self.copied = self.failed = 0
+            last_id = None
+            # forced to write into the cars of the target
+            replace = restart or not force
+        else:
+            last_id = checkpoint['last_id']
+            # replaced from the first car again
+            replace = last_id is None
+            self.logger.info('Resume after id: %s', str(last_id))
+
+        started = time.perf_counter()
+        copied_before = self.copied
+        # (last id, copied, failed) saved in the checkpoint, which stays
+        # before the first failed car in this run
+        progress = (last_id, self.copied, self.failed)
+        held = False
+        first_chunk = True
+        cars = self.source.iter_cars(page_size=self.chunk_size,
+                                     start_after_id=last_id)
+        while True:
+            chunk = list(itertools.islice(cars, self.chunk_size))
+            if not chunk:
+                break
+
+            cars_data, invalid = self.validate(chunk)
+            if first_chunk and replace and hasattr(self.target, 'create'):
+                # Start a new csv file with the first chunk
+                results = ([True] * len(cars_data)
+                           if self.target.create(cars_data)
+                           else [False] * len(cars_data))
+            else:
+                results = self.write(cars_data)
+            first_chunk = False
+
+            # results of the cars in the chunk, with the invalid ones
+            results = iter(results)
+            results = [index not in invalid and next(results)
+                       for index in range(len(chunk))]
+            failed = [index for index, succeeded in enumerate(results)
+                      if not succeeded]
+            self.failed_ids += [chunk[index]['id'] for index in failed]
+
+            if not held:
+                if failed:
+                    held = True
+                    # copied up to the car before the first failed one
+                    if failed[0] > 0:
+                        progress = (chunk[failed[0] - 1]['id'],
+                                    self.copied + failed[0], self.failed)
+                else:
+                    progress = (chunk[-1]['id'],
+                                self.copied + len(chunk), self.failed)
+            self.copied += len(chunk) - len(failed)
+            self.failed += len(failed)
+            self.write_checkpoint(*progress)
+
+            elapsed = time.perf_counter() - started
+            self.logger.info('%d cars copied, %d failed, %.0f rows/sec',
+                             self.copied, self.failed,
+                             (self.copied - copied_before) / elapsed)
+
+        # A page of the source which failed to load ends the cars early,
+        # so the cars read are checked with the number of the cars.
+        # The checkpoint is kept to resume from there.
+        total = self.source.count_cars()
+        if total is None or self.copied + self.failed < total:
+            raise MigrationError(
+                '{} of {} cars read from {}, run again to resume from '
+                'id after {}'.format(self.copied + self.failed, total,
+                                     self.source_name, progress[0]))
+
+        if self.failed_ids:
+            self.logger.error('%d cars failed, ids: %s. Run again to copy '
+                              'them from id after %s',
+                              len(self.failed_ids),
+                              ', '.join(map(str, self.failed_ids)),
+                              str(progress[0]))
+        elif os.path.exists(self.checkpoint_file):
+            # Finished, so the next run starts over
+            os.remove(self.checkpoint_file)
+        elapsed = time.perf_counter() - started
+        return (self.copied - copied_before) / elapsed if elapsed else 0.0
+
+    # Convert the rows to the car data of the right types.
+    # Invalid rows are not copied and counted as failed.
+    # Return the car data and the set of the indexes of the invalid rows.
+    def validate(self, chunk: list):
+        cars, errors = Car.validate_many(chunk)
+        for index, reason in errors:
+            self.logger.error('Invalid car: %s, %s', str(chunk[index]), reason)
+        return ([car.to_dict() for car in cars],
+                {index for index, reason in errors})
+
+    # Add the cars to the target. The cars which already exist, such as
+    # the ones copied just before the interruption, are updated.
+    def write(self, cars_data: list) -> list:
+        results = self.target.add_many(cars_data)
+        existing = [car_data for car_data, succeeded
+                    in zip(cars_data, results) if not succeeded]
+        if existing:
+            updated = iter(self.target.update_many(existing))
+            results = [succeeded or next(updated) for succeeded in results]
+        return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dbpanel.migrate',
+        description='Copy cars from one database to another.')
+    parser.add_argument('--from', dest='source', required=True,
+                        choices=DB_CLASSES.keys())
+    parser.add_argument('--to', dest='target', required=True,
+                        choices=DB_CLASSES.keys())
+    parser.add_argument('--chunk-size', type=int,
+                        default=Migration.CHUNK_SIZE)
+    parser.add_argument('--checkpoint', default=Migration.CHECKPOINT_FILE)
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the checkpoint and start over')
+    parser.add_argument('--force', action='store_true',
+                        help='copy into the target which has cars')
+    options = parser.parse_args(args)
+
+    try:
+        migration = Migration(options.source, options.target,
+                              options.chunk_size, options.checkpoint)
+        rate = migration.run(options.restart, options.force)
+    except ServerNotReadyError:
+        Logger(__name__).get_logger().error('Server is not ready')
+        exit(1)
+    except MigrationError as e:
+        Logger(__name__).get_logger().error('Migration failed: %s', e)
+        exit(1)
+
+    print('{} cars copied, {} failed, {:.0f} rows/sec'.format(
+        migration.copied, migration.failed, rate))
+    if migration.failed_ids:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import atexit
+import bisect
+import configparser
+import threading
+if __name__ == '__main__' or __name__ == 'residentcsv':
+    from accessor import Car
+    from accessor import CarDataAccessor
+    from carscsv import CarsCSV
+else:
+    from .accessor import Car
+    from .accessor import CarDataAccessor
+    from .carscsv import CarsCSV
+
+
+# CarsCSV which loads the csv file once and keeps the cars in memory
+# indexed by id.
+# Reads are served from memory, and changes are written back to the file
+# according to the flush policy:
+#   immediate : write the file on every change
+#   debounced : write the file flush_delay seconds after the last change
+#   on-exit   : write the file when close() is called or the program exits
+# The policy and the delay not given to the constructor are read from the
+# [csv-mem] section of dbpanel.ini:
+#   [csv-mem]
+#   flush_policy = immediate
+#   flush_delay = 1.0
+class ResidentCarsCSV(CarsCSV):
+    FLUSH_IMMEDIATE = 'immediate'
+    FLUSH_DEBOUNCED = 'debounced'
+    FLUSH_ON_EXIT = 'on-exit'
+    FLUSH_POLICIES = (FLUSH_IMMEDIATE, FLUSH_DEBOUNCED, FLUSH_ON_EXIT)
+    # Seconds to wait for other changes before writing in debounced policy
+    FLUSH_DELAY = 1.0
+    CONFIG_FILE = './dbpanel.ini'
+    SECTION = 'csv-mem'
+
+    def __init__(self, flush_policy=None, flush_delay=None):
+        super().__init__()
+        config_policy, config_delay = self.read_config()
+        self.flush_policy = (config_policy if flush_policy is None
+                             else flush_policy)
+        self.flush_delay = (config_delay if flush_delay is None
+                            else flush_delay)
+        # id -> car data, and the sorted list of ids
+        self.cars = {}
+        self.ids = []
+        # True while there are changes not written to the file
+        self.dirty = False
+        # True while change_many is changing cars
+        self.in_batch = False
+        # (mtime, size) of the file when it was read or written last
+        self.file_stamp = None
+        self.timer = None
+        # The debounce timer writes the file in another thread
+        self.lock = threading.RLock()
+        self.load()
+        if self.flush_policy != self.FLUSH_IMMEDIATE:
+            atexit.register(self.close)
+
+    # Return the flush policy and delay in dbpanel.ini.
+    # The defaults are returned for the missing or wrong values.
+    def read_config(self, config_file=CONFIG_FILE):
+        config = configparser.ConfigParser()
+        config.read_dict({self.SECTION: {
+            'flush_policy': self.FLUSH_IMMEDIATE,
+            'flush_delay': str(self.FLUSH_DELAY),
+        }})
+        # dbpanel.ini may not exist yet
+        config.read(config_file)
+        settings = config[self.SECTION]
+
+        flush_policy = settings['flush_policy'].strip().lower()
+        if flush_policy not in self.FLUSH_POLICIES:
+            self.logger.warning('unknown flush_policy: %s, use %s',
+                                flush_policy, self.FLUSH_IMMEDIATE)
+            flush_policy = self.FLUSH_IMMEDIATE
+
+        try:
+            flush_delay = settings.getfloat('flush_delay')
+        except ValueError:
+            flush_delay = -1.0
+        if flush_delay < 0:
+            self.logger.warning('wrong flush_delay: %s, use %s',
+                                settings['flush_delay'], self.FLUSH_DELAY)
+            flush_delay = self.FLUSH_DELAY
+        return flush_policy, flush_delay
+
+    # Read the whole csv file into the index.
+    # Return True if succeeded else False.
+    def load(self) -> bool:
+        with self.lock:
+            cars = super().get_cars_list()
+            if cars is None:
+                return False
+
+            self.cars = {int(car['id']): car for car in cars}
+            self.ids = sorted(self.cars)
+            self.dirty = False
+            self.file_stamp = self.stat_file()
+            self.logger.debug('%d cars loaded from %s',
+                              len(self.ids), self.filename)
+            return True
+
+    # Reload the file when it was edited by others since it was read.
+    def check_file(self):
+        if self.stat_file() == self.file_stamp:
+            return
+
+        if self.dirty:
+            self.logger.warning('%s was changed outside, '
+                                'it will be overwritten by the changes here',
+                                self.filename)
+        else:
+            self.logger.info('%s was changed outside, reload it',
+                             self.filename)
+            self.load()
+
+    # Write the cars in memory to the csv file if they are changed.
+    # Return True if succeeded else False.
+    def flush(self) -> bool:
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if not self.dirty:
+                return True
+
+            if not self.create([self.cars[car_id] for car_id in self.ids]):
+                return False
+
+            self.dirty = False
+            self.file_stamp = self.stat_file()
+            return True
+
+    # Write the pending changes and stop the debounce timer.
+    def close(self):
+        self.flush()
+
+    # Called after the cars in memory are changed
+    # Return False if the file should be written now and it failed.
+    def changed(self) -> bool:
+        self.dirty = True
+        if self.in_batch:
+            # written once after all cars are changed
+            return True
+        if self.flush_policy == self.FLUSH_IMMEDIATE:
+            return self.flush()
+        if self.flush_policy == self.FLUSH_DEBOUNCED:
+            # Restart the timer so that a burst of changes is written once
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.flush_delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+        return True
+
+    def get_cars_list(self) -> list:
+        with self.lock:
+            self.check_file()
+            return [dict(self.cars[car_id]) for car_id in self.ids]
+
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        with self.lock:
+            self.check_file()
+            start = (0 if start_after_id is None
+                     else bisect.bisect_right(self.ids, int(start_after_id)))
+            ids = self.ids[start:]
+
+        for car_id in ids:
+            car = self.cars.get(car_id)
+            if car is not None:
+                yield dict(car)
+
+    def count_cars(self) -> int:
+        with self.lock:
+            self.check_file()
+            return len(self.ids)
+
+    def get_cars_page(self, start: int, count: int) -> list:
+        with self.lock:
+            self.check_file()
+            return [dict(self.cars[car_id])
+                    for car_id in self.ids[start:start + count]]
+
+    # The cars are in memory, so the secondary indexes of the file
+    # are not used.
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        return CarDataAccessor.find(self, sort, limit, **criteria)
+
+    # Return the id next to the largest id, the last one of the sorted ids.
+    def new_id(self) -> int:
+        with self.lock:
+            self.check_file()
+            return max(self.ids[-1], 0) + 1 if self.ids else 1
+
+    def add_car_with_new_id(self, car_data: dict) -> bool:
+        with self.lock:
+            car_data['id'] = self.new_id()
+            return self.add_new_car(car_data)
+
+    def add_new_car(self, car_data: dict) -> bool:
+        with self.lock:
+            self.check_file()
+            car_id = int(car_data['id'])
+            if car_id in self.cars:
+                self.logger.error('car id: %d already exists', car_id)
+                return False
+
+            # keep the values as strings as they are read from the file
+            self.cars[car_id] = self.to_row(car_data)
+            bisect.insort(self.ids, car_id)
+            if not self.changed():
+                return False
+
+        self.logger.info('Car id: %s added', str(car_data['id']))
+        return True
+
+    def delete_a_car(self, car_data: dict) -> bool:
+        with self.lock:
+            self.check_file()
+            car_id = int(car_data['id'])
+            if self.cars.pop(car_id, None) is None:
+                self.logger.error('car id: %d not found', car_id)
+                return False
+
+            del self.ids[bisect.bisect_left(self.ids, car_id)]
+            return self.changed()
+
+    def select_a_car(self, car_data: dict) -> dict:
+        with self.lock:
+            self.check_file()
+            car_found = self.cars.get(int(car_data['id']))
+
+        return None if car_found is None else Car(car_found).to_dict()
+
+    def update_a_car(self, car_data: dict) -> bool:
+        with self.lock:
+            self.check_file()
+            car_id = int(car_data['id'])
+            if car_id not in self.cars:
+                self.logger.error('car id %d not found', car_id)
+                return False
+
+            self.cars[car_id] = self.to_row(car_data)
+            if not self.changed():
+                return False
+
+        self.logger.info('update success id: %s', str(car_data['id']))
+        return True
+
+    # Change the cars in memory, and write the file once.
+    def change_many(self, operation, cars_data, all_or_nothing) -> list:
+        functions = {
+            'add': self.add_new_car,
+            'update': self.update_a_car,
+            'delete': self.delete_a_car,
+        }
+        with self.lock:
+            self.check_file()
+            results = self.check_many(operation, cars_data, set(self.cars))
+            if all_or_nothing and not all(results):
+                return [False] * len(results)
+
+            self.in_batch = True
+            try:
+                for car_data, succeeded in zip(cars_data, results):
+                    if succeeded:
+                        functions[operation](car_data)
+            finally:
+                self.in_batch = False
+
+            if any(results) and not self.changed():
+                return [False] * len(results)
+            return results
+
+    # Convert car data to the row format read from the csv file
+    def to_row(self, car_data: dict) -> dict:
+        return {attr: str(value) for attr, value in car_data.items()}
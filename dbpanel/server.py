@@ -0,0 +1,609 @@
+import argparse
+import bisect
+import json
+import os
+import select
+import socket
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+# __name__ is '__main__' also in python -m dbpanel.server,
+# so the package tells if this is run as a script in dbpanel/
+if not __package__:
+    from accessor import CarDataAccessor
+    from logger import Logger
+else:
+    from .accessor import CarDataAccessor
+    from .logger import Logger
+
+
+# REST server of the cars which answers like json-server, so CarsDB works
+# with it as it is.
+#
+#   $ python -m dbpanel.server --file cars.json --port 3000
+#
+#   GET    /cars?<attr>=&<attr>_gte=&<attr>_lte=&<attr>_ne=&q=
+#               &_sort=&_order=&_start=&_end=&_page=&_limit=
+#   GET    /cars/<id>
+#   POST   /cars              (the id is assigned if not given)
+#   PUT    /cars/<id>
+#   PATCH  /cars/<id>
+#   DELETE /cars/<id>
+#   HEAD   /                  (health check)
+#
+# The cars are kept in memory, and written to the file in the format of
+# json-server ({"cars": [...]}) by a snapshot thread, not on every write.
+
+
+# Cars in memory indexed by id, brand and production_year.
+# Cars are never changed in place but replaced, so a list of them taken
+# under the lock can be read after it is released.
+class CarStore:
+    def __init__(self, cars=()):
+        self.lock = threading.RLock()
+        # id -> car, and the sorted list of ids
+        self.cars = {}
+        self.ids = []
+        # brand in lower case -> set of ids
+        self.brands = {}
+        # sorted list of (production_year, id)
+        self.years = []
+        # Incremented on every change, to make ETags and snapshots
+        self.version = 0
+        # The version starts from 0 again when the server is restarted,
+        # so ETags have this too not to match the ones made before.
+        self.boot = os.urandom(4).hex()
+        for car in cars:
+            self.insert(dict(car))
+
+    # Add the car to the indexes. The lock must be held.
+    def insert(self, car):
+        car_id = car['id']
+        self.cars[car_id] = car
+        bisect.insort(self.ids, car_id)
+        self.brands.setdefault(str(car.get('brand')).lower(),
+                               set()).add(car_id)
+        year = self.year(car)
+        if year is not None:
+            bisect.insort(self.years, (year, car_id))
+        self.version += 1
+
+    # Remove the car from the indexes. The lock must be held.
+    def remove(self, car_id):
+        car = self.cars.pop(car_id)
+        del self.ids[bisect.bisect_left(self.ids, car_id)]
+        brand = str(car.get('brand')).lower()
+        self.brands[brand].discard(car_id)
+        if not self.brands[brand]:
+            del self.brands[brand]
+        year = self.year(car)
+        if year is not None:
+            del self.years[bisect.bisect_left(self.years, (year, car_id))]
+        self.version += 1
+        return car
+
+    @staticmethod
+    def year(car):
+        try:
+            return int(car.get('production_year'))
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, car_id):
+        with self.lock:
+            return self.cars.get(car_id)
+
+    # Add the car, assigning the largest id + 1 if it has no id.
+    # Return the added car, or None if the id is used.
+    # Raise ValueError if the id isn't an integer.
+    def add(self, car: dict) -> dict:
+        car_id = car.get('id')
+        if car_id is not None and (not isinstance(car_id, int)
+                                   or isinstance(car_id, bool)):
+            raise ValueError('id is not an integer: ' + repr(car_id))
+        with self.lock:
+            if car.get('id') is None:
+                car = dict(car, id=self.ids[-1] + 1 if self.ids else 1)
+            if car['id'] in self.cars:
+                return None
+            self.insert(car)
+            return car
+
+    # Replace the car with the id, or update its attributes in car if
+    # merge is True. Return the new car, or None if not found.
+    def update(self, car_id, car: dict, merge=False) -> dict:
+        with self.lock:
+            old_car = self.cars.get(car_id)
+            if old_car is None:
+                return None
+            new_car = dict(old_car, **car) if merge else dict(car)
+            new_car['id'] = car_id
+            self.remove(car_id)
+            self.insert(new_car)
+            return new_car
+
+    def delete(self, car_id) -> bool:
+        with self.lock:
+            if car_id not in self.cars:
+                return False
+            self.remove(car_id)
+            return True
+
+    # Return the cars selected by the query parameters of json-server,
+    # and the number of them before they are sliced.
+    # Raise ValueError or TypeError if a value can't be compared.
+    def query(self, params: dict):
+        criteria = {}
+        for key, value in params.items():
+            if not key.startswith('_'):
+                criteria[key] = value
+
+        with self.lock:
+            car_ids = self.candidates(criteria)
+            cars = [self.cars[car_id] for car_id in car_ids]
+
+        if criteria:
+            cars = [car for car in cars if self.match(car, criteria)]
+
+        keys = params.get('_sort', 'id').split(',')
+        if keys != ['id'] or params.get('_order', 'asc') != 'asc':
+            orders = params.get('_order', 'asc').split(',')
+            orders += orders[-1:] * (len(keys) - len(orders))
+            # Sort by the last key first, as the sort is stable
+            for key, order in reversed(list(zip(keys, orders))):
+                cars.sort(key=lambda car, key=key:
+                          self.sort_key(car.get(key)),
+                          reverse=order == 'desc')
+
+        total = len(cars)
+        start = int(params.get('_start', 0))
+        end = params.get('_end')
+        limit = params.get('_limit')
+        if '_page' in params:
+            limit = int(limit or 10)
+            start = (int(params['_page']) - 1) * limit
+        if end is not None:
+            cars = cars[start:int(end)]
+        elif limit is not None:
+            cars = cars[start:start + int(limit)]
+        elif start:
+            cars = cars[start:]
+        return cars, total
+
+    # Return the ids in id order of the cars which may match criteria,
+    # narrowed by the indexes.
+    def candidates(self, criteria: dict):
+        low = criteria.get('id_gte')
+        high = criteria.get('id_lte')
+        if 'id' in criteria:
+            return [int(criteria['id'])] if int(criteria['id']) in self.cars \
+                else []
+        if low is not None or high is not None:
+            start = 0 if low is None else bisect.bisect_left(self.ids,
+                                                             int(low))
+            end = len(self.ids) if high is None \
+                else bisect.bisect_right(self.ids, int(high))
+            return self.ids[start:end]
+        if 'brand' in criteria:
+            return sorted(self.brands.get(criteria['brand'].lower(), ()))
+        if 'production_year' in criteria or \
+                'production_year_gte' in criteria or \
+                'production_year_lte' in criteria:
+            low = int(criteria.get('production_year_gte',
+                                   criteria.get('production_year', -10 ** 9)))
+            high = int(criteria.get('production_year_lte',
+                                    criteria.get('production_year', 10 ** 9)))
+            start = bisect.bisect_left(self.years, (low, -10 ** 18))
+            end = bisect.bisect_right(self.years, (high, 10 ** 18))
+            return sorted(car_id for year, car_id in self.years[start:end])
+        return self.ids
+
+    # Return True if the car matches all criteria.
+    # _ne is supported besides the criteria of CarDataAccessor.find.
+    @staticmethod
+    def match(car: dict, criteria: dict) -> bool:
+        for key, value in criteria.items():
+            if key.endswith('_ne'):
+                if str(car.get(key[:-3])).lower() == value.lower():
+                    return False
+            elif key.endswith(('_gte', '_lte')):
+                if key[:-4] not in car:
+                    return False
+                if not CarDataAccessor.match(car, {key: value}):
+                    return False
+            elif key != 'q' and key not in car:
+                return False
+            elif not CarDataAccessor.match(car, {key: value}):
+                return False
+        return True
+
+    @staticmethod
+    def sort_key(value):
+        # None is sorted first, and numbers before strings
+        if value is None:
+            return (0, 0)
+        value = CarDataAccessor.sort_value(value)
+        return (1, value) if isinstance(value, (int, float)) else (2, value)
+
+    # Return the list of all cars and the version of them.
+    def snapshot(self):
+        with self.lock:
+            return [self.cars[car_id] for car_id in self.ids], self.version
+
+
+# Write the cars in the store to the file when they are changed.
+# The file is written every interval seconds, or at once when
+# batch_size changes are made, in a background thread.
+class Snapshotter:
+    INTERVAL = 1.0
+    BATCH_SIZE = 1000
+
+    def __init__(self, store, filename, interval=INTERVAL,
+                 batch_size=BATCH_SIZE):
+        self.store = store
+        self.filename = filename
+        self.interval = interval
+        self.batch_size = batch_size
+        self.logger = Logger(__name__).get_logger()
+        self.saved_version = store.version
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Called after a change
+    def changed(self):
+        if self.store.version - self.saved_version >= self.batch_size:
+            self.wakeup.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.save()
+
+    # Write the cars if they are changed since the last time.
+    # Return True if succeeded else False.
+    def save(self) -> bool:
+        cars, version = self.store.snapshot()
+        if version == self.saved_version:
+            return True
+
+        temp_name = self.filename + '.tmp'
+        try:
+            with open(temp_name, 'w') as json_file:
+                json.dump({'cars': cars}, json_file, indent=2)
+                json_file.flush()
+                os.fsync(json_file.fileno())
+            os.replace(temp_name, self.filename)
+
+        except OSError as e:
+            self.logger.error('Snapshot to %s failed. error: %s',
+                              self.filename, e.strerror)
+            return False
+
+        self.saved_version = version
+        self.logger.debug('%d cars saved in %s', len(cars), self.filename)
+        return True
+
+    # Stop the thread and write the last changes.
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
+        self.save()
+
+
+class CarsRequestHandler(BaseHTTPRequestHandler):
+    # keep the connections alive as json-server does
+    protocol_version = 'HTTP/1.1'
+    # The header and the body are written separately, and Nagle's
+    # algorithm would hold the body until the header is acknowledged.
+    disable_nagle_algorithm = True
+    RESOURCE = 'cars'
+    # Seconds to wait for the rest of a request being received
+    timeout = 10.0
+    # Seconds a kept-alive connection may wait for the next request
+    IDLE_TIMEOUT = 5.0
+    # Seconds between the checks of the server while waiting
+    POLL_INTERVAL = 0.1
+
+    # Handle the requests on the connection until it is closed.
+    # While waiting for the next request, the connection is closed when
+    # it has been idle for IDLE_TIMEOUT, when other connections are
+    # waiting for a thread of the pool, or when the server is closing.
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.wait_for_request():
+                return
+            self.handle_one_request()
+
+    # Return True when the next request is received, or False if the
+    # connection should be closed.
+    def wait_for_request(self) -> bool:
+        waited = 0.0
+        while waited < self.IDLE_TIMEOUT:
+            if self.server.closing or self.server.queued:
+                return False
+            readable, _, _ = select.select([self.connection], [], [],
+                                           self.POLL_INTERVAL)
+            if readable:
+                return True
+            waited += self.POLL_INTERVAL
+        return False
+
+    def log_message(self, format, *args):
+        self.server.logger.debug('%s %s', self.address_string(),
+                                 format % args)
+
+    # A connection closed for the queued connections is closed after this
+    # reply, so tell the client not to send the next request on it.
+    def end_headers(self):
+        if self.server.closing or self.server.queued:
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    # Return the car in the request body, or None if it isn't an object.
+    def read_car(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            car = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return None
+        return car if isinstance(car, dict) else None
+
+    # Return ('cars', None) for /cars, ('cars', id) for /cars/<id>,
+    # or (None, None) for other paths.
+    def resource(self):
+        parts = [part for part in urlsplit(self.path).path.split('/')
+                 if part]
+        if not parts or parts[0] != self.RESOURCE or len(parts) > 2:
+            return None, None
+        if len(parts) == 1:
+            return self.RESOURCE, None
+        try:
+            return self.RESOURCE, int(parts[1])
+        except ValueError:
+            return self.RESOURCE, parts[1]
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        resource, car_id = self.resource()
+        if resource is None:
+            # The root answers the health check
+            if urlsplit(self.path).path == '/':
+                self.send_json(200, {})
+            else:
+                self.send_json(404, {})
+            return
+
+        store = self.server.store
+        if car_id is not None:
+            car = store.get(car_id)
+            self.send_json(200 if car else 404, car or {})
+            return
+
+        # The same query gives the same reply until the cars are changed,
+        # so the reply is revalidated without running the query.
+        query = urlsplit(self.path).query
+        etag = 'W/"{}-{}-{:x}"'.format(store.boot, store.version,
+                                       zlib.crc32(query.encode()))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_empty(304, {'ETag': etag})
+            return
+
+        params = dict(parse_qsl(query))
+        try:
+            cars, total = store.query(params)
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        headers = {'ETag': etag}
+        if any(key in params for key in ('_start', '_end', '_page',
+                                         '_limit')):
+            headers['X-Total-Count'] = str(total)
+            headers['Access-Control-Expose-Headers'] = 'X-Total-Count'
+        self.send_json(200, cars, headers)
+
+    def do_POST(self):
+        resource, car_id = self.resource()
+        car = self.read_car()
+        if resource is None or car_id is not None:
+            self.send_json(404, {})
+        elif car is None:
+            self.send_json(400, {})
+        else:
+            try:
+                added = self.server.store.add(car)
+            except ValueError as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            if added is None:
+                # json-server answers 500 for a duplicated id
+                self.send_json(500, {'error': 'duplicate id'})
+            else:
+                self.server.changed()
+                self.send_json(201, added)
+
+    def do_PUT(self):
+        self.write_car(merge=False)
+
+    def do_PATCH(self):
+        self.write_car(merge=True)
+
+    def write_car(self, merge):
+        resource, car_id = self.resource()
+        car = self.read_car()
+        if resource is None or car_id is None:
+            self.send_json(404, {})
+        elif car is None:
+            self.send_json(400, {})
+        else:
+            updated = self.server.store.update(car_id, car, merge)
+            if updated is None:
+                self.send_json(404, {})
+            else:
+                self.server.changed()
+                self.send_json(200, updated)
+
+    def do_DELETE(self):
+        resource, car_id = self.resource()
+        if resource is None or car_id is None \
+                or not self.server.store.delete(car_id):
+            self.send_json(404, {})
+        else:
+            self.server.changed()
+            self.send_json(200, {})
+
+
+# HTTP server which handles the connections in a pool of threads.
+# A connection kept alive holds its thread only until it is idle and
+# other connections are queued, see CarsRequestHandler.handle.
+class CarsServer(HTTPServer):
+    THREADS = 16
+    # Connections waiting to be accepted. The default 5 drops some of the
+    # connections a client pool opens at once, which are sent again by
+    # TCP a second later.
+    request_queue_size = 128
+
+    def __init__(self, address, store: CarStore, snapshotter=None,
+                 threads=THREADS):
+        super().__init__(address, CarsRequestHandler)
+        self.store = store
+        self.snapshotter = snapshotter
+        self.executor = ThreadPoolExecutor(max_workers=threads,
+                                           thread_name_prefix='server')
+        self.logger = Logger(__name__).get_logger()
+        # Open client sockets, and the number of them not handled yet
+        self.connections = set()
+        self.queued = 0
+        self.connections_lock = threading.Lock()
+        self.closing = False
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+            self.queued += 1
+        self.executor.submit(self.process_request_thread,
+                             request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        with self.connections_lock:
+            self.queued -= 1
+        try:
+            if not self.closing:
+                self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.connections_lock:
+                self.connections.discard(request)
+
+    def changed(self):
+        if self.snapshotter is not None:
+            self.snapshotter.changed()
+
+    # Start serving in a background thread, such as in the benchmark.
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    # Stop accepting connections, let the requests being handled finish,
+    # close the other connections, and then save the last snapshot, so no
+    # request succeeds after it.
+    def close(self):
+        self.closing = True
+        self.shutdown()
+        self.server_close()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        # The connections cancelled in the queue
+        with self.connections_lock:
+            connections = list(self.connections)
+            self.connections.clear()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+        if self.snapshotter is not None:
+            self.snapshotter.stop()
+
+
+# Return the cars in the json file of json-server, or [] if not found.
+def load_cars(filename) -> list:
+    try:
+        with open(filename, 'r') as json_file:
+            return json.load(json_file).get('cars', [])
+    except FileNotFoundError:
+        return []
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dbpanel.server',
+        description='Serve the cars like json-server.')
+    parser.add_argument('--file', default='cars.json',
+                        help='json file of the cars, made if not found')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--threads', type=int, default=CarsServer.THREADS)
+    parser.add_argument('--snapshot-interval', type=float,
+                        default=Snapshotter.INTERVAL,
+                        help='seconds between writes of the changes')
+    parser.add_argument('--snapshot-changes', type=int,
+                        default=Snapshotter.BATCH_SIZE,
+                        help='number of changes written at once')
+    options = parser.parse_args(args)
+
+    logger = Logger(__name__).get_logger()
+    store = CarStore(load_cars(options.file))
+    snapshotter = Snapshotter(store, options.file, options.snapshot_interval,
+                              options.snapshot_changes)
+    server = CarsServer((options.host, options.port), store, snapshotter,
+                        options.threads)
+    logger.info('%d cars from %s served at http://%s:%d/cars',
+                len(store.ids), options.file, options.host, server.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        logger.info('Stopped, the cars are saved in %s', options.file)
+
+
+if __name__ == '__main__':
+    main()
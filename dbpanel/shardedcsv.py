@@ -0,0 +1,410 @@
+import bisect
+import json
+import os
+# __name__ is '__main__' also in python -m dbpanel.shardedcsv,
+# so the package tells if this is run as a script in dbpanel/
+if not __package__:
+    from accessor import Car
+    from accessor import CarDataAccessor
+    from carscsv import CarsCSV
+    from logger import Logger
+else:
+    from .accessor import Car
+    from .accessor import CarDataAccessor
+    from .carscsv import CarsCSV
+    from .logger import Logger
+
+
+# Cars in csv files partitioned by id range, so a change rewrites only
+# the file owning the id.
+#
+#   cars.shards/manifest.json
+#   cars.shards/cars-000001.csv     ids from 1
+#   cars.shards/cars-000002.csv     ids from the low of this shard
+#   ...
+#
+# The manifest keeps the header and the list of the shards in id order,
+# each with its file, the lowest id it owns and the number of rows.
+# A shard owns the ids from its low up to the low of the next shard.
+# A shard is split into shards of MAX_ROWS / 2 to MAX_ROWS rows when it has
+# more than MAX_ROWS rows, and merged with a neighbour when it has less than MIN_ROWS rows.
+# Split and merged shards are written to new files before the manifest is
+# replaced, so the manifest always lists complete files.
+class ShardedCarsCSV(CarDataAccessor):
+    DIRECTORY = 'cars.shards'
+    MANIFEST = 'manifest.json'
+    MAX_ROWS = 10000
+    MIN_ROWS = MAX_ROWS // 4
+
+    def __init__(self, directory=DIRECTORY):
+        self.directory = directory
+        self.logger = Logger(__name__).get_logger()
+        self.header = None
+        # list of {'file', 'low', 'rows'} in id order, and the lows of them
+        self.shards = []
+        self.lows = []
+        # Number used in the name of the next shard file
+        self.next_file = 1
+        # file name -> CarsCSV of the shard, which keeps its id index
+        self.accessors = {}
+        if not self.load_manifest():
+            self.initialize()
+
+    # Read the manifest. Return True if succeeded else False.
+    def load_manifest(self) -> bool:
+        try:
+            with open(self.manifest_path(), 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+
+        except FileNotFoundError:
+            return False
+
+        self.header = manifest['header']
+        self.shards = manifest['shards']
+        self.lows = [shard['low'] for shard in self.shards]
+        self.next_file = manifest['next_file']
+        return True
+
+    # Write the manifest atomically. Return True if succeeded else False.
+    def save_manifest(self) -> bool:
+        path = self.manifest_path()
+        try:
+            with open(path + '.tmp', 'w') as manifest_file:
+                json.dump({'header': self.header,
+                           'shards': self.shards,
+                           'next_file': self.next_file},
+                          manifest_file, indent=2)
+            os.replace(path + '.tmp', path)
+
+        except OSError as e:
+            self.logger.error('Write %s failed. error: %s', path, e.strerror)
+            return False
+
+        self.lows = [shard['low'] for shard in self.shards]
+        return True
+
+    def manifest_path(self):
+        return os.path.join(self.directory, self.MANIFEST)
+
+    # Make the directory with the cars in the csv file of CarsCSV if it
+    # exists, or with no cars.
+    def initialize(self):
+        os.makedirs(self.directory, exist_ok=True)
+        cars = []
+        if os.path.exists(CarsCSV.FILENAME):
+            cars = CarsCSV().get_cars_list() or []
+            self.logger.info('%d cars imported from %s into %s', len(cars),
+                             CarsCSV.FILENAME, self.directory)
+        self.create(cars)
+
+    # Newly create the shards with the data given in cars parameter.
+    # Return True if succeeded else False.
+    def create(self, cars: list) -> bool:
+        header = list(cars[0].keys()) if cars else \
+            self.header or list(Car.__slots__)
+        old_shards = self.shards
+        self.header = header
+        cars = sorted(cars, key=lambda car: int(car['id']))
+
+        shards = []
+        for start in range(0, max(len(cars), 1), self.MAX_ROWS):
+            shard = self.write_shard(cars[start:start + self.MAX_ROWS])
+            if shard is None:
+                return False
+            shards.append(shard)
+        # The first shard owns the ids from 1
+        shards[0]['low'] = 1
+
+        self.shards = shards
+        if not self.save_manifest():
+            return False
+        self.remove_files(old_shards)
+        return True
+
+    # Write the cars to a new shard file.
+    # Return the shard, or None if failed.
+    def write_shard(self, cars: list) -> dict:
+        filename = 'cars-{:06d}.csv'.format(self.next_file)
+        self.next_file += 1
+        shard = {'file': filename,
+                 'low': int(cars[0]['id']) if cars else 1,
+                 'rows': len(cars)}
+        if not self.accessor(shard).create(cars):
+            return None
+        return shard
+
+    # Remove the files of the shards which are no longer in the manifest,
+    # with their id indexes and lock files.
+    def remove_files(self, shards: list):
+        for shard in shards:
+            self.accessors.pop(shard['file'], None)
+            path = os.path.join(self.directory, shard['file'])
+            for filename in (path, path + CarsCSV.ID_INDEX_SUFFIX,
+                             path + CarsCSV.LOCK_SUFFIX):
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.logger.warning('Remove %s failed. error: %s',
+                                        filename, e.strerror)
+
+    # Return the CarsCSV reading and writing the file of the shard.
+    def accessor(self, shard: dict) -> CarsCSV:
+        db = self.accessors.get(shard['file'])
+        if db is None:
+            db = CarsCSV()
+            db.filename = os.path.join(self.directory, shard['file'])
+            # The header of an empty new file is taken from the manifest
+            db._header = self.header
+            self.accessors[shard['file']] = db
+        return db
+
+    # Return the index of the shard owning the id.
+    def shard_index(self, car_id: int) -> int:
+        return max(bisect.bisect_right(self.lows, int(car_id)) - 1, 0)
+
+    # Return the index of the shard owning the id of the car data,
+    # or None if the id is not a number.
+    def owner_index(self, car_data: dict) -> int:
+        try:
+            return self.shard_index(car_data['id'])
+        except (KeyError, TypeError, ValueError):
+            self.logger.error('wrong car id: %s', car_data.get('id'))
+            return None
+
+    def attributes(self) -> list:
+        return list(self.header)
+
+    # Get cars list from all shards, and return list of dictionaries.
+    # If failed, return None.
+    def get_cars_list(self) -> list:
+        cars = []
+        for shard in self.shards:
+            rows = self.accessor(shard).get_cars_list()
+            if rows is None:
+                return None
+            cars.extend(rows)
+        return cars
+
+    # Yield cars in id order streaming the shards from the one owning
+    # start_after_id.
+    def iter_cars(self, page_size=CarDataAccessor.PAGE_SIZE,
+                  start_after_id=None):
+        first = 0 if start_after_id is None \
+            else self.shard_index(start_after_id)
+        for shard in self.shards[first:]:
+            yield from self.accessor(shard).iter_cars(page_size,
+                                                      start_after_id)
+
+    # The manifest has the number of rows of each shard
+    def count_cars(self) -> int:
+        return sum(shard['rows'] for shard in self.shards)
+
+    # Read only the shards which have the rows of the page.
+    def get_cars_page(self, start: int, count: int) -> list:
+        cars = []
+        for shard in self.shards:
+            if start >= shard['rows']:
+                start -= shard['rows']
+                continue
+            rows = self.accessor(shard).get_cars_page(start,
+                                                      count - len(cars))
+            if rows is None:
+                return None
+            cars.extend(rows)
+            start = 0
+            if len(cars) >= count:
+                break
+        return cars
+
+    # Return the id next to the largest id, found in the last row of the
+    # last shard which has rows.
+    # Return None if failed.
+    def new_id(self) -> int:
+        for shard in reversed(self.shards):
+            if shard['rows']:
+                return self.accessor(shard).new_id()
+        return 1
+
+    # Look up the cars in each shard by its indexes. Shards out of the
+    # range of id_gte and id_lte are not read.
+    def find(self, sort=None, limit=None, **criteria) -> list:
+        shards = self.shards
+        try:
+            if 'id' in criteria:
+                # An id not in digits matches no rows as in CarsCSV
+                shards = [self.shards[self.shard_index(criteria['id'])]] \
+                    if str(criteria['id']).isdigit() else []
+            else:
+                if 'id_lte' in criteria:
+                    shards = shards[:self.shard_index(criteria['id_lte']) + 1]
+                if 'id_gte' in criteria:
+                    shards = shards[self.shard_index(criteria['id_gte']):]
+
+        except ValueError as e:
+            self.logger.error('Find failed. error: %s', e)
+            return None
+
+        cars = []
+        for shard in shards:
+            found = self.accessor(shard).find(**criteria)
+            if found is None:
+                return None
+            cars.extend(found)
+            # The shards are in id order
+            if sort is None and limit is not None and len(cars) >= limit:
+                break
+        return self.sort_cars(cars, sort, limit)
+
+    # Add car data to the owning shard.
+    # Return True if succeeded else False.
+    def add_new_car(self, car_data: dict) -> bool:
+        return self.add_many([car_data])[0]
+
+    # Delete a car data from the owning shard.
+    # Return True if succeeded, else False.
+    def delete_a_car(self, car_data: dict) -> bool:
+        return self.delete_many([car_data])[0]
+
+    # Retrieve a car data with the id of specified car data.
+    # Return None if not found else the dict type data of the car.
+    def select_a_car(self, car_data: dict) -> dict:
+        index = self.owner_index(car_data)
+        if index is None:
+            return None
+        return self.accessor(self.shards[index]).select_a_car(car_data)
+
+    # Update a car data in the owning shard.
+    # Return True if suceeded, else False.
+    def update_a_car(self, car_data: dict) -> bool:
+        return self.update_many([car_data])[0]
+
+    # Add, update or delete the cars with one write of each owning shard.
+    def add_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('add', cars_data, all_or_nothing)
+
+    def update_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('update', cars_data, all_or_nothing)
+
+    def delete_many(self, cars_data: list, all_or_nothing=False) -> list:
+        return self.change_many('delete', cars_data, all_or_nothing)
+
+    # operation is 'add', 'update' or 'delete'.
+    # The cars are grouped by the owning shards, and all groups are
+    # checked first when all_or_nothing is True.
+    # A car whose id is not a number fails.
+    # Return the list of True or False for each car.
+    def change_many(self, operation, cars_data, all_or_nothing) -> list:
+        groups = {}
+        for position, car_data in enumerate(cars_data):
+            index = self.owner_index(car_data)
+            if index is None:
+                if all_or_nothing:
+                    return [False] * len(cars_data)
+                continue
+            groups.setdefault(index, []).append(position)
+
+        if all_or_nothing:
+            for index, positions in groups.items():
+                db = self.accessor(self.shards[index])
+                id_index = db.load_id_index()
+                if id_index is None or not all(db.check_many(
+                        operation, [cars_data[position]
+                                    for position in positions],
+                        set(id_index[0]))):
+                    return [False] * len(cars_data)
+
+        results = [False] * len(cars_data)
+        for index, positions in groups.items():
+            shard = self.shards[index]
+            group = [cars_data[position] for position in positions]
+            if operation == 'add':
+                # cars are appended when their ids are after the last row
+                group.sort(key=lambda car_data: int(car_data['id']))
+                positions = sorted(positions,
+                                   key=lambda p: int(cars_data[p]['id']))
+            group_results = self.accessor(shard).change_many(
+                operation, group, False)
+            for position, succeeded in zip(positions, group_results):
+                results[position] = succeeded
+
+            changed = group_results.count(True)
+            if operation == 'add':
+                shard['rows'] += changed
+            elif operation == 'delete':
+                shard['rows'] -= changed
+
+        if operation != 'update' and any(results):
+            self.rebalance()
+        return results
+
+    # Split the shards which have grown over MAX_ROWS, and merge the ones
+    # which have shrunk under MIN_ROWS, then save the manifest.
+    def rebalance(self):
+        old_shards = []
+        shards = []
+        for shard in self.shards:
+            if shard['rows'] > self.MAX_ROWS:
+                cars = self.accessor(shard).get_cars_list()
+                if cars is None:
+                    shards.append(shard)
+                    continue
+                parts = self.split_shard(shard, cars)
+                if parts is None:
+                    shards.append(shard)
+                    continue
+                shards += parts
+                old_shards.append(shard)
+                self.logger.debug('Shard %s split into %s', shard['file'],
+                                  ', '.join(part['file'] for part in parts))
+
+            elif shards and shard['rows'] < self.MIN_ROWS \
+                    or shards and shards[-1]['rows'] < self.MIN_ROWS:
+                previous = shards[-1]
+                if previous['rows'] + shard['rows'] > self.MAX_ROWS:
+                    shards.append(shard)
+                    continue
+                cars = self.accessor(previous).get_cars_list()
+                rows = self.accessor(shard).get_cars_list()
+                merged = None if cars is None or rows is None \
+                    else self.write_shard(cars + rows)
+                if merged is None:
+                    shards.append(shard)
+                    continue
+                merged['low'] = previous['low']
+                shards[-1] = merged
+                old_shards += [previous, shard]
+                self.logger.debug('Shards %s and %s merged into %s',
+                                  previous['file'], shard['file'],
+                                  merged['file'])
+
+            else:
+                shards.append(shard)
+
+        # The merged shards written in this call are not old files
+        old_shards = [shard for shard in old_shards if shard not in shards]
+        self.shards = shards
+        if self.save_manifest():
+            self.remove_files(old_shards)
+
+    # Write the cars of the shard into new shards of MAX_ROWS / 2 to
+    # MAX_ROWS rows, as many as a bulk add may have put in it.
+    # Return the new shards, or None if failed.
+    def split_shard(self, shard: dict, cars: list) -> list:
+        count = max(len(cars) // max(self.MAX_ROWS // 2, 1), 2)
+        parts = []
+        for number in range(count):
+            part = self.write_shard(cars[len(cars) * number // count:
+                                         len(cars) * (number + 1) // count])
+            if part is None:
+                self.remove_files(parts)
+                return None
+            parts.append(part)
+        parts[0]['low'] = shard['low']
+        return parts
+
+
+if __name__ == '__main__':
+    db = ShardedCarsCSV()
+    print(len(db.shards), 'shards', db.count_cars(), 'cars')
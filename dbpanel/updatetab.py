@@ -22,4 +22,5 @@ class UpdateTab:
 
         self.logger.debug('new data to update: %s', car_update_data.values())
         self.panel.submit_request(car_update_data,
-                                  self.panel.db.update_a_car)
+                                  self.panel.db.update_a_car,
+                                  'update')
@@ -0,0 +1,128 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+if __name__ == '__main__' or __name__ == 'worker':
+    from logger import Logger
+else:
+    from .logger import Logger
+
+
+# A database call submitted to the Worker.
+class Task:
+    def __init__(self, function, args, callback, key):
+        self.function = function
+        self.args = args
+        self.callback = callback
+        self.key = key
+        self.future = None
+        self.cancelled = False
+
+    # Stop the call if it isn't started yet.
+    # The callback isn't called after this anyway.
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+# Run database calls in a thread pool not to block the Tk mainloop.
+# The results are passed to the callbacks in the mainloop thread, which
+# polls the finished calls with root.after.
+#
+# Calls submitted with the same key are coalesced: a new call cancels
+# the previous one, so only the result of the latest call is used.
+class Worker:
+    # Milliseconds between polls for finished calls
+    POLL_INTERVAL = 20
+
+    def __init__(self, root, max_workers=1, on_busy=None):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='dbpanel')
+        # Finished tasks put by the pool threads
+        self.finished = queue.Queue()
+        # key -> the latest task submitted with the key
+        self.latest = {}
+        # Number of tasks not handled by poll yet
+        self.running = 0
+        self.busy = False
+        # Called with True when calls start and False when all finished
+        self.on_busy = on_busy
+        self.poll_id = None
+        self.logger = Logger(__name__).get_logger()
+
+    # Run function(*args) in the pool, and call callback(result) in the
+    # mainloop thread when it is finished, or callback(None) if it raised.
+    # Return the Task which can be cancelled.
+    def submit(self, function, *args, callback=None, key=None) -> Task:
+        task = Task(function, args, callback, key)
+        if key is not None:
+            self.cancel(key)
+            self.latest[key] = task
+
+        self.running += 1
+        task.future = self.executor.submit(function, *args)
+        # Called in the pool thread, or here if the task is cancelled
+        task.future.add_done_callback(lambda future: self.finished.put(task))
+
+        self.set_busy(True)
+        if self.poll_id is None:
+            self.poll_id = self.root.after(self.POLL_INTERVAL, self.poll)
+        return task
+
+    # Cancel the latest task submitted with the key.
+    def cancel(self, key):
+        task = self.latest.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    # Call the callbacks of the finished tasks in the mainloop thread.
+    def poll(self):
+        self.poll_id = None
+        while True:
+            try:
+                task = self.finished.get_nowait()
+            except queue.Empty:
+                break
+
+            self.running -= 1
+            if task.key is not None and self.latest.get(task.key) is task:
+                del self.latest[task.key]
+            if task.cancelled:
+                continue
+
+            error = task.future.exception()
+            if error is not None:
+                self.logger.error('%s failed. error: %s',
+                                  task.function.__name__, error)
+            if task.callback is None:
+                continue
+            # A call which raised is passed None as the database calls
+            # return when they fail, so the callback shows the failure.
+            try:
+                task.callback(None if error is not None
+                              else task.future.result())
+            except Exception as e:
+                # The other tasks are still handled and polled
+                self.logger.error('Callback of %s failed. error: %s',
+                                  task.function.__name__, e)
+
+        if self.running > 0:
+            if self.poll_id is None:
+                self.poll_id = self.root.after(self.POLL_INTERVAL, self.poll)
+        else:
+            self.set_busy(False)
+
+    def set_busy(self, busy):
+        if busy != self.busy:
+            self.busy = busy
+            if self.on_busy is not None:
+                self.on_busy(busy)
+
+    # Cancel the waiting calls and stop the pool.
+    def shutdown(self):
+        for key in list(self.latest):
+            self.cancel(key)
+        if self.poll_id is not None:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
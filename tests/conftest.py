@@ -0,0 +1,15 @@
+import pytest
+
+
+# Every test runs in its own directory, as the backends and the logger
+# use the files in the current directory.
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def make_car(car_id, brand='Fiat', model='500', production_year=1970,
+             convertible=False):
+    return {'id': car_id, 'brand': brand, 'model': model,
+            'production_year': production_year, 'convertible': convertible}
@@ -0,0 +1,123 @@
+import pytest
+
+from dbpanel.accessor import Car
+from dbpanel.backends import BACKENDS
+from dbpanel.backends import DB_CLASSES
+from dbpanel.cachingaccessor import CachingAccessor
+from dbpanel.carscsv import CarsCSV
+from dbpanel.server import CarsServer
+from dbpanel.server import CarStore
+from dbpanel.server import Snapshotter
+from tests.conftest import make_car
+
+CARS = [make_car(1, 'Alfa Romeo', 'Spider', 1966, True),
+        make_car(2, 'Fiat', '500', 1957),
+        make_car(3, 'Ford', 'Mustang', 1964, True),
+        make_car(5, 'Honda', 'S800', 1966, True),
+        make_car(6, 'Fiat', '124 Spider', 1966, True)]
+
+
+# Every backend made with CARS, and the csv backend behind the cache the
+# panel reads through
+@pytest.fixture(params=list(BACKENDS) + ['cached'])
+def db(request):
+    cars = [dict(car) for car in CARS]
+    server = None
+    if request.param == 'json':
+        store = CarStore(cars)
+        server = CarsServer(('localhost', 0), store,
+                            Snapshotter(store, 'cars.json', interval=60),
+                            threads=4)
+        server.start()
+        db = DB_CLASSES['json'](port=server.port)
+    elif request.param == 'cached':
+        assert CarsCSV().create(cars)
+        db = CachingAccessor(CarsCSV())
+    elif request.param == 'csv-log':
+        # the journal is started on the base file
+        assert CarsCSV().create(cars)
+        db = DB_CLASSES['csv-log']()
+    else:
+        db = DB_CLASSES[request.param]()
+        assert db.create(cars)
+
+    yield db
+    if hasattr(db, 'close'):
+        db.close()
+    if server is not None:
+        server.close()
+
+
+# The car data in the types Car gives, as the csv backends give strings
+def cars(cars_data):
+    return [Car({attr: str(value) for attr, value in car_data.items()})
+            .to_dict() for car_data in cars_data]
+
+
+def ids(cars_data):
+    return [int(car_data['id']) for car_data in cars_data]
+
+
+def test_crud(db):
+    assert db.add_new_car(make_car(4, 'Lancia', 'Fulvia', 1965))
+    assert not db.add_new_car(make_car(4))
+    assert cars([db.select_a_car({'id': 4})]) \
+        == [make_car(4, 'Lancia', 'Fulvia', 1965)]
+
+    assert db.update_a_car(make_car(4, 'Lancia', 'Stratos', 1973, True))
+    assert not db.update_a_car(make_car(9))
+    assert cars([db.select_a_car({'id': 4})]) \
+        == [make_car(4, 'Lancia', 'Stratos', 1973, True)]
+
+    assert db.delete_a_car({'id': 4})
+    assert not db.delete_a_car({'id': 4})
+    assert db.select_a_car({'id': 4}) is None
+    assert cars(db.get_cars_list()) == CARS
+
+
+def test_bulk_changes(db):
+    assert db.add_many([make_car(7), make_car(1), make_car(8)]) \
+        == [True, False, True]
+    assert db.update_many([make_car(7, 'Lancia'), make_car(9)]) \
+        == [True, False]
+    assert db.delete_many([make_car(8), make_car(9)]) == [True, False]
+    assert db.add_many([make_car(10), make_car(2)], all_or_nothing=True) \
+        == [False, False]
+    assert ids(db.get_cars_list()) == [1, 2, 3, 5, 6, 7]
+    assert cars([db.select_a_car({'id': 7})]) == [make_car(7, 'Lancia')]
+
+
+def test_find(db):
+    assert ids(db.find(brand='fiat')) == [2, 6]
+    assert ids(db.find(production_year_gte=1960, production_year_lte=1965)) \
+        == [3]
+    assert ids(db.find(production_year=1966, brand='Honda')) == [5]
+    assert ids(db.find(sort='-production_year', limit=2)) == [1, 5]
+    assert ids(db.find(sort=['brand', '-id'])) == [1, 6, 2, 3, 5]
+    assert ids(db.find(q='spider')) == [1, 6]
+    assert db.find(brand='Lancia') == []
+
+
+def test_paging(db):
+    assert db.count_cars() == 5
+    assert ids(db.get_cars_page(0, 2)) == [1, 2]
+    assert ids(db.get_cars_page(3, 10)) == [5, 6]
+    assert db.get_cars_page(5, 10) == []
+    assert ids(db.iter_cars(page_size=2)) == [1, 2, 3, 5, 6]
+    assert ids(db.iter_cars(page_size=2, start_after_id=3)) == [5, 6]
+
+
+# Every backend gives the id after the largest one, and the gap at 4
+# isn't filled
+def test_id_allocation(db):
+    assert db.new_id() == 7
+
+    added = []
+    for _ in range(3):
+        car_data = make_car(None, 'Lancia')
+        assert db.add_car_with_new_id(car_data)
+        added.append(int(car_data['id']))
+    assert added == [7, 8, 9]
+    assert ids(db.find(brand='Lancia')) == added
+    assert db.count_cars() == 8
+    assert db.new_id() == 10
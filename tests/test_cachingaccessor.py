@@ -0,0 +1,62 @@
+import threading
+
+from dbpanel.cachingaccessor import CachingAccessor
+from dbpanel.carssqlite import CarsSQLite
+from tests.conftest import make_car
+
+
+def make_cache():
+    db = CarsSQLite()
+    db.create([make_car(1), make_car(2)])
+    return CachingAccessor(db, ttl=60)
+
+
+def test_writes_invalidate_results():
+    cache = make_cache()
+    assert cache.count_cars() == 2
+    assert cache.select_a_car({'id': 1})['model'] == '500'
+    assert cache.add_new_car(make_car(3))
+    assert cache.update_a_car(make_car(1, model='Panda'))
+    assert cache.count_cars() == 3
+    assert cache.select_a_car({'id': 1})['model'] == 'Panda'
+    assert cache.cache_stats()['hits'] == 0
+
+    assert cache.count_cars() == 3
+    assert cache.cache_stats()['hits'] == 1
+
+
+def test_invalidate_forgets_results():
+    cache = make_cache()
+    assert cache.count_cars() == 2
+    cache.db.add_new_car(make_car(3))
+    assert cache.count_cars() == 2
+    cache.invalidate()
+    assert cache.count_cars() == 3
+
+
+def test_result_read_before_a_write_is_not_kept():
+    cache = make_cache()
+    reading = threading.Event()
+    written = threading.Event()
+    count_cars = cache.db.count_cars
+
+    # count_cars reads the old count, and returns it after a write
+    def slow_count():
+        count = count_cars()
+        reading.set()
+        written.wait(5)
+        return count
+
+    cache.db.count_cars = slow_count
+    results = []
+    reader = threading.Thread(target=lambda: results.append(
+        cache.count_cars()))
+    reader.start()
+    reading.wait(5)
+    assert cache.add_new_car(make_car(3))
+    written.set()
+    reader.join(5)
+    assert results == [2]
+
+    cache.db.count_cars = count_cars
+    assert cache.count_cars() == 3
@@ -0,0 +1,57 @@
+import pytest
+
+from dbpanel.carsbinary import CarsBinary
+from tests.conftest import make_car
+
+
+@pytest.fixture
+def db():
+    db = CarsBinary()
+    db.create([make_car(1), make_car(2, convertible='Yes')])
+    yield db
+    db.close()
+
+
+def test_convertible_is_stored(db):
+    assert db.select_a_car({'id': 1})['convertible'] is False
+    assert db.select_a_car({'id': 2})['convertible'] is True
+
+
+@pytest.mark.parametrize('convertible', ['maybe', '', 'truthy'])
+def test_bad_convertible_is_rejected(db, convertible):
+    assert db.add_many([make_car(3), make_car(4, convertible=convertible)]) \
+        == [True, False]
+    assert db.update_a_car(make_car(1, convertible=convertible)) is False
+    assert db.select_a_car({'id': 1})['convertible'] is False
+    assert db.select_a_car({'id': 4}) is None
+    assert db.count_cars() == 3
+
+
+def test_strings_are_shared_by_instances(db):
+    other = CarsBinary()
+    try:
+        assert db.add_new_car(make_car(10, brand='Only1'))
+        assert other.add_new_car(make_car(11, brand='Only2'))
+        assert db.add_new_car(make_car(12, brand='Only2'))
+        assert other.select_a_car({'id': 10})['brand'] == 'Only1'
+        assert db.select_a_car({'id': 11})['brand'] == 'Only2'
+    finally:
+        other.close()
+
+    db.close()
+    reopened = CarsBinary()
+    try:
+        assert [reopened.select_a_car({'id': car_id})['brand']
+                for car_id in (10, 11, 12)] == ['Only1', 'Only2', 'Only2']
+        # a string is appended once
+        assert len(reopened.strings) == 4
+    finally:
+        reopened.close()
+
+
+@pytest.mark.parametrize('car_data', [make_car('x'), make_car(None),
+                                      make_car(3, production_year=None)])
+def test_bad_values_return_false(db, car_data):
+    assert db.add_many([car_data, make_car(4)]) == [False, True]
+    assert db.add_many([car_data], all_or_nothing=True) == [False]
+    assert db.update_many([car_data]) == [False]
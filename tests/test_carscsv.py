@@ -0,0 +1,154 @@
+import multiprocessing
+import time
+
+import pytest
+
+from dbpanel.carscsv import CarsCSV
+from dbpanel.carscsv import read_chunk
+from dbpanel.journalcsv import JournaledCarsCSV
+from dbpanel.shardedcsv import ShardedCarsCSV
+from tests.conftest import make_car
+
+CARS = [make_car(1, 'Alfa Romeo', 'Spider', 1966, True),
+        make_car(2, 'Fiat', '500', 1957),
+        make_car(3, 'Ford', 'Mustang', 1964, True),
+        make_car(4, 'Honda', 'S800', 1966, True)]
+
+
+@pytest.fixture(params=[CarsCSV, ShardedCarsCSV])
+def db(request):
+    db = request.param()
+    db.create([dict(car) for car in CARS])
+    return db
+
+
+def ids(cars):
+    return [int(car['id']) for car in cars]
+
+
+def test_find_by_range_of_unindexed_key(db):
+    assert ids(db.find(brand_gte='F')) == [2, 3, 4]
+    assert ids(db.find(brand_gte='F', brand_lte='Fz')) == [2, 3]
+    assert ids(db.find(brand_gte='F', production_year=1966)) == [4]
+
+
+def test_find_in_indexes(db):
+    assert ids(db.find(brand='ford')) == [3]
+    assert ids(db.find(production_year_gte=1960, production_year_lte=1965)) \
+        == [3]
+    assert ids(db.find(production_year=1966, sort='-id')) == [4, 1]
+
+
+@pytest.mark.parametrize('criteria', [{'production_year_gte': 'abc'},
+                                      {'production_year': 'abc'},
+                                      {'brand_gte': 5},
+                                      {'id_gte': 'abc'}])
+def test_find_returns_none_for_bad_values(db, criteria):
+    assert db.find(**criteria) is None
+
+
+def test_pages_are_read_at_the_offsets(db, monkeypatch):
+    # the rows of the page are not parsed from the head
+    monkeypatch.setattr(CarsCSV, 'iter_cars', None)
+    assert db.count_cars() == 4
+    assert db.get_cars_page(1, 2) == [
+        {key: str(value) for key, value in car.items()} for car in CARS[1:3]]
+    assert ids(db.get_cars_page(3, 10)) == [4]
+    assert db.get_cars_page(4, 10) == []
+
+
+def test_journal_is_paged_with_the_base_file():
+    CarsCSV().create([dict(car) for car in CARS])
+    db = JournaledCarsCSV()
+    assert db.update_a_car(make_car(2, brand='Lancia'))
+    assert db.delete_a_car({'id': 3})
+    pages = db.get_cars_page(0, 2) + db.get_cars_page(2, 2)
+    assert [car['brand'] for car in pages] == ['Alfa Romeo', 'Lancia', 'Honda']
+    assert db.count_cars() == 3
+
+
+def test_journal_rejects_an_existing_id():
+    CarsCSV().create([dict(car) for car in CARS])
+    db = JournaledCarsCSV()
+    assert not db.add_new_car(make_car(2))
+    assert db.add_new_car(make_car(5))
+    assert not db.add_new_car(make_car(5))
+    assert db.delete_a_car({'id': 5})
+    assert db.add_new_car(make_car(5))
+    assert ids(db.get_cars_list()) == [1, 2, 3, 4, 5]
+
+
+def test_find_by_id_not_in_digits(db):
+    assert db.find(id='abc') == []
+
+
+# CarsCSV which waits between taking a new id and adding the row,
+# so that another process would take the same id without the lock
+class SlowCarsCSV(CarsCSV):
+    def new_id(self):
+        car_id = super().new_id()
+        time.sleep(0.005)
+        return car_id
+
+
+def add_cars_with_new_ids(count):
+    db = SlowCarsCSV()
+    for _ in range(count):
+        assert db.add_car_with_new_id(make_car(None))
+
+
+def test_new_id_follows_the_last_row():
+    db = CarsCSV()
+    db.create([make_car(1), make_car(5)])
+    assert db.new_id() == 6
+    car = make_car(None)
+    assert db.add_car_with_new_id(car)
+    assert car['id'] == 6
+    assert ids(db.get_cars_list()) == [1, 5, 6]
+
+
+def test_processes_take_different_new_ids():
+    CarsCSV().create([make_car(1)])
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=add_cars_with_new_ids, args=(20,))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+    assert ids(CarsCSV().get_cars_list()) == list(range(1, 82))
+
+
+ROWS = ('id,brand,model,production_year,convertible\r\n'
+        + ''.join('{},Fiat,"Model\r\n{}",1970,Yes\r\n'.format(car_id, car_id)
+                  for car_id in range(1, 40))
+        + '40,Fiat,500\r\n'
+        + '\r\n'
+        + '41,Fiat,500,1970,no,extra\r\n'
+        + '42,Fiat,500,19xx,no\r\n'
+        + '43,"Fiat ""Abarth""",595,1965,No\r\n')
+
+
+def test_parallel_read_matches_serial_read():
+    with open(CarsCSV.FILENAME, 'w', newline='') as csvfile:
+        csvfile.write(ROWS)
+    db = CarsCSV()
+    db.CHUNK_SIZE = 100
+    db.WORKERS = 2
+    assert len(db.split_chunks()) > 5
+    parallel = db.get_cars_list_parallel()
+    db.WORKERS = 1
+    assert parallel == db.get_cars_list()
+    assert len(parallel) == 43
+
+
+def test_read_chunk_validates_rows():
+    with open(CarsCSV.FILENAME, 'w', newline='') as csvfile:
+        csvfile.write(ROWS)
+    db = CarsCSV()
+    rows, malformed, invalid = read_chunk(db.filename, 0, len(ROWS),
+                                          db.header)
+    # the header row is invalid too
+    assert (malformed, invalid) == (2, 2)
+    assert rows[1] == ('1', 'Fiat', 'Model\r\n1', '1970', 'Yes')
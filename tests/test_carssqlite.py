@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+from dbpanel.carssqlite import CarsSQLite
+from tests.conftest import make_car
+
+
+@pytest.fixture
+def db():
+    db = CarsSQLite()
+    db.create([make_car(1), make_car(2, convertible='yes'), make_car(5)])
+    yield db
+    db.close()
+
+
+def test_new_id_follows_the_largest_id(db):
+    assert db.new_id() == 6
+    assert db.add_car_with_new_id(make_car(None))
+    assert db.select_a_car({'id': 6})['id'] == 6
+    assert db.create([])
+    assert db.new_id() == 1
+
+
+@pytest.mark.parametrize('convertible', ['maybe', '', 'truthy'])
+def test_bad_convertible_is_rejected(db, convertible):
+    assert db.add_many([make_car(3), make_car(4, convertible=convertible)]) \
+        == [True, False]
+    assert db.update_a_car(make_car(1, convertible=convertible)) is False
+    assert db.select_a_car({'id': 1})['convertible'] is False
+    assert db.add_car_with_new_id(make_car(None, convertible=convertible)) \
+        is False
+    assert db.create([make_car(9, convertible=convertible)]) is False
+    assert db.count_cars() == 4
+    assert db.find(convertible=convertible) is None
+
+
+def test_sort_ties_are_in_id_order(db):
+    assert db.add_many([make_car(4, production_year=1980),
+                        make_car(3, production_year=1980)]) == [True, True]
+    assert [car['id'] for car in db.find(sort='-production_year')] \
+        == [3, 4, 1, 2, 5]
+
+
+def test_find_text_sort_ignores_case(db):
+    assert db.add_many([make_car(3, brand='alfa'), make_car(4, brand='Zil'),
+                        make_car(6, brand='BMW')]) == [True] * 3
+    assert [car['brand'] for car in db.find(sort='brand')] \
+        == ['alfa', 'BMW', 'Fiat', 'Fiat', 'Fiat', 'Zil']
+    assert [car['id'] for car in db.find(sort=['-brand', 'id'])] \
+        == [4, 1, 2, 5, 6, 3]
+
+
+@pytest.mark.parametrize('text, ids', [
+    ('%', [3]), ('_', [4]), ('\\', [5]), ('A%B', [3]), ('500', [1, 2]),
+])
+def test_find_q_matches_wildcards_as_text(db, text, ids):
+    assert db.delete_a_car({'id': 5})
+    assert db.add_many([make_car(3, model='a%b'), make_car(4, model='a_b'),
+                        make_car(5, model='a\\b')]) == [True] * 3
+    assert [car['id'] for car in db.find(q=text)] == ids
+
+
+def test_find_convertible(db):
+    assert [car['id'] for car in db.find(convertible='YES')] == [2]
+    assert [car['id'] for car in db.find(convertible=False)] == [1, 5]
+    assert db.find(production_year='abc') is None
+
+
+# Wraps a connection to make COMMIT fail
+class FailingCommit:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, *args):
+        if sql == 'COMMIT':
+            raise sqlite3.OperationalError('disk I/O error')
+        return self.connection.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def test_transaction_is_rolled_back_if_commit_fails(db, monkeypatch):
+    connection = db.connection()
+    monkeypatch.setattr(db, 'connection', lambda: FailingCommit(connection))
+    assert db.add_new_car(make_car(3)) is False
+    assert not connection.in_transaction
+    # undo() would also undo the change of the working directory
+    monkeypatch.setattr(db, 'connection', lambda: connection)
+    assert db.select_a_car({'id': 3}) is None
+    assert db.add_new_car(make_car(3)) is True
@@ -0,0 +1,64 @@
+import pytest
+
+from dbpanel import cartable
+from dbpanel.accessor import Car
+from dbpanel.accessor import CarDataAccessor
+from dbpanel.cartable import CarTable
+from tests.conftest import make_car
+
+CARS = [make_car(1, 'Maserati', 'Ghibli', 1967, 'yes'),
+        make_car(2, 'Fiat', '500', 1957, 'no'),
+        make_car(3, 'Ford', 'Mustang', 1964, 'yes'),
+        make_car(4, 'Maserati', 'Bora', 1971, 'no'),
+        make_car(5, 'Honda', 'S800', 1966, 'yes'),
+        make_car(12, 'Fiat', '124 Spider', 1966, 'yes')]
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def table(request, monkeypatch):
+    if request.param == 'numpy':
+        monkeypatch.setattr(cartable, 'numpy', pytest.importorskip('numpy'))
+    else:
+        monkeypatch.setattr(cartable, 'numpy', None)
+    table = CarTable()
+    table.extend(Car.validate_many(CARS)[0])
+    return table
+
+
+def ids(table):
+    return [car['id'] for car in table.get_cars_list()]
+
+
+@pytest.mark.parametrize('criteria', [
+    {'brand': 'maserati'},
+    {'brand': 'Maserati', 'production_year_gte': 1970},
+    {'brand_gte': 'F', 'brand_lte': 'Fz'},
+    {'production_year_gte': '1960', 'production_year_lte': 1966},
+    {'production_year': '1966'},
+    {'production_year': '01966'},
+    {'id_gte': 3, 'convertible': True},
+    {'convertible': 'false'},
+    {'model': '500'},
+    {'q': '12'},
+    {'q': 'SPIDER'},
+    {'q': 'true'},
+])
+def test_filter_matches_find(table, criteria):
+    expected = [car['id'] for car in table.get_cars_list()
+                if CarDataAccessor.match(car, criteria)]
+    assert ids(table.filter(**criteria)) == expected
+
+
+@pytest.mark.parametrize('criteria', [{'production_year_gte': 'abc'},
+                                      {'brand_gte': 5},
+                                      {'color': 'red'}])
+def test_filter_returns_none_for_bad_criteria(table, criteria):
+    assert table.filter(**criteria) is None
+
+
+def test_filter_and_sort_are_chained(table):
+    assert ids(table.filter(convertible=True).sort(['brand', '-id'])) \
+        == [12, 3, 5, 1]
+    assert ids(table.sort('-production_year').filter(brand='Fiat')) \
+        == [12, 2]
+    assert ids(table.sort(['-convertible', 'model'])) == [12, 1, 3, 5, 2, 4]
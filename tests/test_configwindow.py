@@ -0,0 +1,42 @@
+import types
+
+import pytest
+
+from dbpanel import configwindow
+from dbpanel.configwindow import ConfigWindow
+
+
+# IntVar without Tk
+class Variable:
+    def __init__(self, master=None):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+@pytest.fixture
+def read_config(monkeypatch):
+    monkeypatch.setattr(configwindow.tk, 'IntVar', Variable)
+    panel = types.SimpleNamespace(root=None, logger=None)
+
+    def read_config(text):
+        if text is not None:
+            with open(ConfigWindow.CONFIG_FILE, 'w') as configfile:
+                configfile.write(text)
+        return ConfigWindow(panel).chosen_db_name()
+    return read_config
+
+
+@pytest.mark.parametrize('text, db_name', [
+    (None, 'json'),
+    ('[Logging]\nlevel = DEBUG\n', 'json'),
+    ('[DB Choice]\ndb = 5\n', 'sqlite'),
+    ('[DB Choice]\ndb = sqlite\n', 'json'),
+    ('[DB Choice]\ndb = 99\n', 'json'),
+])
+def test_read_config(read_config, text, db_name):
+    assert read_config(text) == db_name
@@ -0,0 +1,125 @@
+import io
+import json
+
+from dbpanel import headless
+from dbpanel.carscsv import CarsCSV
+from dbpanel.headless import BatchRunner
+from tests.conftest import make_car
+
+
+def operation(op, car=None, **fields):
+    request = dict(fields, op=op)
+    if car is not None:
+        request['car'] = car
+    return json.dumps(request) + '\n'
+
+
+# Run the lines on a csv file and return the results and the write calls
+def run(lines, monkeypatch, batch_size=BatchRunner.BATCH_SIZE):
+    db = CarsCSV()
+    db.create([make_car(1)])
+    calls = []
+    for name in ('add_many', 'update_many', 'delete_many'):
+        method = getattr(db, name)
+        monkeypatch.setattr(
+            db, name,
+            lambda cars, method=method, name=name:
+                calls.append((name, [car['id'] for car in cars]))
+                or method(cars))
+
+    output = io.StringIO()
+    runner = BatchRunner(db, output, batch_size)
+    runner.run(lines)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    return runner, results, calls
+
+
+def test_consecutive_writes_are_batched_until_the_op_changes(monkeypatch):
+    lines = [operation('add', make_car(2)),
+             operation('add', make_car(3)),
+             operation('add', make_car(4)),
+             operation('update', make_car(2, brand='Lancia')),
+             operation('update', make_car(3, brand='Lancia')),
+             operation('delete', id=4),
+             operation('add', make_car(5))]
+    runner, results, calls = run(lines, monkeypatch, batch_size=2)
+
+    assert calls == [('add_many', [2, 3]), ('add_many', [4]),
+                     ('update_many', [2, 3]), ('delete_many', [4]),
+                     ('add_many', [5])]
+    assert [(result['line'], result['op'], result['id'], result['ok'])
+            for result in results] == [
+        (1, 'add', 2, True), (2, 'add', 3, True), (3, 'add', 4, True),
+        (4, 'update', 2, True), (5, 'update', 3, True),
+        (6, 'delete', 4, True), (7, 'add', 5, True)]
+    assert (runner.succeeded, runner.failed) == (7, 0)
+    assert [car['brand'] for car in CarsCSV().get_cars_list()] == \
+        ['Fiat', 'Lancia', 'Lancia', 'Fiat']
+
+
+def test_add_without_id_gets_a_new_id(monkeypatch):
+    car = make_car(None)
+    del car['id']
+    lines = [operation('add', make_car(2)),
+             operation('add', car),
+             operation('add', make_car(4))]
+    runner, results, calls = run(lines, monkeypatch)
+
+    # the pending add is written before the new id is taken
+    assert calls == [('add_many', [2]), ('add_many', [4])]
+    assert [result['id'] for result in results] == [2, 3, 4]
+    assert all(result['ok'] for result in results)
+    assert [int(car['id']) for car in CarsCSV().get_cars_list()] == \
+        [1, 2, 3, 4]
+
+
+def test_bad_line_fails_alone(monkeypatch):
+    lines = [operation('add', make_car(2)),
+             '{"op": "add", "car": \n',
+             operation('fly', id=2),
+             operation('delete', id='two'),
+             operation('add', make_car(3, production_year='old')),
+             '\n',
+             operation('add', make_car(4))]
+    runner, results, calls = run(lines, monkeypatch)
+
+    assert [(result['line'], result['ok']) for result in results] == [
+        (1, True), (2, False), (3, False), (4, False), (5, False),
+        (7, True)]
+    assert all('error' in result for result in results[1:5])
+    assert calls == [('add_many', [2]), ('add_many', [4])]
+    assert (runner.succeeded, runner.failed) == (2, 4)
+
+
+def test_select_returns_the_car_or_fails(monkeypatch):
+    lines = [operation('select', id=1), operation('select', id=9)]
+    runner, results, calls = run(lines, monkeypatch)
+
+    assert results[0]['ok'] is True
+    assert results[0]['car']['brand'] == 'Fiat'
+    assert results[1] == {'line': 2, 'op': 'select', 'id': 9, 'ok': False}
+    assert (runner.succeeded, runner.failed) == (1, 1)
+
+
+def test_failed_write_is_reported(monkeypatch):
+    lines = [operation('add', make_car(1)), operation('delete', id=9)]
+    runner, results, calls = run(lines, monkeypatch)
+
+    assert [result['ok'] for result in results] == [False, False]
+    assert runner.failed == 2
+
+
+def test_exit_code_tells_if_an_operation_failed(monkeypatch, capsys):
+    CarsCSV().create([make_car(1)])
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        operation('add', make_car(2)) + operation('select', id=2)))
+    assert headless.main(['--headless', '--db', 'csv']) == 0
+    captured = capsys.readouterr()
+    assert [json.loads(line)['ok']
+            for line in captured.out.splitlines()] == [True, True]
+    assert '2 operations, 0 failed' in captured.err
+
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        operation('add', make_car(2)) + 'not json\n'))
+    assert headless.main(['--headless', '--db', 'csv']) == 1
+    assert '2 operations, 2 failed' in capsys.readouterr().err
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from dbpanel.carscsv import CarsCSV
+from dbpanel.journalcsv import JournaledCarsCSV
+from tests.conftest import make_car
+
+CARS = [make_car(car_id) for car_id in (1, 2, 3, 123)]
+
+
+@pytest.fixture
+def db():
+    CarsCSV().create([dict(car) for car in CARS])
+    db = JournaledCarsCSV()
+    yield db
+    db.close()
+
+
+def ids(cars):
+    return [int(car['id']) for car in cars]
+
+
+def append_to_journal(text):
+    with open('cars.csv.journal', 'a', newline='') as journal:
+        journal.write(text)
+
+
+@pytest.mark.parametrize('tail', ['delete,', 'delete,12', 'add,4,Fia'])
+def test_cut_off_entry_is_not_applied(db, tail):
+    assert db.delete_a_car({'id': 1})
+    append_to_journal(tail)
+
+    db = JournaledCarsCSV()
+    assert ids(db.get_cars_list()) == [2, 3, 123]
+    # the next entry starts at the head of a line
+    assert db.delete_a_car({'id': 2})
+    assert ids(JournaledCarsCSV().get_cars_list()) == [3, 123]
+
+
+def test_broken_entry_is_skipped(db):
+    append_to_journal('delete,x\r\nupdate,2\r\ndelete,3\r\n')
+    assert ids(JournaledCarsCSV().get_cars_list()) == [1, 2, 123]
+
+
+def test_compaction_folds_the_journal(db):
+    assert db.add_new_car(make_car(5, brand='Lancia'))
+    assert db.update_a_car(make_car(2, brand='Ford'))
+    assert db.delete_a_car({'id': 3})
+    assert db.compact()
+
+    assert not os.path.exists(db.journal_name)
+    assert not os.path.exists(db.compacting_name)
+    base = CarsCSV().get_cars_list()
+    assert ids(base) == [1, 2, 5, 123]
+    assert [car['brand'] for car in base] == ['Fiat', 'Ford', 'Lancia',
+                                               'Fiat']
+    assert JournaledCarsCSV().get_cars_list() == base
+
+
+def test_compaction_runs_in_background_over_compact_size():
+    CarsCSV().create([dict(car) for car in CARS])
+    db = JournaledCarsCSV(compact_size=100)
+    assert db.add_many([make_car(car_id) for car_id in range(10, 20)]) \
+        == [True] * 10
+    db.close()
+    assert not os.path.exists(db.compacting_name)
+    assert ids(CarsCSV().get_cars_list()) \
+        == [1, 2, 3] + list(range(10, 20)) + [123]
+
+
+def test_compacting_journal_left_by_a_crash_is_applied(db):
+    assert db.delete_a_car({'id': 1})
+    assert db.add_new_car(make_car(7))
+    # stopped after the journal was renamed, before the base was replaced
+    os.replace(db.journal_name, db.compacting_name)
+    assert db.update_a_car(make_car(7, brand='Lancia'))
+
+    db = JournaledCarsCSV()
+    assert ids(db.get_cars_list()) == [2, 3, 7, 123]
+    assert db.select_a_car({'id': 7})['brand'] == 'Lancia'
+
+    # the compacting journal is folded first, the newer journal is kept
+    assert db.compact()
+    assert not os.path.exists(db.compacting_name)
+    assert ids(CarsCSV().get_cars_list()) == [2, 3, 7, 123]
+    db = JournaledCarsCSV()
+    assert db.select_a_car({'id': 7})['brand'] == 'Lancia'
+    assert db.compact()
+    assert not os.path.exists(db.journal_name)
+    assert CarsCSV().select_a_car({'id': 7})['brand'] == 'Lancia'
+
+
+def test_new_id_follows_the_largest_id_without_reading_the_rows(
+        db, monkeypatch):
+    monkeypatch.setattr(db, 'iter_cars', None)
+    assert db.new_id() == 124
+    assert db.add_new_car(make_car(200))
+    assert db.delete_a_car({'id': 200})
+    assert db.new_id() == 201
+    car = make_car(None)
+    assert db.add_car_with_new_id(car)
+    assert car['id'] == 201
+
+    # read again from the base file and the journal
+    assert JournaledCarsCSV().new_id() == 202
+    assert db.compact()
+    assert JournaledCarsCSV().new_id() == 202
+    assert db.create([make_car(5)])
+    assert db.new_id() == 6
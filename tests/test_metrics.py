@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from dbpanel.carscsv import CarsCSV
+from dbpanel.metrics import MeteredAccessor
+from dbpanel.metrics import Metrics
+from tests.conftest import make_car
+
+
+def test_latencies_are_counted_in_histogram_and_percentiles():
+    metrics = Metrics()
+    for milliseconds in range(1, 101):
+        metrics.record('db.find', milliseconds / 1000)
+    metrics.record('db.find', 20, failed=True)
+
+    operation = metrics.snapshot()['db.find']
+    assert operation['count'] == 101
+    assert operation['errors'] == 1
+    assert operation['max_ms'] == pytest.approx(20000)
+    assert operation['p50_ms'] == pytest.approx(51)
+    assert operation['p95_ms'] == pytest.approx(96)
+    assert operation['histogram'] == {'<=1': 1, '<=2.5': 1, '<=5': 3,
+                                      '<=10': 5, '<=25': 15, '<=50': 25,
+                                      '<=100': 50, '>10000': 1}
+    assert metrics.percentile('db.find', 50) == pytest.approx(51)
+    assert metrics.percentile('db.count_cars', 50) is None
+
+
+def test_timer_records_exception_as_failed():
+    metrics = Metrics()
+    with metrics.timer('load'):
+        pass
+    with pytest.raises(KeyError):
+        with metrics.timer('load'):
+            raise KeyError('id')
+    assert metrics.snapshot()['load']['count'] == 2
+    assert metrics.snapshot()['load']['errors'] == 1
+    assert metrics.last[0] == 'load' and metrics.last[2] is True
+
+
+def test_dump_writes_snapshot():
+    metrics = Metrics()
+    metrics.record('first_paint', 0.5)
+    assert metrics.dump('metrics.json')
+    with open('metrics.json') as metrics_file:
+        dumped = json.load(metrics_file)
+    assert dumped['operations'] == json.loads(json.dumps(metrics.snapshot()))
+    assert not metrics.dump('no_such_directory/metrics.json')
+
+
+def test_status_shows_last_operation():
+    metrics = Metrics()
+    assert metrics.status() is None
+    metrics.record('db.find', 0.002)
+    metrics.record('db.find', 0.004)
+    assert metrics.status() \
+        == 'db.find 4.0 ms    p50 4.0 ms    p95 4.0 ms'
+    metrics.record('db.add_many', 0.010, failed=2)
+    assert metrics.status() \
+        == 'db.add_many 2 failed 10.0 ms    p50 10.0 ms    p95 10.0 ms'
+    metrics.record('db.find', 0.001, failed=True)
+    assert metrics.status().startswith('db.find failed 1.0 ms')
+
+
+def errors(metrics, name):
+    return metrics.snapshot()[name]['errors']
+
+
+def test_metered_accessor_counts_only_failures():
+    CarsCSV().create([make_car(1), make_car(2)])
+    metrics = Metrics()
+    db = MeteredAccessor(CarsCSV(), metrics)
+
+    # a change refused for the data and a select miss are not errors
+    assert db.add_new_car(make_car(1)) is False
+    assert db.delete_a_car({'id': 9}) is False
+    assert db.select_a_car({'id': 9}) is None
+    assert db.add_many([make_car(3), make_car(1), make_car(2)]) \
+        == [True, False, False]
+    assert db.find(production_year='abc') is None
+    with pytest.raises(ValueError):
+        db.select_a_car({'id': 'abc'})
+
+    assert errors(metrics, 'db.add_new_car') == 0
+    assert errors(metrics, 'db.delete_a_car') == 0
+    assert errors(metrics, 'db.add_many') == 2
+    assert errors(metrics, 'db.find') == 1
+    snapshot = metrics.snapshot()['db.select_a_car']
+    assert (snapshot['count'], snapshot['errors']) == (2, 1)
+    assert db.count_cars() == 3
+    assert errors(metrics, 'db.count_cars') == 0
@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+from dbpanel.carscsv import CarsCSV
+from dbpanel.carssqlite import CarsSQLite
+from dbpanel.migrate import Migration
+from dbpanel.migrate import MigrationError
+from dbpanel.migrate import main
+from tests.conftest import make_car
+
+
+def make_source(count, invalid=()):
+    CarsCSV().create([make_car(car_id, production_year='abc')
+                      if car_id in invalid else make_car(car_id)
+                      for car_id in range(1, count + 1)])
+
+
+def target_ids():
+    db = CarsSQLite()
+    try:
+        return [car['id'] for car in db.get_cars_list()]
+    finally:
+        db.close()
+
+
+def read_checkpoint():
+    with open(Migration.CHECKPOINT_FILE) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def test_migration_resumes_after_interruption(monkeypatch):
+    make_source(10)
+    migration = Migration('csv', 'sqlite', chunk_size=3)
+    add_many = migration.target.add_many
+    calls = []
+
+    def interrupted(cars_data, all_or_nothing=False):
+        calls.append(cars_data)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return add_many(cars_data, all_or_nothing)
+
+    monkeypatch.setattr(migration.target, 'add_many', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        migration.run()
+    # ids are kept as the source gives
+    assert read_checkpoint()['last_id'] == '6'
+    assert target_ids() == [1, 2, 3, 4, 5, 6]
+
+    migration = Migration('csv', 'sqlite', chunk_size=3)
+    migration.run()
+    assert (migration.copied, migration.failed) == (10, 0)
+    assert target_ids() == list(range(1, 11))
+
+
+def test_checkpoint_stays_before_failed_cars():
+    make_source(10, invalid=(5, 8))
+    migration = Migration('csv', 'sqlite', chunk_size=3)
+    migration.run()
+    assert migration.failed_ids == ['5', '8']
+    checkpoint = read_checkpoint()
+    assert checkpoint['last_id'] == '4'
+    assert (checkpoint['copied'], checkpoint['failed']) == (4, 0)
+    assert checkpoint['failed_ids'] == ['5', '8']
+    assert target_ids() == [1, 2, 3, 4, 6, 7, 9, 10]
+
+    # The failed cars are fixed in the source, and copied from there
+    CarsCSV().update_many([make_car(5), make_car(8)])
+    migration = Migration('csv', 'sqlite', chunk_size=3)
+    migration.run()
+    assert (migration.copied, migration.failed) == (10, 0)
+    assert target_ids() == list(range(1, 11))
+
+
+def test_target_with_cars_is_not_written(monkeypatch):
+    make_source(3)
+    CarsSQLite().create([make_car(7)])
+    with pytest.raises(MigrationError):
+        Migration('csv', 'sqlite').run()
+    assert target_ids() == [7]
+
+    Migration('csv', 'sqlite').run(force=True)
+    assert target_ids() == [1, 2, 3, 7]
+    Migration('csv', 'sqlite').run(restart=True)
+    assert target_ids() == [1, 2, 3]
+
+
+def test_source_is_not_the_target():
+    with pytest.raises(MigrationError):
+        Migration('csv', 'csv')
+
+
+def test_source_page_which_failed_to_load_keeps_the_checkpoint(
+        monkeypatch):
+    make_source(10)
+    migration = Migration('csv', 'sqlite', chunk_size=3)
+    iter_cars = migration.source.iter_cars
+
+    # the pages after the second one fail to load, ending the cars
+    def cut(page_size, start_after_id=None):
+        cars = iter_cars(page_size, start_after_id)
+        for _ in range(6):
+            yield next(cars)
+
+    monkeypatch.setattr(migration.source, 'iter_cars', cut)
+    with pytest.raises(MigrationError):
+        migration.run()
+    assert read_checkpoint()['last_id'] == '6'
+
+    migration = Migration('csv', 'sqlite', chunk_size=3)
+    migration.run()
+    assert (migration.copied, migration.failed) == (10, 0)
+    assert target_ids() == list(range(1, 11))
+
+
+def test_main_exits_with_1_when_cars_failed():
+    make_source(3, invalid=(2,))
+    with pytest.raises(SystemExit) as exit_info:
+        main(['--from', 'csv', '--to', 'sqlite'])
+    assert exit_info.value.code == 1
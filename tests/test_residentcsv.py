@@ -0,0 +1,103 @@
+import time
+
+from dbpanel.carscsv import CarsCSV
+from dbpanel.residentcsv import ResidentCarsCSV
+from tests.conftest import make_car
+
+
+def test_new_id_follows_the_largest_id():
+    db = ResidentCarsCSV()
+    db.create([make_car(car_id) for car_id in (1, 2, 4, 7)])
+    db.load()
+    assert db.new_id() == 8
+    assert db.delete_a_car({'id': 1})
+    assert db.new_id() == 8
+    assert db.add_car_with_new_id(make_car(None))
+    assert db.add_car_with_new_id(make_car(None))
+    assert db.ids == [2, 4, 7, 8, 9]
+
+
+def test_sparse_id_does_not_allocate_the_gap():
+    db = ResidentCarsCSV()
+    started = time.perf_counter()
+    assert db.add_new_car(make_car(10 ** 9))
+    assert db.new_id() == 10 ** 9 + 1
+    db.load()
+    assert db.new_id() == 10 ** 9 + 1
+    assert time.perf_counter() - started < 1.0
+
+
+def read_file_ids():
+    return [int(car['id']) for car in CarsCSV().get_cars_list()]
+
+
+def test_flush_policy_is_read_from_ini():
+    with open('dbpanel.ini', 'w') as config_file:
+        config_file.write('[csv-mem]\n'
+                          'flush_policy = debounced\n'
+                          'flush_delay = 0.5\n')
+    db = ResidentCarsCSV()
+    assert db.flush_policy == ResidentCarsCSV.FLUSH_DEBOUNCED
+    assert db.flush_delay == 0.5
+
+    db = ResidentCarsCSV(flush_policy=ResidentCarsCSV.FLUSH_ON_EXIT)
+    assert db.flush_policy == ResidentCarsCSV.FLUSH_ON_EXIT
+    assert db.flush_delay == 0.5
+
+
+def test_wrong_ini_values_are_the_defaults():
+    with open('dbpanel.ini', 'w') as config_file:
+        config_file.write('[csv-mem]\n'
+                          'flush_policy = sometimes\n'
+                          'flush_delay = soon\n')
+    db = ResidentCarsCSV()
+    assert db.flush_policy == ResidentCarsCSV.FLUSH_IMMEDIATE
+    assert db.flush_delay == ResidentCarsCSV.FLUSH_DELAY
+
+
+def test_debounced_changes_are_written_once_after_the_delay(monkeypatch):
+    db = ResidentCarsCSV(flush_policy=ResidentCarsCSV.FLUSH_DEBOUNCED,
+                         flush_delay=0.2)
+    db.create([make_car(1)])
+    db.load()
+    writes = []
+    create = db.create
+    monkeypatch.setattr(db, 'create',
+                        lambda cars: writes.append(len(cars)) or create(cars))
+
+    assert db.add_new_car(make_car(2))
+    assert db.add_new_car(make_car(3))
+    assert db.delete_a_car({'id': 1})
+    assert read_file_ids() == [1]
+
+    time.sleep(0.6)
+    assert read_file_ids() == [2, 3]
+    assert writes == [2]
+    assert not db.dirty
+
+
+def test_on_exit_changes_are_written_by_close():
+    db = ResidentCarsCSV(flush_policy=ResidentCarsCSV.FLUSH_ON_EXIT)
+    db.create([make_car(1)])
+    db.load()
+    assert db.add_new_car(make_car(2))
+    assert db.update_a_car(make_car(1, brand='Lancia'))
+    time.sleep(0.2)
+    assert read_file_ids() == [1]
+
+    db.close()
+    assert read_file_ids() == [1, 2]
+    assert CarsCSV().select_a_car({'id': 1})['brand'] == 'Lancia'
+
+
+def test_failed_write_is_reported(monkeypatch):
+    db = ResidentCarsCSV(flush_policy=ResidentCarsCSV.FLUSH_IMMEDIATE)
+    db.create([make_car(1)])
+    db.load()
+    monkeypatch.setattr(db, 'create', lambda cars: False)
+    assert not db.add_new_car(make_car(2))
+    assert not db.update_a_car(make_car(1, brand='Lancia'))
+    assert not db.delete_a_car({'id': 1})
+    assert db.change_many('add', [make_car(3), make_car(4)],
+                          False) == [False, False]
+    assert db.dirty
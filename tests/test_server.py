@@ -0,0 +1,125 @@
+import http.client
+import json
+import socket
+import time
+
+import pytest
+
+from dbpanel.carsdb import CarsDB
+from dbpanel.server import CarsServer
+from dbpanel.server import CarStore
+from dbpanel.server import Snapshotter
+from dbpanel.server import load_cars
+from tests.conftest import make_car
+
+
+@pytest.fixture
+def server():
+    store = CarStore([make_car(1), make_car(2, 'Ford', 'T', 1950, True)])
+    snapshotter = Snapshotter(store, 'cars.json', interval=60)
+    server = CarsServer(('localhost', 0), store, snapshotter, threads=4)
+    server.start()
+    yield server
+    if not server.closing:
+        server.close()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection('localhost', server.port,
+                                            timeout=5)
+    connection.request(method, path,
+                       body=None if body is None else json.dumps(body),
+                       headers=headers or {})
+    reply = connection.getresponse()
+    data = reply.read()
+    connection.close()
+    return reply, json.loads(data) if data else None
+
+
+def test_carsdb_round_trip(server):
+    db = CarsDB(port=server.port)
+    assert db.count_cars() == 2
+    assert db.add_new_car(make_car(5, 'Honda', 'S800', 1966))
+    assert db.select_a_car({'id': 5})['model'] == 'S800'
+    assert db.update_a_car(make_car(5, 'Honda', 'S600', 1964))
+    assert db.find(brand='honda') == [make_car(5, 'Honda', 'S600', 1964)]
+    assert [car['id'] for car in db.find(sort='-production_year')] \
+        == [1, 5, 2]
+    assert [car['id'] for car in db.get_cars_page(1, 2)] == [2, 5]
+    assert db.delete_a_car({'id': 5})
+    assert not db.delete_a_car({'id': 5})
+    db.close()
+
+
+def test_bad_values_are_rejected(server):
+    for path in ('/cars?id=x', '/cars?_start=x', '/cars?_limit=x',
+                 '/cars?production_year_gte=x'):
+        reply, _ = request(server, 'GET', path)
+        assert reply.status == 400, path
+    reply, _ = request(server, 'POST', '/cars', dict(make_car('7')))
+    assert reply.status == 400
+    reply, _ = request(server, 'GET', '/cars')
+    assert reply.status == 200
+
+
+def test_etag_differs_after_restart(server):
+    reply, _ = request(server, 'GET', '/cars?_limit=1')
+    etag = reply.getheader('ETag')
+    reply, _ = request(server, 'GET', '/cars?_limit=1',
+                       headers={'If-None-Match': etag})
+    assert reply.status == 304
+
+    restarted = CarsServer(('localhost', 0), CarStore(server.store.snapshot()[0]))
+    restarted.start()
+    try:
+        reply, _ = request(restarted, 'GET', '/cars?_limit=1',
+                           headers={'If-None-Match': etag})
+        assert reply.status == 200
+    finally:
+        restarted.close()
+
+
+def test_idle_connections_dont_block_others(server):
+    # More idle keep-alive connections than the threads of the pool
+    idle = []
+    for _ in range(8):
+        connection = http.client.HTTPConnection('localhost', server.port)
+        connection.request('GET', '/')
+        connection.getresponse().read()
+        idle.append(connection)
+
+    started = time.perf_counter()
+    reply, _ = request(server, 'GET', '/cars/1')
+    assert reply.status == 200
+    assert time.perf_counter() - started < 2
+    for connection in idle:
+        connection.close()
+
+
+def test_close_saves_every_write(server):
+    # The connection is kept alive across the close
+    connection = http.client.HTTPConnection('localhost', server.port,
+                                            timeout=5)
+    connection.request('POST', '/cars', json.dumps(make_car(3)))
+    assert connection.getresponse().read()
+
+    started = time.perf_counter()
+    server.close()
+    assert time.perf_counter() - started < 2
+    with pytest.raises((OSError, http.client.HTTPException)):
+        connection.request('POST', '/cars', json.dumps(make_car(4)))
+        connection.getresponse()
+
+    assert [car['id'] for car in load_cars('cars.json')] == [1, 2, 3]
+    with pytest.raises(OSError):
+        socket.create_connection(('localhost', server.port), timeout=1)
+
+
+def test_pool_connections_are_not_dropped(server):
+    db = CarsDB(port=server.port)
+    started = time.perf_counter()
+    assert db.add_many([make_car(car_id) for car_id in range(10, 110)]) \
+        == [True] * 100
+    # a dropped connection is sent again after a second
+    assert time.perf_counter() - started < 0.8
+    db.close()
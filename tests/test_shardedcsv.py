@@ -0,0 +1,59 @@
+import pytest
+
+from dbpanel.shardedcsv import ShardedCarsCSV
+from tests.conftest import make_car
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(ShardedCarsCSV, 'MAX_ROWS', 10)
+    monkeypatch.setattr(ShardedCarsCSV, 'MIN_ROWS', 3)
+    return ShardedCarsCSV()
+
+
+# The manifest agrees with the files, and every id is in its owner
+def check_shards(db):
+    for index, shard in enumerate(db.shards):
+        ids = [int(car['id'])
+               for car in db.accessor(shard).get_cars_list()]
+        assert len(ids) == shard['rows']
+        assert all(db.shard_index(car_id) == index for car_id in ids)
+    assert db.shards[0]['low'] == 1
+
+
+def test_bulk_add_is_split_into_shards_under_max_rows(db):
+    assert all(db.add_many([make_car(car_id)
+                            for car_id in range(1, 25)]))
+    assert [shard['rows'] for shard in db.shards] == [6, 6, 6, 6]
+    check_shards(db)
+
+    assert all(db.add_many([make_car(car_id)
+                            for car_id in range(100, 131)]))
+    assert all(5 <= shard['rows'] <= 10 for shard in db.shards)
+    assert db.count_cars() == 55
+    check_shards(db)
+    assert [int(car['id']) for car in db.iter_cars()] == \
+        list(range(1, 25)) + list(range(100, 131))
+    assert db.select_a_car({'id': 130})['id'] == 130
+
+
+def test_shrunk_shards_are_merged(db):
+    assert all(db.add_many([make_car(car_id)
+                            for car_id in range(1, 25)]))
+    assert all(db.delete_many([{'id': car_id}
+                               for car_id in range(2, 24)]))
+    assert [shard['rows'] for shard in db.shards] == [2]
+    check_shards(db)
+    assert [int(car['id']) for car in db.iter_cars()] == [1, 24]
+    assert sorted(db.accessors) == [db.shards[0]['file']]
+
+
+@pytest.mark.parametrize('car_id', ['abc', None, ''])
+def test_bad_id_fails(db, car_id):
+    assert db.add_many([make_car(1), make_car(car_id)]) == [True, False]
+    assert db.add_many([make_car(2), make_car(car_id)],
+                       all_or_nothing=True) == [False, False]
+    assert db.update_a_car(make_car(car_id)) is False
+    assert db.delete_a_car({'id': car_id}) is False
+    assert db.select_a_car({'id': car_id}) is None
+    assert db.count_cars() == 1
@@ -0,0 +1,56 @@
+import time
+
+from dbpanel.worker import Worker
+
+
+# Root which runs the after callbacks when run() is called, without Tk
+class Root:
+    def __init__(self):
+        self.calls = {}
+        self.next_id = 0
+
+    def after(self, milliseconds, function):
+        self.next_id += 1
+        self.calls[self.next_id] = function
+        return self.next_id
+
+    def after_cancel(self, call_id):
+        self.calls.pop(call_id, None)
+
+    # Run the callbacks until none is left
+    def run(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while self.calls and time.monotonic() < deadline:
+            call_id = min(self.calls)
+            self.calls.pop(call_id)()
+            time.sleep(0.001)
+
+
+def fail():
+    raise OSError('connection refused')
+
+
+def test_callback_gets_none_when_the_call_raises():
+    root = Root()
+    busy = []
+    results = []
+    worker = Worker(root, on_busy=busy.append)
+    worker.submit(fail, callback=results.append)
+    worker.submit(len, 'abc', callback=results.append)
+    root.run()
+    worker.shutdown()
+    assert results == [None, 3]
+    assert busy == [True, False]
+
+
+def test_raising_callback_does_not_stop_polling():
+    root = Root()
+    busy = []
+    results = []
+    worker = Worker(root, on_busy=busy.append)
+    worker.submit(len, 'a', callback=lambda result: 1 / 0)
+    worker.submit(len, 'ab', callback=results.append)
+    root.run()
+    worker.shutdown()
+    assert results == [2]
+    assert busy == [True, False]